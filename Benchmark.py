@@ -0,0 +1,913 @@
+import base64
+import copy
+import datetime
+import gc
+import io
+import json
+import os
+import resource
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import warnings
+import zlib
+import numpy as np
+import pandas as pd
+import plotly
+import plotly.express as px
+import ColumnStats
+import CompositionParser
+import ConnectionPool
+import Export
+import Figures
+import IngestJobs
+import RenderService
+import Migrations
+import Pipeline
+from Pagination import KeysetPager
+
+REPEATS = 20
+SOURCE_DB = os.path.abspath(Pipeline.DEFAULT_DB)
+
+
+def use_database_copy():
+    # Benchmarks run inside a scratch directory holding a copy of Database.db,
+    # so the relative DEFAULT_DB path points at the copy and the real file is never modified
+    Pipeline.snapshot.wait()
+    ConnectionPool.close_all()
+    Pipeline.result_cache.bump()
+    Pipeline.catalog.invalidate()
+    Pipeline.column_stats.invalidate()
+    Pipeline.snapshot.close()
+    directory = tempfile.mkdtemp(prefix='clio-bench-')
+    shutil.copyfile(SOURCE_DB, os.path.join(directory, Pipeline.DEFAULT_DB))
+    os.chdir(directory)
+    return directory
+
+
+def timed(function, repeats=REPEATS):
+    # Returns the best and mean wall time of function() in milliseconds
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return min(times), sum(times) / len(times)
+
+
+def report(name, before, after):
+    print(f"{name}: before best {before[0]:.2f} ms, mean {before[1]:.2f} ms | "
+          f"after best {after[0]:.2f} ms, mean {after[1]:.2f} ms | speedup {before[1] / after[1]:.1f}x")
+
+
+def all_options():
+    # A "Show Table" click with every checkbox on the form selected
+    options = {}
+    for category in Pipeline.get_choices():
+        options[category['Title']] = {Pipeline.LOGIC: 'or'}
+        for variable in category['Options']:
+            if variable != 'CompositionID':
+                options[category['Title']][variable] = {'min': None, 'max': None}
+    return options
+
+
+def legacy_get_data_from_database(query, db_file=None, params=None):
+    # The original read path: a new connection for every query
+    conn = sqlite3.connect(db_file or Pipeline.DEFAULT_DB)
+    try:
+        return pd.read_sql(query, conn, params=params)
+    finally:
+        conn.close()
+
+
+def benchmark_connection_pool():
+    use_database_copy()
+    options = all_options()
+    pooled = Pipeline.get_data_from_database
+    Pipeline.get_data_from_database = legacy_get_data_from_database
+    try:
+        before = timed(lambda: Pipeline.generate_df_legacy(options))
+    finally:
+        Pipeline.get_data_from_database = pooled
+    after = timed(lambda: Pipeline.generate_df_legacy(options))
+    report('generate_df (2N+1 queries) latency, new connection per query vs pooled connection', before, after)
+    ConnectionPool.close_all()
+
+
+def check_connection_initializers(threads=4):
+    # Threads opening a database for the first time wait for its initializers, and a failed
+    # initializer runs again on the next connection
+    use_database_copy()
+    db_file = 'initializers.db'
+    calls = []
+
+    def initializer(conn):
+        calls.append(threading.get_ident())
+        if len(calls) == 1:
+            raise sqlite3.OperationalError('first run fails')
+        time.sleep(0.2)
+        conn.execute("CREATE TABLE IF NOT EXISTS ready (x)")
+
+    def reader():
+        counts.append(ConnectionPool.get_connection(db_file).execute("SELECT COUNT(*) FROM ready").fetchone()[0])
+        ConnectionPool.close_thread_connections()
+
+    ConnectionPool.register_initializer(initializer)
+    try:
+        try:
+            ConnectionPool.get_connection(db_file)
+            raise AssertionError('the initializer error was swallowed')
+        except sqlite3.OperationalError:
+            pass
+        counts = []
+        workers = [threading.Thread(target=reader) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        assert counts == [0] * threads and len(calls) == 2
+    finally:
+        ConnectionPool._initializers.remove(initializer)
+        ConnectionPool.close_all()
+    print(f"Connection initializers: failed run retried, {threads} threads waited for the second run")
+
+
+def synthetic_compositions(count, seed=0):
+    # check_validity style compositions with two solvents and one salt each
+    random = np.random.default_rng(seed)
+    solvents = ['DMC', 'EA', 'EC', 'EMC']
+    compositions = []
+    for i in range(count):
+        first, second = random.choice(len(solvents), 2, replace=False)
+        percentage = float(random.integers(1, 100))
+        compositions.append({
+            'Solvents': {'solvent': [solvents[first], solvents[second]], 'percentage': [percentage, 100 - percentage]},
+            'Salts': {'salt': ['LiPF6'], 'molality': [float(random.uniform(0.1, 3))]},
+            Pipeline.MAIN_NAME: {'Density': float(random.uniform(0.9, 1.4)), 'Conductivity': float(random.uniform(1, 20)),
+                                 'Viscosity': float(random.uniform(1, 5)), 'Mass': None, 'Volume': None,
+                                 'Temperature': float(random.uniform(10, 40)), 'Date': 19428 + i % 365, 'Trial': i},
+        })
+    return compositions
+
+
+def table_counts():
+    return [Pipeline.get_data_from_database(f"SELECT COUNT(*) AS n FROM {table}")['n'][0]
+            for table in [Pipeline.MAIN_NAME, 'Solvents', 'Salts']]
+
+
+def benchmark_bulk_ingest(count=5000):
+    compositions = synthetic_compositions(count)
+    use_database_copy()
+    start = time.perf_counter()
+    Pipeline.edit_database(Pipeline.generate_edit_queries(compositions))
+    before = time.perf_counter() - start
+    legacy_counts = table_counts()
+    use_database_copy()
+    start = time.perf_counter()
+    Pipeline.insert_new_data_bulk(compositions)
+    after = time.perf_counter() - start
+    assert table_counts() == legacy_counts
+    print(f"insert_new_data_bulk with {count} rows: per-row queries {count / before:.0f} rows/s | "
+          f"executemany batches {count / after:.0f} rows/s | speedup {before / after:.1f}x")
+    ConnectionPool.close_all()
+
+
+def synthetic_upload(count, seed=0):
+    # An uploaded CSV as parse_contents reads it, with a share of invalid cells
+    random = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'Density': random.uniform(-0.1, 2, count), 'Conductivity': random.uniform(0, 20, count),
+        'Viscosity': random.uniform(0, 5, count), 'Mass': np.nan, 'Volume': np.nan,
+        'Temperature': random.integers(-300, 50, count),
+        'CompositionID': random.choice(['DMC_EC|50_50|LiPF6|1', 'EC|100|LiPF6|1.5', 'EC|90|LiPF6|1', 'bad'], count),
+        'Date': random.choice(['1/2/2024', '2024-03-04', '01/05/24', '13/40/2020'], count),
+        'Trial': random.integers(-1, 5, count)})
+    return pd.read_csv(io.StringIO(df.to_csv(index=False)))[Pipeline.ALL_INPUT['Property']]
+
+
+def same_tables(left, right):
+    # Compares ingest tables as JSON so NaN cells compare equal
+    def normalize(tables):
+        main_columns, ids, main_rows, associations = tables
+        return json.dumps([main_columns, [current.hex() for current in ids], main_rows,
+                           {table: [columns, [int(owner) for owner in owners], rows]
+                            for table, (columns, owners, rows) in associations.items()}])
+    return normalize(left) == normalize(right)
+
+
+def benchmark_batch_validation(count=100000):
+    df = synthetic_upload(count)
+    start = time.perf_counter()
+    compositions = []
+    errors = {}
+    for index, row in df.iterrows():
+        composition = Pipeline.check_validity(tuple(row))
+        if isinstance(composition, str):
+            errors[index] = composition
+        else:
+            compositions.append(composition)
+    before = time.perf_counter() - start
+    start = time.perf_counter()
+    tables, batch_errors = Pipeline.check_validity_batch(df)
+    after = time.perf_counter() - start
+    assert batch_errors.to_dict() == errors
+    assert same_tables(tables, Pipeline.group_by_table(compositions, Pipeline.MAIN_NAME, Pipeline.hash_datapoint))
+    print(f"Validating {count} rows: check_validity per row {before:.2f} s | "
+          f"check_validity_batch {after:.2f} s | speedup {before / after:.1f}x")
+    # Columns pandas reads as float or text must fail the same rows with the same messages
+    rows = synthetic_upload(12)
+    for column, cells in [('Trial', [3.0, 2.5, np.nan, -1.0]), ('Trial', [1, 2, 3, np.nan]),
+                          ('Trial', ['3', 'x', 4, np.nan]), ('Density', ['1.1', 'x', 1.2, np.nan])]:
+        variant = rows.copy()
+        variant[column] = (cells * 3)[:len(variant)]
+        expected = {}
+        for index, row in variant.iterrows():
+            composition = Pipeline.check_validity(tuple(row))
+            if isinstance(composition, str):
+                expected[index] = composition
+        assert Pipeline.check_validity_batch(variant)[1].to_dict() == expected, (column, cells)
+    # Molalities are taken as given, like before the parser was cached
+    assert CompositionParser.parse_composition_id('EC|100|LiPF6|0')[1] == (('LiPF6',), (0.0,))
+    print(f"Composition ID cache: {CompositionParser.cache_info()}")
+
+
+def check_query_plans():
+    # Every filter generate_df runs and every get_choices lookup must be answered from an index
+    use_database_copy()
+    conn = ConnectionPool.get_connection(Pipeline.DEFAULT_DB)
+    assert Migrations.schema_version(conn) == Migrations.SCHEMA_VERSION
+    Pipeline.get_choices()
+    queries = ["SELECT DISTINCT solvent FROM Solvents", "SELECT DISTINCT salt FROM Salts"]
+    for table, variable in [('Solvents', 'DMC'), ('Salts', 'LiPF6'), (Pipeline.MAIN_NAME, 'Temperature'),
+                            (Pipeline.MAIN_NAME, 'Density'), (Pipeline.MAIN_NAME, 'Date')]:
+        queries += [Pipeline.generate_query(table, variable, 1, 50), Pipeline.generate_query(table, variable, 1),
+                    Pipeline.generate_query(table, variable, None, 50)]
+    queries.append(Pipeline.generate_query('Solvents', 'DMC'))
+    for query in queries:
+        plan = Migrations.explain(conn, query)
+        assert all('USING COVERING INDEX' in step for step in plan), (query, plan)
+    print(f"Query plans: all {len(queries)} filter queries use a covering index")
+    ConnectionPool.close_all()
+
+
+def option_variants():
+    # Filter forms covering and/or logic, one-sided and two-sided bounds and empty categories
+    variants = [all_options()]
+    anded = copy.deepcopy(variants[0])
+    for category in anded.values():
+        category[Pipeline.LOGIC] = 'and'
+    variants.append(anded)
+    variants.append({
+        Pipeline.DEPENDENT_VARIABLE: {Pipeline.LOGIC: 'and', 'Density': {'min': 1.18, 'max': None}, 'Viscosity': {'min': None, 'max': 2.65}},
+        Pipeline.INDEPENDENT_VARIABLE: {Pipeline.LOGIC: 'or', 'Temperature': {'min': 20, 'max': 30}, 'Date': {'min': None, 'max': None}},
+        'Solvents': {Pipeline.LOGIC: 'and', 'DMC': {'min': 40, 'max': 60}, 'EC': {'min': None, 'max': None}},
+        'Salts': {Pipeline.LOGIC: 'or'}})
+    variants.append({
+        Pipeline.DEPENDENT_VARIABLE: {Pipeline.LOGIC: 'or', 'Conductivity': {'min': 15.53, 'max': None}},
+        'Solvents': {Pipeline.LOGIC: 'or', 'EA': {'min': None, 'max': 25}, 'EMC': {'min': 10, 'max': None}},
+        'Salts': {Pipeline.LOGIC: 'or', 'LiPF6': {'min': None, 'max': None}}})
+    return variants
+
+
+def check_generate_df(variants):
+    # The compiled query must return exactly what the merge based generate_df did
+    for options in variants:
+        pd.testing.assert_frame_equal(Pipeline.query_df(copy.deepcopy(options)),
+                                      Pipeline.generate_df_legacy(copy.deepcopy(options)))
+
+
+def benchmark_query_compiler():
+    use_database_copy()
+    variants = option_variants()
+    check_generate_df(variants)
+    print(f"generate_df: compiled query matches the merge based version on {len(variants)} filter forms")
+    options = variants[0]
+    before = timed(lambda: Pipeline.generate_df_legacy(options))
+    after = timed(lambda: Pipeline.query_df(options))
+    report('generate_df latency, one query per variable and merges vs one compiled query', before, after)
+    ConnectionPool.close_all()
+
+
+def benchmark_result_cache():
+    use_database_copy()
+    Pipeline.result_cache.bump()
+    variants = option_variants()
+    before = timed(lambda: Pipeline.query_df(variants[0]))
+    first = Pipeline.generate_df(variants[0])
+    after = timed(lambda: Pipeline.generate_df(variants[0]))
+    report('generate_df latency, uncached vs cached', before, after)
+    # A write must invalidate: the new experiment shows up in the next result
+    Pipeline.insert_new_data_bulk(synthetic_compositions(1))
+    assert len(Pipeline.generate_df(variants[0])) == len(first) + 1
+    Pipeline.insert_new_data_bulk([dict(synthetic_compositions(1, seed=1)[0], Solvents={'solvent': ['PC'], 'percentage': [100.0]})])
+    assert 'PC' in Pipeline.get_choices()[2]['Options']
+    for options in variants:
+        Pipeline.generate_df(options)
+        Pipeline.generate_df(options)
+    print(f"Result cache: {Pipeline.result_cache.stats()}")
+    ConnectionPool.close_all()
+
+
+JOIN_QUERY = ("SELECT COUNT(*), SUM(s.percentage), SUM(t.molality) FROM experiments e "
+              "JOIN Solvents s ON s.ID = e.ID JOIN Salts t ON t.ID = e.ID")
+
+
+def database_size(conn):
+    conn.execute("VACUUM")
+    return os.path.getsize(Pipeline.DEFAULT_DB)
+
+
+def benchmark_integer_ids(count=50000):
+    # Builds a copy at schema version 1 (32 byte hash IDs in every table) holding count more
+    # experiments, then migrates it to integer IDs. The pool isn't used so nothing migrates early.
+    use_database_copy()
+    conn = sqlite3.connect(Pipeline.DEFAULT_DB, isolation_level=None)
+    conn.execute("BEGIN")
+    Migrations.MIGRATIONS[0](conn)
+    conn.execute("PRAGMA user_version = 1")
+    main_columns, ids, main_rows, associations = Pipeline.group_by_table(
+        synthetic_compositions(count), Pipeline.MAIN_NAME, Pipeline.hash_datapoint)
+    conn.executemany(f"INSERT OR REPLACE INTO experiments (ID, {', '.join(main_columns)}) VALUES ({', '.join('?' * (len(main_columns) + 1))})",
+                     ((current,) + row for current, row in zip(ids, main_rows)))
+    for table, (columns, owners, rows) in associations.items():
+        conn.executemany(f"INSERT INTO {table} (ID, {', '.join(columns)}) VALUES (?, ?, ?)",
+                         ((ids[owner],) + row for owner, row in zip(owners, rows)))
+    conn.execute("COMMIT")
+    size_before = database_size(conn)
+    before = timed(lambda: conn.execute(JOIN_QUERY).fetchall(), repeats=5)
+    result = conn.execute(JOIN_QUERY).fetchall()
+    Migrations.migrate(conn)
+    size_after = database_size(conn)
+    after = timed(lambda: conn.execute(JOIN_QUERY).fetchall(), repeats=5)
+    # The sums may be added up in a different order
+    assert np.allclose(conn.execute(JOIN_QUERY).fetchall(), result)
+    conn.close()
+    print(f"Database with {count} extra experiments: {size_before / 2 ** 20:.1f} MB with hash IDs | "
+          f"{size_after / 2 ** 20:.1f} MB with integer IDs")
+    report('experiments/Solvents/Salts join, hash IDs vs integer IDs', before, after)
+
+
+def all_pages(pager, options, page_size, sort_by=None):
+    pages = []
+    for page in range(pager.page_count(options, page_size)):
+        pages.append(pager.page(options, page, page_size, sort_by))
+    return pd.concat(pages, ignore_index=True)
+
+
+def benchmark_pagination(count=50000, page_size=1000):
+    use_database_copy()
+    Pipeline.insert_new_data_bulk(synthetic_compositions(count))
+    options = all_options()
+    pager = KeysetPager()
+    full = Pipeline.query_df(options)
+    # Walking every page gives back the whole result, in the order asked for
+    pd.testing.assert_frame_equal(all_pages(pager, options, page_size), full)
+    descending = full.iloc[::-1].sort_values('Density', ascending=False, kind='stable').reset_index(drop=True)
+    pd.testing.assert_frame_equal(all_pages(pager, options, page_size, [{'column_id': 'Density', 'direction': 'desc'}]), descending)
+    # A page on its own can have an integer column where the whole result has a float one
+    last = pager.page_count(options, page_size) - 1
+    pd.testing.assert_frame_equal(KeysetPager().page(options, last, page_size), full.iloc[last * page_size:].reset_index(drop=True),
+                                  check_dtype=False)
+    print(f"Pagination: {len(full)} rows in {last + 1} pages of {page_size} match generate_df")
+    before = timed(lambda: Pipeline.query_df(options), repeats=5)
+    first_page = lambda pager: (pager.page(options, 0), pager.page_count(options))
+    after = timed(lambda: first_page(KeysetPager()), repeats=5)
+    report('table render, whole result vs first page', before, after)
+    before = timed(lambda: KeysetPager().page(options, last, page_size), repeats=5)
+    after = timed(lambda: pager.page(options, last, page_size), repeats=5)
+    report('last page, skipped to vs reached page by page', before, after)
+    ConnectionPool.close_all()
+
+
+def peak_memory(function):
+    tracemalloc.start()
+    try:
+        result = function()
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_export(count=100000):
+    use_database_copy()
+    Pipeline.insert_new_data_bulk(synthetic_compositions(count))
+    options = all_options()
+    full = Pipeline.query_df(options)
+    # Exports write integers as floats, so files are compared by their values
+    expected = pd.read_csv(io.StringIO(full.to_csv(index=False)))
+    streamed = b''.join(Export.export(options, 'csv', chunk_size=777))
+    pd.testing.assert_frame_equal(pd.read_csv(io.BytesIO(streamed)), expected, check_dtype=False)
+    assert zlib.decompress(b''.join(Export.export(options, 'csv.gz')), wbits=31) == streamed
+    if 'parquet' in Export.available_formats():
+        parquet = pd.read_parquet(io.BytesIO(b''.join(Export.export(options, 'parquet'))))
+        pd.testing.assert_frame_equal(parquet, full, check_dtype=False)
+    # The Flask route streams the same bytes
+    import Main
+    response = Main.app.server.test_client().get(Export.export_url(options, 'csv'))
+    assert response.status_code == 200 and response.data == streamed
+    assert Main.app.server.test_client().get(Export.ROUTE + '?format=csv&options=bad').status_code == 400
+    print(f"Export: {len(full)} rows match generate_df as {', '.join(Export.available_formats())}")
+    before = timed(lambda: Pipeline.query_df(options).to_csv(index=False).encode('utf-8'), repeats=3)
+    after = timed(lambda: sum(len(part) for part in Export.export(options, 'csv')), repeats=3)
+    report('CSV export, generate_df and to_csv vs streamed', before, after)
+    ConnectionPool.close_all()
+    size, before = peak_memory(lambda: len(Pipeline.query_df(options).to_csv(index=False).encode('utf-8')))
+    for export_format in Export.available_formats():
+        streamed, after = peak_memory(lambda: sum(len(part) for part in Export.export(options, export_format)))
+        print(f"{export_format} export of {size / 2 ** 20:.1f} MB of CSV: peak Python memory {before / 2 ** 20:.1f} MB in one piece | "
+              f"{after / 2 ** 20:.1f} MB streamed ({streamed / 2 ** 20:.1f} MB written)")
+    ConnectionPool.close_all()
+
+
+def check_snapshot(variants):
+    generation = Pipeline.result_cache.generation
+    assert Pipeline.snapshot.fresh(generation)
+    for options in variants:
+        pd.testing.assert_frame_equal(Pipeline.snapshot_df(copy.deepcopy(options), generation),
+                                      Pipeline.query_df(copy.deepcopy(options)), check_dtype=False)
+
+
+MAX_SNAPSHOT_BURST = 40  # more ingests than Snapshot.MAX_PARTS, which used to force a rebuild on the writer
+
+
+def benchmark_snapshot(count=100000):
+    use_database_copy()
+    variants = option_variants()
+    # The first ingest writes the snapshot, the next ones append to it
+    builds, appends = Pipeline.snapshot.builds, Pipeline.snapshot.appends
+    Pipeline.insert_new_data_bulk(synthetic_compositions(count))
+    Pipeline.snapshot.wait()
+    Pipeline.insert_new_data_bulk(synthetic_compositions(count // 10, seed=1))
+    Pipeline.snapshot.wait()
+    assert (Pipeline.snapshot.builds - builds, Pipeline.snapshot.appends - appends) == (1, 1)
+    check_snapshot(variants)
+    # Re-ingesting known experiments or editing rows can't be appended
+    Pipeline.insert_new_data_bulk(synthetic_compositions(10))
+    Pipeline.snapshot.wait()
+    assert Pipeline.snapshot.builds - builds == 2
+    check_snapshot(variants)
+    Pipeline.edit_database([("UPDATE experiments SET Density = Density + 1 WHERE ID = (SELECT MIN(ID) FROM experiments)", ())])
+    assert not Pipeline.snapshot.fresh(Pipeline.result_cache.generation)
+    Pipeline.insert_new_data_bulk(synthetic_compositions(1, seed=2))
+    Pipeline.snapshot.wait()
+    check_snapshot(variants)
+    # Add Data batches don't wait for the snapshot; a burst of them is refreshed once
+    builds, appends = Pipeline.snapshot.builds, Pipeline.snapshot.appends
+    start = time.perf_counter()
+    for seed in range(MAX_SNAPSHOT_BURST):
+        Pipeline.insert_new_data_bulk(synthetic_compositions(16, seed=100 + seed))
+    burst = time.perf_counter() - start
+    Pipeline.snapshot.wait()
+    assert Pipeline.snapshot.builds - builds + Pipeline.snapshot.appends - appends == 1
+    check_snapshot(variants)
+    # What each batch used to wait for on the writer thread
+    Pipeline.insert_new_data_bulk(synthetic_compositions(16, seed=99))
+    start = time.perf_counter()
+    Pipeline.snapshot.wait()
+    refresh = time.perf_counter() - start
+    # A read while the snapshot is rewritten answers from SQLite instead of waiting for it
+    Pipeline.edit_database([("UPDATE experiments SET Density = Density - 1 WHERE ID = (SELECT MIN(ID) FROM experiments)", ())])
+    Pipeline.insert_new_data_bulk(synthetic_compositions(1, seed=3))
+    waiter = threading.Thread(target=Pipeline.snapshot.wait)
+    start = time.perf_counter()
+    waiter.start()
+    while not Pipeline.snapshot.refreshing:
+        time.sleep(0.001)
+    read_start = time.perf_counter()
+    during = Pipeline.generate_df(copy.deepcopy(variants[2]))
+    read = time.perf_counter() - read_start
+    still_refreshing = Pipeline.snapshot.refreshing
+    waiter.join()
+    rebuild = time.perf_counter() - start
+    assert still_refreshing and read < rebuild
+    assert len(during) == len(Pipeline.query_df(copy.deepcopy(variants[2])))
+    check_snapshot(variants)
+    print(f"Snapshot: a read during a {rebuild * 1000:.0f} ms rebuild answered from SQLite in {read * 1000:.0f} ms")
+    print(f"Snapshot: {MAX_SNAPSHOT_BURST} Add Data batches written in {burst / MAX_SNAPSHOT_BURST * 1000:.1f} ms each, "
+          f"one background refresh; an inline refresh added {refresh * 1000:.0f} ms to every batch")
+    print(f"Snapshot: matches generate_df on {len(variants)} filter forms after appends, rebuilds and edits")
+    generation = Pipeline.result_cache.generation
+    for name, options in [('scan', variants[0]), ('filter', variants[2])]:
+        before = timed(lambda: Pipeline.query_df(options), repeats=5)
+        after = timed(lambda: Pipeline.snapshot_df(options, generation), repeats=5)
+        report(f'generate_df {name} ({len(Pipeline.query_df(options))} rows), SQLite vs Parquet snapshot', before, after)
+    ConnectionPool.close_all()
+
+
+def legacy_figures(df, variable_names, properties):
+    # show_graph's figures before the large-data mode: the whole DataFrame in every figure
+    hover_template = '<br>'.join(f"{current}: %{{customdata[{i}]}}" for i, current in enumerate(properties)) + '<extra></extra>'
+    result = []
+    for i in range(len(variable_names)):
+        for j in range(i + 1, len(variable_names)):
+            for k in properties:
+                figure = px.scatter_3d(df, x=df[variable_names[i]], y=df[variable_names[j]], z=k)
+                figure.update_traces(customdata=df[properties].to_numpy(), hovertemplate=variable_names[i] + ': %{x}<br>' +
+                                     variable_names[j] + ': %{y}<br>' + hover_template)
+                result.append(figure)
+    return result
+
+
+def figure_array(value):
+    # Figure dicts hold numpy arrays as plotly's base64 typed arrays
+    if isinstance(value, dict):
+        array = np.frombuffer(base64.b64decode(value['bdata']), dtype=value['dtype'])
+        return array.reshape([int(current) for current in value['shape'].split(',')]) if 'shape' in value else array
+    return np.asarray(value)
+
+
+def payload(figures):
+    return sum(len(plotly.io.to_json(figure, validate=False)) for figure in figures)
+
+
+def benchmark_figures(count=100000):
+    use_database_copy()
+    Pipeline.insert_new_data_bulk(synthetic_compositions(count))
+    df = Pipeline.generate_df(all_options())
+    properties = ['Conductivity', 'Density', 'Viscosity']
+    variable_names = ['Temperature', 'DMC_percentage', 'EC_percentage']
+    # Under the budget the figures hold every row, with the same hover as before
+    small = df.iloc[:1000]
+    for new, old in zip(Figures.build_figures(small, variable_names, properties), legacy_figures(small, variable_names, properties)):
+        assert new['data'][0]['hovertemplate'] == old.data[0].hovertemplate
+        assert np.array_equal(figure_array(new['data'][0]['customdata']), old.data[0].customdata)
+        assert np.array_equal(figure_array(new['data'][0]['z']), old.data[0].z)
+    # Voxel averages keep every point and stay inside the data's range
+    values = df[variable_names[:2] + properties].to_numpy(dtype='float64')
+    means, counts = Figures.voxel_means(values)
+    assert counts.sum() == len(values) and len(means) <= Figures.POINT_BUDGET
+    assert (means.min(axis=0) >= values.min(axis=0) - 1e-9).all() and (means.max(axis=0) <= values.max(axis=0) + 1e-9).all()
+    print(f"Figures: {len(values)} rows average to {len(means)} voxels")
+    # Date is plotted on a date axis, as milliseconds since the epoch; under the budget every
+    # row's date, above it voxel averages within the dates' range
+    date_variables = ['Date', 'Temperature']
+    for rows in [small, df]:
+        legacy_figures(rows.iloc[:1000], date_variables, properties)
+        figure = Figures.build_figures(rows, date_variables, properties)[0]
+        x = figure_array(figure['data'][0]['x'])
+        milliseconds = np.array([(current - datetime.date(1970, 1, 1)).days * 86400000 for current in rows['Date']], dtype='float64')
+        assert figure['layout']['scene']['xaxis']['type'] == 'date'
+        assert np.array_equal(x, milliseconds) if rows is small else milliseconds.min() <= x.min() <= x.max() <= milliseconds.max()
+    before_size = payload(legacy_figures(df, variable_names, properties))
+    after_size = payload(Figures.build_figures(df, variable_names, properties))
+    print(f"show_graph payload for {len(df)} rows, 3 pairs x 3 properties: {before_size / 2 ** 20:.1f} MB | {after_size / 2 ** 20:.1f} MB")
+    before = timed(lambda: payload(legacy_figures(df, variable_names, properties)), repeats=3)
+    after = timed(lambda: payload(Figures.build_figures(df, variable_names, properties)), repeats=3)
+    report('show_graph figures built and serialized, whole result vs downsampled', before, after)
+    ConnectionPool.close_all()
+
+
+def benchmark_figure_tabs(count=20000):
+    # 6 variables and 4 properties: 15 pairs x 4 properties = 60 figures
+    use_database_copy()
+    Pipeline.insert_new_data_bulk(synthetic_compositions(count))
+    df = Pipeline.generate_df({
+        Pipeline.DEPENDENT_VARIABLE: {Pipeline.LOGIC: 'or', 'Conductivity': {'min': None, 'max': None}, 'Density': {'min': None, 'max': None},
+                                      'Viscosity': {'min': None, 'max': None}, 'Mass': {'min': None, 'max': None}},
+        Pipeline.INDEPENDENT_VARIABLE: {Pipeline.LOGIC: 'or', 'Temperature': {'min': None, 'max': None}},
+        'Solvents': {Pipeline.LOGIC: 'or', 'DMC': {'min': None, 'max': None}, 'EC': {'min': None, 'max': None},
+                     'EMC': {'min': None, 'max': None}, 'EA': {'min': None, 'max': None}},
+        'Salts': {Pipeline.LOGIC: 'or', 'LiPF6': {'min': None, 'max': None}}})
+    properties = ['Conductivity', 'Density', 'Viscosity', 'Mass']
+    variable_names = ['Temperature', 'DMC_percentage', 'EC_percentage', 'EMC_percentage', 'EA_percentage', 'LiPF6_molality']
+    # Show_graph serializes the figures, so that is timed too
+    build = lambda groups=None, parallel=False: [plotly.io.to_json(figure, validate=False) for figure in
+                                                 Figures.build_figures(df, variable_names, properties, groups=groups, parallel=parallel)]
+    every = build()
+    groups = Figures.figure_groups(variable_names)
+    # A tab holds the figures of its group, the same as in the full build
+    assert len(every) == 60 and build(groups[:1]) == every[:len(properties)] and build(groups[-1:]) == every[-len(properties):]
+    # The thread pool returns the figures of the sequential build, in order
+    workers = Figures.WORKERS
+    Figures.WORKERS = 4
+    assert build(parallel=True) == every
+    print(f"Figure executor: {len(every)} figures from {Figures.WORKERS} threads match the sequential build, in order "
+          f"({os.cpu_count()} CPUs here)")
+    for count in [len(groups[:3]) * len(properties), len(every)]:
+        sequential = timed(lambda: build(groups[:count // len(properties)]), repeats=3)
+        parallel = timed(lambda: build(groups[:count // len(properties)], parallel=True), repeats=3)
+        report(f'{count} figures built and serialized, one thread vs {Figures.WORKERS} threads', sequential, parallel)
+    Figures.executor.shutdown()
+    Figures.executor = None
+    Figures.WORKERS = workers
+    before = timed(build, repeats=3)
+    first_tab = timed(lambda: build(groups[:1]), repeats=3)
+    report('show_graph, every figure vs the first tab (lazy mode)', before, first_tab)
+    ConnectionPool.close_all()
+
+
+def legacy_generate_graph(df, c, x, y):
+    # generate_graph before the render service: pyplot figures that are never closed
+    import matplotlib.pyplot as plt
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    scatter = ax.scatter(df[x], df[y], c=df[c], marker='o')
+    fig.colorbar(scatter, ax=ax, pad=0.1, shrink=0.7, aspect=10)
+    buffer = io.BytesIO()
+    plt.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+
+def live_figures():
+    from matplotlib.figure import Figure
+    gc.collect()
+    return sum(1 for current in gc.get_objects() if isinstance(current, Figure))
+
+
+def check_render_service(renders=1000):
+    use_database_copy()
+    df = Pipeline.generate_df(all_options())
+    # Leak check: after the first 100 uncached renders, the next 900 add no objects and no memory
+    for i in range(renders):
+        Pipeline.render_service.render(df, 'Density', 'DMC_percentage', 'EC_percentage')
+        if i == 99:
+            gc.collect()
+            objects = len(gc.get_objects())
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    gc.collect()
+    grown = len(gc.get_objects()) - objects
+    peak_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - peak
+    assert live_figures() == 0 and grown < 100 and peak_growth < 16 * 1024
+    print(f"Render service: {renders} renders, {grown} more objects and {peak_growth} KB more peak memory "
+          f"than after the first 100, no figures alive")
+    before = live_figures()
+    for i in range(20):
+        legacy_generate_graph(df, 'Density', 'DMC_percentage', 'EC_percentage')
+    print(f"Old generate_graph: {live_figures() - before} figures still alive after 20 renders")
+    import matplotlib.pyplot as plt
+    plt.close('all')
+    # graphs() renders each image once per generation and saves the bytes it returns
+    first = Pipeline.graphs(['Density', 'Viscosity'], ['DMC', 'EC'], ['LiPF6'])
+    renders = Pipeline.render_service.stats()['renders']
+    second = Pipeline.graphs(['Density', 'Viscosity'], ['DMC', 'EC'], ['LiPF6'])
+    assert first == second and Pipeline.render_service.stats()['renders'] == renders
+    saved = sorted(os.listdir('Saved Plots'))[-2:]
+    assert [base64.b64encode(open(os.path.join('Saved Plots', current), 'rb').read()).decode('utf-8') for current in saved] == second['base_64']
+    Pipeline.insert_new_data_bulk(synthetic_compositions(1))
+    Pipeline.graphs(['Density', 'Viscosity'], ['DMC', 'EC'], ['LiPF6'])
+    assert Pipeline.render_service.stats()['renders'] == renders + 2
+    before = timed(lambda: RenderService.render_png(df, 'Density', 'DMC_percentage', 'EC_percentage', 'LiPF6_molality'), repeats=5)
+    after = timed(lambda: Pipeline.graphs(['Density', 'Viscosity'], ['DMC', 'EC'], ['LiPF6']), repeats=5)
+    report('graphs() for 2 properties, rendering one image vs both from the cache', before, after)
+    print(f"Render cache: {Pipeline.render_service.stats()}")
+    ConnectionPool.close_all()
+
+
+def stored_stats(conn):
+    return pd.read_sql(f"SELECT * FROM {Migrations.STATS_TABLE} ORDER BY table_name, column_name, name", conn)
+
+
+def check_column_stats():
+    # The incrementally kept stats have to match the ones computed from the data
+    with ConnectionPool.transaction(Pipeline.DEFAULT_DB) as conn:
+        stored = stored_stats(conn)
+        conn.execute(f"DELETE FROM {Migrations.STATS_TABLE}")
+        Migrations.fill_column_stats(conn)
+        expected = stored_stats(conn)
+    pd.testing.assert_frame_equal(stored.drop(columns='sum'), expected.drop(columns='sum'))
+    assert np.allclose(stored['sum'], expected['sum'])
+    # and the lookup by generate_df column name has to find them
+    for column, query in [('Density', "SELECT Density AS v FROM experiments WHERE Density IS NOT NULL"),
+                          ('Trial', "SELECT Trial AS v FROM experiments WHERE Trial IS NOT NULL"),
+                          ('DMC_percentage', "SELECT percentage AS v FROM Solvents WHERE solvent = 'DMC'"),
+                          ('LiPF6_molality', "SELECT molality AS v FROM Salts WHERE salt = 'LiPF6'")]:
+        stats = Pipeline.get_column_stats(column)
+        values = Pipeline.get_data_from_database(query)['v']
+        assert (stats['count'], stats['min'], stats['max']) == (len(values), values.min(), values.max()), column
+        assert np.isclose(stats['mean'], values.mean())
+
+
+def benchmark_column_stats(count=100000):
+    use_database_copy()
+    # Opening the copy runs the migration that computes the stats
+    check_column_stats()
+    Pipeline.insert_new_data_bulk(synthetic_compositions(count), batch_size=7000)
+    check_column_stats()
+    # Re-ingested experiments replace identical rows; their association rows are added again
+    Pipeline.insert_new_data_bulk(synthetic_compositions(100) + synthetic_compositions(10, seed=1) * 2)
+    check_column_stats()
+    Pipeline.edit_database([("UPDATE experiments SET Density = 10 WHERE ID = (SELECT MIN(ID) FROM experiments)", ()),
+                            ("DELETE FROM Solvents WHERE solvent = 'EA'", ())])
+    check_column_stats()
+    # Edits that take away extremes, rename, replace, add names and columns
+    Pipeline.edit_database([("UPDATE experiments SET Density = 1 WHERE Density = (SELECT MAX(Density) FROM experiments)", ()),
+                            ("DELETE FROM experiments WHERE Conductivity = (SELECT MIN(Conductivity) FROM experiments)", ()),
+                            ("UPDATE Salts SET salt = 'LiTFSI' WHERE ID IN (SELECT ID FROM Salts LIMIT 50)", ()),
+                            ("INSERT INTO Solvents (ID, solvent, percentage) VALUES (1, 'PC', 'n/a'), (1, 'PC', 40)", ())])
+    check_column_stats()
+    Pipeline.edit_database(Pipeline.generate_edit_queries(synthetic_compositions(20, seed=3) + synthetic_compositions(5)))
+    check_column_stats()
+    Pipeline.edit_database([("ALTER TABLE experiments ADD COLUMN Pressure", ()), ("UPDATE experiments SET Pressure = Trial", ()),
+                            ("CREATE TABLE Additives (ID INTEGER(32), additive, fraction)", ()),
+                            ("INSERT INTO Additives VALUES (1, 'FEC', 0.1)", ())])
+    check_column_stats()
+    # A failed edit leaves data and stats as they were
+    before = table_counts()
+    try:
+        Pipeline.edit_database([("DELETE FROM Salts", ()), ("not sql", ())])
+    except sqlite3.Error:
+        pass
+    assert table_counts() == before
+    check_column_stats()
+    print("Column stats: match SQL aggregates after migration, batched ingests, re-ingests and edits")
+    edit = [("UPDATE experiments SET Viscosity = Viscosity + 0.5 WHERE ID = (SELECT MAX(ID) FROM experiments)", ())]
+
+    def rebuilt():
+        # edit_database before: every column's stats computed again over the whole database
+        with ConnectionPool.transaction(Pipeline.DEFAULT_DB) as conn:
+            conn.execute(edit[0][0])
+            conn.execute(f"DELETE FROM {Migrations.STATS_TABLE}")
+            Migrations.fill_column_stats(conn)
+
+    report(f'single-row edit over {table_counts()[0]} experiments, stats rebuilt vs followed', timed(rebuilt, repeats=5),
+           timed(lambda: Pipeline.edit_database(edit), repeats=5))
+    check_column_stats()
+    properties = ['Density', 'Conductivity', 'Viscosity', 'Temperature']
+    options = {Pipeline.DEPENDENT_VARIABLE: dict({Pipeline.LOGIC: 'or'}, **{current: {'min': None, 'max': None} for current in properties[:3]}),
+               Pipeline.INDEPENDENT_VARIABLE: {Pipeline.LOGIC: 'or', 'Temperature': {'min': None, 'max': None}}}
+
+    def scanned():
+        # The unfiltered bounds the filter form shows, scanned: builtin min/max over every experiment
+        df = Pipeline.query_df(options)
+        return {current: [min(df[current]), max(df[current])] for current in properties}
+
+    def from_stats():
+        # After a write the stats table is read again, which is the slowest case
+        Pipeline.column_stats.invalidate()
+        return {current: Pipeline.column_bounds(current) for current in properties}
+
+    assert {current: list(bounds) for current, bounds in from_stats().items()} == scanned()
+    report(f'filter form bounds of {len(properties)} properties over {table_counts()[0]} experiments, scan vs column stats',
+           timed(scanned, repeats=5), timed(from_stats))
+    df = Pipeline.query_df(options)
+    # show_graph's axes follow the filtered result
+    report(f'axis ranges over a {len(df)} row result, builtin vs vectorized min/max',
+           timed(lambda: {current: [min(df[current]), max(df[current])] for current in properties}),
+           timed(lambda: {current: Figures.value_range(df[current]) for current in properties}))
+    ConnectionPool.close_all()
+
+
+def upload_contents(df):
+    # The data URL dcc.Upload hands to update_output
+    return 'data:text/csv;base64,' + base64.b64encode(df.to_csv(index=False).encode('utf-8')).decode('ascii')
+
+
+def wait_for_job(job_id, poll=0.05):
+    while Pipeline.ingest_jobs.status(job_id)['state'] not in IngestJobs.FINISHED:
+        time.sleep(poll)
+    return Pipeline.ingest_jobs.status(job_id)
+
+
+def benchmark_ingest_jobs(count=50000):
+    uploads = [upload_contents(synthetic_upload(count, seed)) for seed in range(3)]
+    use_database_copy()
+    start = time.perf_counter()
+    message = Pipeline.parse_contents_streaming(uploads[0], 'upload.csv')
+    blocking = time.perf_counter() - start
+    expected = table_counts()
+    use_database_copy()
+    start = time.perf_counter()
+    job_id = Pipeline.submit_upload(uploads[0], 'upload.csv')
+    queued = time.perf_counter() - start
+    status = wait_for_job(job_id)
+    assert (status['state'], status['message']) == (IngestJobs.DONE, message) and table_counts() == expected
+    print(f"Upload of {count} rows, time the request thread is held: parse_contents_streaming {blocking * 1000:.0f} ms | "
+          f"submit_upload {queued * 1000:.2f} ms")
+    # Uploads running together share the writer, so none of them fails on a locked database.
+    # The last one is cancelled after its first chunk; the chunks it saved stay.
+    before = table_counts()[0]
+    jobs = [Pipeline.submit_upload(contents, f'upload{i}.csv') for i, contents in enumerate(uploads[1:])]
+    cancelled = Pipeline.submit_upload(upload_contents(synthetic_upload(count, 3)), 'cancelled.csv')
+    while not Pipeline.ingest_jobs.status(cancelled)['progress']:
+        time.sleep(0.01)
+    assert Pipeline.ingest_jobs.cancel(cancelled)
+    statuses = [wait_for_job(current) for current in jobs + [cancelled]]
+    assert [current['state'] for current in statuses] == [IngestJobs.DONE] * len(jobs) + [IngestJobs.CANCELLED]
+    assert 0 < statuses[-1]['progress']['inserted'] < count * 0.9
+    assert table_counts()[0] - before == sum(current['progress']['inserted'] for current in statuses)
+    print(f"Ingest jobs: {len(jobs)} concurrent uploads done, 1 cancelled after "
+          f"{statuses[-1]['progress']['inserted']} rows, no lock errors")
+    ConnectionPool.close_all()
+
+
+def concurrent_submissions(insert, compositions, stations):
+    # Each station thread submits its share one experiment at a time, like repeated
+    # Add Data clicks. Returns the wall time and each submission's latency.
+    latencies = []
+    errors = []
+
+    def station(share):
+        for composition in share:
+            start = time.perf_counter()
+            try:
+                insert(composition)
+            except Exception as e:
+                errors.append(e)
+            latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=station, args=(compositions[i::stations],)) for i in range(stations)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors, errors[:1]
+    return time.perf_counter() - start, latencies
+
+
+def single_transaction(composition):
+    # Add Data before the write buffer, with the same durability as its batches
+    with ConnectionPool.durable(Pipeline.DEFAULT_DB):
+        Pipeline.insert_new_data_bulk([composition])
+
+
+def benchmark_write_buffer(count=2000, stations=16):
+    compositions = synthetic_compositions(count)
+    use_database_copy()
+    base = table_counts()
+    before, before_latencies = concurrent_submissions(single_transaction, compositions, stations)
+    expected = table_counts()
+    use_database_copy()
+    after, after_latencies = concurrent_submissions(Pipeline.insert_new_data, compositions, stations)
+    assert table_counts() == expected and expected[0] == base[0] + count
+    print(f"Add Data from {stations} stations, {count} experiments: one transaction each {count / before:.0f} rows/s, "
+          f"p95 {np.percentile(before_latencies, 95) * 1000:.1f} ms | group commit {count / after:.0f} rows/s, "
+          f"p95 {np.percentile(after_latencies, 95) * 1000:.1f} ms | speedup {before / after:.1f}x")
+    # A submission resolves to the integer ID its experiment was stored under
+    composition = synthetic_compositions(1, seed=count)[0]
+    experiment_id = Pipeline.write_buffer.put(composition).result()
+    stored = Pipeline.get_data_from_database(f"SELECT Trial FROM {Pipeline.MAIN_NAME} WHERE ID = ?", params=(experiment_id,))
+    assert stored['Trial'].tolist() == [composition[Pipeline.MAIN_NAME]['Trial']]
+    print(f"Write buffer: {Pipeline.write_buffer.metrics()}")
+    ConnectionPool.close_all()
+
+
+def form_json(sections):
+    return json.dumps(sections, cls=plotly.utils.PlotlyJSONEncoder)
+
+
+def benchmark_layout_cache(loads=5000):
+    use_database_copy()
+    import Main
+    Main.generate_options(None)
+    sections = len(Main.layout_cache.entries)
+    builds = Main.layout_cache.builds
+
+    def uncached():
+        # What every page load built before the cache
+        return [Main.variable_section(category) if category['Title'] in (Pipeline.DEPENDENT_VARIABLE, Pipeline.INDEPENDENT_VARIABLE)
+                else Main.association_section(category) for category in Pipeline.get_choices()]
+
+    assert form_json(uncached()) == form_json(Main.generate_options(None))
+    report('filter form per page load, built vs cached', timed(uncached), timed(lambda: Main.generate_options(None)))
+    # Thousands of page loads keep the same trees: no builds and no growing memory
+    gc.collect()
+    tracemalloc.start()
+    for _ in range(loads):
+        Main.generate_options(None)
+    gc.collect()
+    growth = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert Main.layout_cache.builds == builds and len(Main.layout_cache.entries) == sections
+    assert growth < 64 * 1024, growth
+    # A new name rebuilds the association sections only
+    composition = synthetic_compositions(1)[0]
+    composition['Solvents'] = {'solvent': ['PC'], 'percentage': [100.0]}
+    Pipeline.insert_new_data_bulk([composition])
+    assert 'PC-checkbox' in form_json(Main.generate_options(None))
+    assert Main.layout_cache.builds - builds == len(Pipeline.catalog.names())
+    print(f"Layout cache: {loads} page loads, {growth / 1024:.1f} KB traced memory left, {sections} sections, "
+          f"{Main.layout_cache.builds - builds} rebuilt after a new solvent")
+    ConnectionPool.close_all()
+
+
+BENCHMARKS = {
+    'connection_pool': benchmark_connection_pool,
+    'connection_initializers': check_connection_initializers,
+    'bulk_ingest': benchmark_bulk_ingest,
+    'batch_validation': benchmark_batch_validation,
+    'query_plans': check_query_plans,
+    'query_compiler': benchmark_query_compiler,
+    'result_cache': benchmark_result_cache,
+    'integer_ids': benchmark_integer_ids,
+    'pagination': benchmark_pagination,
+    'export': benchmark_export,
+    'snapshot': benchmark_snapshot,
+    'figures': benchmark_figures,
+    'figure_tabs': benchmark_figure_tabs,
+    'render_service': check_render_service,
+    'column_stats': benchmark_column_stats,
+    'ingest_jobs': benchmark_ingest_jobs,
+    'write_buffer': benchmark_write_buffer,
+    'layout_cache': benchmark_layout_cache,
+}
+
+if __name__ == '__main__':
+    # Usage: python Benchmark.py [name ...]
+    warnings.simplefilter('ignore', FutureWarning)
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
@@ -0,0 +1,88 @@
+import numpy as np
+from ColumnStats import add_stats, association_rows, column_rows, new_experiments
+from ConnectionPool import transaction
+from Migrations import HASH_TABLE, association_table_sql, create_indexes, hash_table_sql, main_table_sql
+
+BATCH_SIZE = 5000  # experiments per transaction
+HASH_LOOKUP_SIZE = 500  # hashes looked up per query, below SQLite's bound parameter limit
+
+
+def group_by_table(compositions, main_name, id_function):
+    # Turns check_validity style dicts into one row list per table.
+    # Association rows keep the index of the experiment they belong to in owners.
+    main_columns = list(compositions[0][main_name].keys())
+    ids = []
+    main_rows = []
+    associations = {}
+    for index, composition in enumerate(compositions):
+        experiment = composition[main_name]
+        ids.append(id_function(experiment))
+        main_rows.append(tuple(experiment[column] for column in main_columns))
+        for table, values in composition.items():
+            if table == main_name:
+                continue
+            columns = list(values.keys())
+            if table not in associations:
+                associations[table] = (columns, [], [])
+            owners, rows = associations[table][1], associations[table][2]
+            column_values = [values[column] if isinstance(values[column], (list, tuple)) else [values[column]] for column in columns]
+            for row in zip(*column_values):
+                owners.append(index)
+                rows.append(row)
+    return main_columns, ids, main_rows, associations
+
+
+def create_tables(conn, main_name, main_columns, associations):
+    conn.execute(hash_table_sql())
+    conn.execute(main_table_sql(main_columns))
+    create_indexes(conn, main_name, main_columns)
+    for table, (columns, owners, rows) in associations.items():
+        conn.execute(association_table_sql(table, columns))
+        create_indexes(conn, table, columns)
+
+
+def lookup_ids(conn, hashes):
+    # The integer IDs of the given content hashes, None for those not stored
+    keys = {}
+    for start in range(0, len(hashes), HASH_LOOKUP_SIZE):
+        chunk = hashes[start:start + HASH_LOOKUP_SIZE]
+        keys.update(conn.execute(f"SELECT Hash, ID FROM {HASH_TABLE} WHERE Hash IN ({', '.join('?' * len(chunk))})", chunk))
+    return [keys.get(current) for current in hashes]
+
+
+def intern_ids(conn, hashes):
+    # The integer IDs of the given content hashes, registering the ones not seen before
+    conn.executemany(f"INSERT OR IGNORE INTO {HASH_TABLE} (Hash) VALUES (?)", ((current,) for current in hashes))
+    return lookup_ids(conn, hashes)
+
+
+def ingest(db_file, main_name, main_columns, ids, main_rows, associations, batch_size=BATCH_SIZE):
+    # Writes batch_size experiments and all of their association rows per transaction.
+    # A failure rolls back the batch it happened in; earlier batches stay committed.
+    # ids are content hashes, stored once in the hash table; rows refer to its integer IDs.
+    # The column stats are updated in the same transactions, from the batch's own rows.
+    main_query = f"INSERT OR REPLACE INTO {main_name} (ID, {', '.join(main_columns)}) VALUES ({', '.join('?' * (len(main_columns) + 1))})"
+    association_queries = {table: f"INSERT INTO {table} (ID, {', '.join(columns)}) VALUES ({', '.join('?' * (len(columns) + 1))})"
+                           for table, (columns, owners, rows) in associations.items()}
+    # Owners are sorted, so each batch's association rows are one contiguous slice
+    owner_arrays = {table: np.asarray(owners) for table, (columns, owners, rows) in associations.items()}
+    batch_size = max(1, int(batch_size))
+    inserted = 0
+    for start in range(0, len(main_rows), batch_size):
+        end = min(start + batch_size, len(main_rows))
+        with transaction(db_file) as conn:
+            if start == 0:
+                create_tables(conn, main_name, main_columns, associations)
+            watermark = conn.execute(f"SELECT COALESCE(MAX(ID), 0) FROM {HASH_TABLE}").fetchone()[0]
+            keys = intern_ids(conn, ids[start:end])
+            # A re-ingested experiment replaces an identical row, so only new ones add to the stats
+            stats = column_rows(main_name, main_columns, [main_rows[start + i] for i in new_experiments(conn, main_name, keys, watermark)])
+            conn.executemany(main_query, ((keys[i - start],) + main_rows[i] for i in range(start, end)))
+            for table, (columns, owners, rows) in associations.items():
+                low, high = np.searchsorted(owner_arrays[table], [start, end])
+                conn.executemany(association_queries[table],
+                                 ((keys[owners[k] - start],) + tuple(rows[k]) for k in range(low, high)))
+                stats += association_rows(table, columns, rows[low:high])
+            add_stats(conn, stats)
+        inserted = end
+    return inserted
@@ -0,0 +1,63 @@
+import threading
+from ConnectionPool import get_connection
+from Migrations import association_tables, table_columns
+
+
+class Catalog:
+    # In-memory copy of the association tables' columns and distinct names, which is what
+    # the filter form and generate_query need. It is read from the database once and then
+    # kept up to date by the ingest path. Updates replace the whole state at once, so readers
+    # on any thread see either the old or the new state and never need the lock.
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.lock = threading.Lock()
+        self.state = None
+        self.version = 0
+
+    def load(self):
+        conn = get_connection(self.db_file)
+        columns = {}
+        names = {}
+        for table in association_tables(conn):
+            columns[table] = table_columns(conn, table)
+            names[table] = frozenset(row[0] for row in conn.execute(f"SELECT DISTINCT {columns[table][1]} FROM {table}"))
+        return columns, names
+
+    def current(self):
+        state = self.state
+        if state is None:
+            with self.lock:
+                if self.state is None:
+                    self.state = self.load()
+                    self.version += 1
+                state = self.state
+        return state
+
+    def table_column_map(self):
+        # table -> [ID, name column, value column]
+        return self.current()[0]
+
+    def names(self):
+        # table -> distinct values of its name column
+        return self.current()[1]
+
+    def add_names(self, table, columns, names):
+        # Called after new rows were committed to an association table
+        with self.lock:
+            if self.state is None:
+                return
+            table_map, table_names = self.state
+            if table in table_names and table_names[table].issuperset(names):
+                return
+            table_map = dict(table_map)
+            table_names = dict(table_names)
+            if table not in table_map:
+                table_map[table] = ['ID'] + list(columns)
+            table_names[table] = table_names.get(table, frozenset()) | frozenset(names)
+            self.state = (table_map, table_names)
+            self.version += 1
+
+    def invalidate(self):
+        # For writes the catalog can't follow, e.g. arbitrary queries; the next read reloads
+        with self.lock:
+            self.state = None
@@ -0,0 +1,240 @@
+import threading
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from ConnectionPool import get_connection
+from Migrations import MAIN_NAME, STATS_TABLE, association_tables, fill_table_stats, table_columns, user_tables
+
+HASH_LOOKUP_SIZE = 500  # IDs looked up per query, below SQLite's bound parameter limit
+# Temporary table the edit triggers record added (+1) and removed (-1) values in
+DELTA_TABLE = 'column_stats_delta'
+NUMERIC = "('integer', 'real')"
+
+
+def numbers(series):
+    # The values SQLite stores as integer or real, as float64
+    if series.dtype == object:
+        series = series[series.map(lambda value: isinstance(value, (int, float, np.integer, np.floating)))]
+    values = series.to_numpy(dtype='float64')
+    return values[~np.isnan(values)]
+
+
+def column_rows(table, columns, rows):
+    # Stats rows (table, column, '', count, sum, min, max) of experiment rows, tuples in columns order
+    frame = pd.DataFrame.from_records(rows, columns=columns)
+    result = []
+    for column in columns:
+        values = numbers(frame[column])
+        if len(values):
+            result.append((table, column, '', len(values), float(values.sum()), float(values.min()), float(values.max())))
+    return result
+
+
+def association_rows(table, columns, rows):
+    # Stats rows (table, value column, name, count, sum, min, max) of association rows,
+    # tuples of (name, value, ...)
+    frame = pd.DataFrame.from_records([row[:2] for row in rows], columns=columns[:2])
+    frame = frame[frame[columns[0]].notna()]
+    names = frame[columns[0]].to_numpy()
+    values = frame[columns[1]]
+    if values.dtype == object:
+        keep = values.map(lambda value: isinstance(value, (int, float, np.integer, np.floating))).to_numpy(dtype=bool)
+        names, values = names[keep], values[keep]
+    values = values.to_numpy(dtype='float64')
+    keep = ~np.isnan(values)
+    if not keep.any():
+        return []
+    # One reduction per statistic over the rows sorted by name
+    names, values = names[keep], values[keep]
+    order = np.argsort(names, kind='stable')
+    names, values = names[order], values[order]
+    starts = np.flatnonzero(np.r_[True, names[1:] != names[:-1]])
+    counts = np.diff(np.r_[starts, len(values)])
+    sums = np.add.reduceat(values, starts)
+    minimums = np.minimum.reduceat(values, starts)
+    maximums = np.maximum.reduceat(values, starts)
+    return [(table, columns[1], names[start], int(count), float(total), float(minimum), float(maximum))
+            for start, count, total, minimum, maximum in zip(starts, counts, sums, minimums, maximums)]
+
+
+def add_stats(conn, rows):
+    # Adds the stats of newly inserted values to the stats table
+    conn.executemany(f"INSERT INTO {STATS_TABLE} (table_name, column_name, name, count, sum, min, max) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                     f"ON CONFLICT (table_name, column_name, name) DO UPDATE SET count = count + excluded.count, "
+                     f"sum = sum + excluded.sum, min = MIN(min, excluded.min), max = MAX(max, excluded.max)", rows)
+
+
+def new_experiments(conn, main_name, keys, watermark):
+    # Indexes of the first row of every key that isn't in main_name yet; keys at or below
+    # watermark (the largest hash ID before they were interned) may already be there.
+    # Rows with the same key have the same content, so each key counts once.
+    keys = np.asarray(keys, dtype=np.int64)
+    unique, first = np.unique(keys, return_index=True)
+    old = unique[unique <= watermark].tolist()
+    existing = set()
+    for start in range(0, len(old), HASH_LOOKUP_SIZE):
+        chunk = old[start:start + HASH_LOOKUP_SIZE]
+        existing.update(row[0] for row in conn.execute(f"SELECT ID FROM {main_name} WHERE ID IN ({', '.join('?' * len(chunk))})", chunk))
+    if existing:
+        first = first[~np.isin(unique, list(existing))]
+    return np.sort(first)
+
+
+def tracked_tables(conn):
+    # table -> (columns with stats, name column or None for the experiments table)
+    tables = {}
+    if MAIN_NAME in user_tables(conn):
+        tables[MAIN_NAME] = (tuple(table_columns(conn, MAIN_NAME)[1:]), None)
+    for table in association_tables(conn):
+        name_column, value_column = table_columns(conn, table)[1:3]
+        tables[table] = ((value_column,), name_column)
+    return tables
+
+
+def recorded(table, columns, name_column, row, sign, changed=False):
+    # Trigger statements recording row's (NEW or OLD) values, only if they changed on update
+    statements = []
+    for column in columns:
+        name = f"{row}.{name_column}" if name_column else "''"
+        condition = ''
+        if changed:
+            condition = f" WHERE OLD.{column} IS NOT NEW.{column}"
+            if name_column:
+                condition += f" OR OLD.{name_column} IS NOT NEW.{name_column}"
+        statements.append(f"INSERT INTO {DELTA_TABLE} SELECT '{table}', '{column}', {name}, {row}.{column}, {sign}{condition};")
+    return ' '.join(statements)
+
+
+def track_changes(conn):
+    # Records what the following statements change in the tables with stats, through
+    # temporary triggers, so follow_changes can update the stats without a full scan.
+    # Returns the tables as they were, for follow_changes.
+    tables = tracked_tables(conn)
+    conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS {DELTA_TABLE} (table_name, column_name, name, value, sign)")
+    # INSERT OR REPLACE fires the delete triggers of the rows it replaces
+    conn.execute("PRAGMA recursive_triggers = ON")
+    for table, (columns, name_column) in tables.items():
+        conn.execute(f"CREATE TEMP TRIGGER column_stats_{table}_insert AFTER INSERT ON {table} BEGIN "
+                     f"{recorded(table, columns, name_column, 'NEW', 1)} END")
+        conn.execute(f"CREATE TEMP TRIGGER column_stats_{table}_delete AFTER DELETE ON {table} BEGIN "
+                     f"{recorded(table, columns, name_column, 'OLD', -1)} END")
+        conn.execute(f"CREATE TEMP TRIGGER column_stats_{table}_update AFTER UPDATE ON {table} BEGIN "
+                     f"{recorded(table, columns, name_column, 'OLD', -1, True)} {recorded(table, columns, name_column, 'NEW', 1, True)} END")
+    return tables
+
+
+def extreme(conn, table, column, name, name_column, descending):
+    # The smallest or largest number in a column, through its index where it has one
+    condition = f"typeof({column}) IN {NUMERIC}"
+    params = ()
+    if name_column:
+        condition = f"{name_column} = ? AND " + condition
+        params = (name,)
+    row = conn.execute(f"SELECT {column} FROM {table} WHERE {condition} ORDER BY {column} {'DESC' if descending else 'ASC'} LIMIT 1",
+                       params).fetchone()
+    return None if row is None else row[0]
+
+
+def follow_changes(conn, tables):
+    # Removes track_changes' triggers and folds what they recorded into the stats. Count and
+    # sum change by the recorded values; min and max are only looked up again when a
+    # removed value was one. Tables the statements created, dropped or altered are
+    # computed again in full.
+    for table in tables:
+        for event in ('insert', 'delete', 'update'):
+            conn.execute(f"DROP TRIGGER IF EXISTS temp.column_stats_{table}_{event}")
+    current = tracked_tables(conn)
+    for table in set(tables) | set(current):
+        if tables.get(table) != current.get(table):
+            conn.execute(f"DELETE FROM {STATS_TABLE} WHERE table_name = ?", (table,))
+            if table in current:
+                fill_table_stats(conn, table)
+    changes = conn.execute(
+        f"SELECT table_name, column_name, name, SUM(sign), TOTAL(sign * value), "
+        f"MIN(CASE WHEN sign > 0 THEN value END), MAX(CASE WHEN sign > 0 THEN value END), "
+        f"MIN(CASE WHEN sign < 0 THEN value END), MAX(CASE WHEN sign < 0 THEN value END) "
+        f"FROM temp.{DELTA_TABLE} WHERE name IS NOT NULL AND typeof(value) IN {NUMERIC} GROUP BY 1, 2, 3").fetchall()
+    conn.execute(f"DELETE FROM temp.{DELTA_TABLE}")
+    for table, column, name, count, total, added_min, added_max, removed_min, removed_max in changes:
+        if tables.get(table) != current.get(table):
+            continue
+        key = (table, column, name)
+        row = conn.execute(f"SELECT count, sum, min, max FROM {STATS_TABLE} WHERE table_name = ? AND column_name = ? AND name = ?", key).fetchone()
+        old_count, old_total, minimum, maximum = row or (0, 0, None, None)
+        count += old_count
+        if count <= 0:
+            conn.execute(f"DELETE FROM {STATS_TABLE} WHERE table_name = ? AND column_name = ? AND name = ?", key)
+            continue
+        name_column = current[table][1]
+        if minimum is None or (removed_min is not None and removed_min <= minimum):
+            minimum = extreme(conn, table, column, name, name_column, False)
+        elif added_min is not None:
+            minimum = min(minimum, added_min)
+        if maximum is None or (removed_max is not None and removed_max >= maximum):
+            maximum = extreme(conn, table, column, name, name_column, True)
+        elif added_max is not None:
+            maximum = max(maximum, added_max)
+        conn.execute(f"INSERT OR REPLACE INTO {STATS_TABLE} (table_name, column_name, name, count, sum, min, max) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     key + (count, old_total + total, minimum, maximum))
+
+
+@contextmanager
+def following_changes(conn):
+    # Keeps the stats right through the statements run in the block, inside a transaction.
+    # If the block raises, the transaction's rollback removes the triggers.
+    tables = track_changes(conn)
+    try:
+        yield
+        follow_changes(conn, tables)
+    finally:
+        conn.execute("PRAGMA recursive_triggers = OFF")
+
+
+class ColumnStats:
+    # In-memory copy of the column stats table, read once after every write. The table is
+    # kept up to date by the ingest transactions, so asking for a column's range never
+    # scans the data.
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.lock = threading.Lock()
+        self.state = None
+        self.version = 0  # bumped whenever the stats are read again
+
+    def load(self):
+        stats = {}
+        for table, column, name, count, total, minimum, maximum in get_connection(self.db_file).execute(
+                f"SELECT table_name, column_name, name, count, sum, min, max FROM {STATS_TABLE}"):
+            stats[(table, column, name)] = {'count': count, 'sum': total, 'mean': total / count,
+                                            'min': minimum, 'max': maximum}
+        return stats
+
+    def current(self):
+        state = self.state
+        if state is None:
+            with self.lock:
+                if self.state is None:
+                    self.state = self.load()
+                    self.version += 1
+                state = self.state
+        return state
+
+    def get(self, table, column, name=''):
+        # {'count', 'sum', 'mean', 'min', 'max'} of a column's numbers, or None if it has none
+        return self.current().get((table, column, name))
+
+    def lookup(self, column, table_column_map, table_names):
+        # Stats of a generate_df column: an experiment column or <name>_<value column>
+        stats = self.get(MAIN_NAME, column)
+        if stats is not None:
+            return stats
+        for table, columns in table_column_map.items():
+            suffix = '_' + columns[2]
+            name = column[:-len(suffix)]
+            if column.endswith(suffix) and name in table_names.get(table, ()):
+                return self.get(table, columns[2], name)
+        return None
+
+    def invalidate(self):
+        # Called after every write; the next read loads the table again
+        with self.lock:
+            self.state = None
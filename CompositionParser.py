@@ -0,0 +1,88 @@
+import re
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+CACHE_SIZE = 4096  # distinct composition IDs remembered
+ERROR_COMP_ID = 'Please enter a valid composition ID.'
+ERROR_PERCENTAGE_SUM = 'Percentages of solvents must sum up to 100.'
+# solvent_solvent|percentage_percentage|salt_salt|molality_molality
+COMPOSITION_ID = re.compile(r'([^|]*)\|([^|]*)\|([^|]*)\|([^|]*)')
+# Association table, name column and amount column of each half of the ID
+COMPONENT_TABLES = [('Solvents', 'solvent', 'percentage'), ('Salts', 'salt', 'molality')]
+
+
+def valid_name(name):
+    return len(name) > 0 and name[0].isupper() and name.isalnum()
+
+
+def parse_amounts(tokens, positive=True):
+    # Returns the amounts as floats, or None if any of them isn't a number (or isn't positive)
+    amounts = []
+    for token in tokens:
+        try:
+            amount = float(token)
+        except ValueError:
+            return None
+        if positive and amount <= 0:
+            return None
+        amounts.append(amount)
+    return tuple(amounts)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_composition_id(composition_id):
+    # Returns ((solvents, percentages), (salts, molalities)) as tuples, or an error message.
+    # Results are cached, so callers must not rely on getting a fresh object.
+    if not isinstance(composition_id, str):
+        return ERROR_COMP_ID
+    match = COMPOSITION_ID.fullmatch(composition_id)
+    if match is None:
+        return ERROR_COMP_ID
+    solvents, percentages, salts, molalities = [field.split('_') for field in match.groups()]
+    if len(solvents) != len(percentages) or not all(valid_name(current) for current in solvents):
+        return ERROR_COMP_ID
+    percentages = parse_amounts(percentages)
+    if percentages is None:
+        return ERROR_COMP_ID
+    if abs(sum(percentages) - 100) > 1E-10:
+        return ERROR_PERCENTAGE_SUM
+    if len(salts) != len(molalities) or not all(valid_name(current) for current in salts):
+        return ERROR_COMP_ID
+    # Any molality is accepted, as it always has been, e.g. 0 for a salt-free reference
+    molalities = parse_amounts(molalities, positive=False)
+    if molalities is None:
+        return ERROR_COMP_ID
+    return (tuple(solvents), percentages), (tuple(salts), molalities)
+
+
+def cache_info():
+    # hits, misses, maxsize and currsize of the parse cache
+    return parse_composition_id.cache_info()
+
+
+def parse_composition_column(property, series):
+    # Parses a whole column of composition IDs, each distinct ID once. Returns
+    # (values, error_mask, messages) where values maps each association table to
+    # (columns, owners, column arrays): flat arrays of component names and amounts,
+    # with owners holding the row position each component belongs to.
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    parsed = [parse_composition_id(current) for current in uniques]
+    unique_errors = np.array([isinstance(current, str) for current in parsed], dtype=bool)
+    unique_messages = np.array([current if isinstance(current, str) else None for current in parsed], dtype=object)
+    error_mask = unique_errors[codes]
+    values = {}
+    for half, (table, name_column, amount_column) in enumerate(COMPONENT_TABLES):
+        names = [() if isinstance(current, str) else current[half][0] for current in parsed]
+        amounts = [() if isinstance(current, str) else current[half][1] for current in parsed]
+        # Components of every distinct ID laid end to end, and where each ID starts
+        unique_counts = np.array([len(current) for current in names], dtype=np.int64)
+        unique_starts = np.cumsum(unique_counts) - unique_counts
+        flat_names = np.array([name for current in names for name in current], dtype=object)
+        flat_amounts = np.array([amount for current in amounts for amount in current], dtype=np.float64)
+        counts = unique_counts[codes]
+        owners = np.repeat(np.arange(len(codes)), counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        positions = np.repeat(unique_starts[codes], counts) + within
+        values[table] = ([name_column, amount_column], owners, [flat_names[positions], flat_amounts[positions]])
+    return values, error_mask, unique_messages[codes]
@@ -0,0 +1,146 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Connection settings, applied to every new connection
+BUSY_TIMEOUT = 5000  # milliseconds to wait on a locked database
+CACHED_STATEMENTS = 256  # prepared statements kept per connection
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 268435456,  # 256 MB
+    'cache_size': -65536,  # negative means KiB, so 64 MB
+    'temp_store': 'MEMORY',
+}
+
+_local = threading.local()
+_lock = threading.Lock()
+_all_connections = []
+_initializers = []
+_initialized_files = set()
+_file_locks = {}
+_generation = 0  # bumped by close_all, so every thread reopens its connections
+
+
+def configure(busy_timeout=None, cached_statements=None, **pragmas):
+    # Change the settings used for connections opened after this call
+    global BUSY_TIMEOUT, CACHED_STATEMENTS
+    if busy_timeout is not None:
+        BUSY_TIMEOUT = busy_timeout
+    if cached_statements is not None:
+        CACHED_STATEMENTS = cached_statements
+    PRAGMAS.update(pragmas)
+
+
+def register_initializer(function):
+    # function(conn) runs once per database file, on the first connection opened to it
+    _initializers.append(function)
+
+
+def open_connection(db_file):
+    # Autocommit mode: writers open their own transactions through transaction()
+    conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT / 1000, isolation_level=None,
+                           cached_statements=CACHED_STATEMENTS)
+    conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT)}")
+    for name, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+def initialize(db_file, conn):
+    # Runs the initializers on the first connection to db_file. Threads opening it meanwhile
+    # wait until they are done; if one raises, the next connection runs them again.
+    with _lock:
+        if db_file in _initialized_files:
+            return
+        file_lock = _file_locks.setdefault(db_file, threading.RLock())
+    with file_lock:
+        with _lock:
+            if db_file in _initialized_files:
+                return
+        for function in _initializers:
+            function(conn)
+        with _lock:
+            _initialized_files.add(db_file)
+
+
+def get_connection(db_file):
+    # Each thread keeps one long-lived connection per database file, keyed by its absolute
+    # path so a relative name still means the file it meant when the connection was opened
+    db_file = os.path.abspath(db_file)
+    connections = getattr(_local, 'connections', None)
+    if connections is None or _local.generation != _generation:
+        # close_all ran since, e.g. on a long-lived writer thread
+        for conn in (connections or {}).values():
+            conn.close()
+        connections = _local.connections = {}
+        _local.generation = _generation
+    conn = connections.get(db_file)
+    if conn is None:
+        conn = open_connection(db_file)
+        try:
+            initialize(db_file, conn)
+        except BaseException:
+            conn.close()
+            raise
+        connections[db_file] = conn
+        with _lock:
+            _all_connections.append(conn)
+    return conn
+
+
+@contextmanager
+def transaction(db_file, immediate=True):
+    # Runs the block in one transaction, rolled back if anything inside raises
+    conn = get_connection(db_file)
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
+
+
+@contextmanager
+def durable(db_file):
+    # Transactions in the block are on disk once they commit. With WAL and synchronous=NORMAL
+    # the last commits can be lost on power loss; FULL syncs the WAL on every commit.
+    conn = get_connection(db_file)
+    conn.execute("PRAGMA synchronous = FULL")
+    try:
+        yield conn
+    finally:
+        conn.execute(f"PRAGMA synchronous = {PRAGMAS['synchronous']}")
+
+
+def close_thread_connections():
+    connections = getattr(_local, 'connections', {})
+    with _lock:
+        for conn in connections.values():
+            if conn in _all_connections:
+                _all_connections.remove(conn)
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
+
+
+def close_all():
+    # Only safe once no other thread is using its connection, e.g. at shutdown or in scripts.
+    # Other threads' connections can't be closed here; they close them on their next call.
+    global _generation
+    with _lock:
+        _generation += 1
+        connections = list(_all_connections)
+        _all_connections.clear()
+        _initialized_files.clear()
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.ProgrammingError:
+            # Connections belonging to other threads can't be closed from here
+            pass
+    _local.connections = {}
+    _local.generation = _generation
@@ -1,7 +1,9 @@
+import numpy as np
 from dash import html
 class CustomType:
-    def __init__(self, verify, inputstructure, selectstructure=lambda x:None, displayMethod=lambda x:x):
+    def __init__(self, verify, inputstructure, selectstructure=lambda x:None, displayMethod=lambda x:x, batchverify=None):
         self.check = verify
+        self.batchcheck = batchverify
         self.inputs = inputstructure
         self.structureValue = None
         self.select = selectstructure
@@ -10,6 +12,16 @@ class CustomType:
     def verify(self, property, input):
         return self.check(property, input)
 
+    def verify_column(self, series):
+        # Verifies a whole column at once. Returns (values, error_mask, messages) where
+        # messages holds verify's error string for the rows flagged in error_mask.
+        if self.batchcheck is not None:
+            return self.batchcheck(series.name, series)
+        values = [self.check(series.name, value) for value in series]
+        error_mask = np.array([isinstance(value, str) for value in values], dtype=bool)
+        messages = np.array([value if isinstance(value, str) else None for value in values], dtype=object)
+        return values, error_mask, messages
+
     def inputstructure(self, id):
         if not self.structureValue:
             self.structure, self.structureValue = self.inputs(id)
@@ -1,10 +1,13 @@
 import serial
 import time
 import logging
+from Measurement import StabilityDetector, WINDOW
+from SerialPorts import ports
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', filename='Balance.log', filemode='a')
 STABLE_COUNT = 5  # Define your stable count threshold here
+MEASUREMENT_TIMEOUT = 60  # seconds streamMeasurement waits for the reading to settle
 
 def makeMeasurement(port_num, baud_rate, period, accuracy):
     try:
@@ -49,4 +52,58 @@ def makeMeasurement(port_num, baud_rate, period, accuracy):
     ser.close()
     return None
 
-print(makeMeasurement('COM3', 9600, 0.1, 10E-5))
\ No newline at end of file
+def parseReading(line):
+    # Readings end with their unit, e.g. 12.3456g
+    try:
+        return float(line.decode(errors='replace').strip()[:-1])
+    except ValueError:
+        return None
+
+def latestReading(ser, pending):
+    # The newest complete reading the balance sent, waiting for one if there is none, and
+    # the bytes of the next, incomplete one. Older readings are skipped.
+    pending += ser.read(ser.in_waiting)
+    if b'\n' not in pending:
+        pending += ser.readline()
+    *lines, pending = pending.split(b'\n')
+    for line in reversed(lines):
+        reading = parseReading(line)
+        if reading is not None:
+            return reading, pending
+    return None, pending
+
+def streamMeasurement(port_num, baud_rate, accuracy, telemetry=None, run=None, window=WINDOW, timeout=MEASUREMENT_TIMEOUT):
+    # Like makeMeasurement, but stability is judged on the last window readings (see
+    # Measurement.StabilityDetector), readings are taken more often as the value settles,
+    # and the readings go to telemetry (a Telemetry.TelemetryWriter) under run instead of the log
+    detector = StabilityDetector(accuracy, window)
+    samples = 0
+    port = None
+    try:
+        port = ports.acquire(port_num, baud_rate)
+        with port.exchange() as ser:
+            ser.reset_input_buffer()
+            pending = b''
+            start = time.perf_counter()
+            while time.perf_counter() - start < timeout:
+                reading, pending = latestReading(ser, pending)
+                if reading is not None:
+                    t = time.perf_counter() - start
+                    samples += 1
+                    if telemetry is not None:
+                        telemetry.add(run, t, reading)
+                    if detector.add(t, reading):
+                        logging.info(f'Measurement stabilized after {samples} readings in {t:.3f} s: {reading}')
+                        return reading
+                time.sleep(detector.nextPeriod())
+        logging.error(f'Measurement on {port_num} did not stabilize within {timeout} s')
+        return None
+    except serial.SerialException as e:
+        logging.error(f"Error opening or reading from serial port {port_num}: {e}")
+        return None
+    finally:
+        if port is not None:
+            ports.release(port)
+
+if __name__ == '__main__':
+    print(makeMeasurement('COM3', 9600, 0.1, 10E-5))
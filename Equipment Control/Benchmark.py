@@ -0,0 +1,508 @@
+import asyncio
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+import serial
+
+SOURCE_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Database.db')
+# The app's migrations create the telemetry table in a copy of the database
+sys.path.append(os.path.dirname(SOURCE_DB))
+# Balance and Valve log to a file in the working directory
+os.chdir(tempfile.mkdtemp(prefix='clio-instruments-'))
+
+import Balance
+import Valve
+import InstrumentIO
+import SerialPorts
+import ConnectionPool
+import Migrations
+import Pipeline
+from CompositionParser import parse_composition_id
+from Telemetry import TelemetryWriter
+import Orchestrator
+from FakeSerial import FakeBalance, FakeProbe, FakePump, FakeValve
+import PumpCodec
+from Pump import Mode, Parity, State1, State2, baud_rate, generate_command, generate_bytes, get_pdu, xor_bytes
+
+BAUD_RATE = 9600
+SETTLE_TIME = 0.5  # seconds the simulated balance drifts
+MOVE_TIMES = [0.3, 0.4]  # seconds the simulated valves take to switch
+PUMP_LATENCY = 0.2  # seconds the simulated pump takes to answer
+PERIOD = 0.02
+ACCURACY = 1e-4
+CYCLES = 5
+
+
+def pumpCommand():
+    return generate_command(Mode.SET_ROTATION_SPEED, 1, State1.START_PUMP, State2.CLOCKWISE, 300)
+
+
+def destination(cycle):
+    # Every cycle switches the valves
+    return 2 + cycle % 2
+
+
+def sequentialCycle(balance, valves, pump, cycle):
+    # The blocking drivers, one device after the other
+    balance.reset()
+    measurement = Balance.makeMeasurement(balance.port, BAUD_RATE, PERIOD, ACCURACY)
+    for valve in valves:
+        Valve.go(valve.port, BAUD_RATE, destination(cycle))
+    command = bytes.fromhex(pumpCommand())
+    with serial.Serial(pump.port, BAUD_RATE, timeout=1) as ser:
+        ser.write(command)
+        assert ser.read(len(command)) == command
+    return measurement
+
+
+async def concurrentCycle(transports, balance, cycle, timeouts=None):
+    balance.reset()
+    command = pumpCommand()
+    operations = {'balance': InstrumentIO.measure(transports['balance'], PERIOD, ACCURACY),
+                  'pump': InstrumentIO.sendPumpCommand(transports['pump'], command, len(bytes.fromhex(command)))}
+    for i in range(len(MOVE_TIMES)):
+        operations[f'valve{i}'] = InstrumentIO.moveValve(transports[f'valve{i}'], destination(cycle))
+    return await InstrumentIO.runConcurrently(operations, timeouts)
+
+
+async def openAll(devices):
+    return {name: await InstrumentIO.openSerial(device.port, BAUD_RATE) for name, device in devices.items()}
+
+
+def benchmark_cycle_time():
+    balance = FakeBalance(SETTLE_TIME)
+    valves = [FakeValve(move_time) for move_time in MOVE_TIMES]
+    pump = FakePump(PUMP_LATENCY)
+    devices = dict({'balance': balance, 'pump': pump}, **{f'valve{i}': valve for i, valve in enumerate(valves)})
+    before = []
+    for cycle in range(CYCLES):
+        start = time.perf_counter()
+        assert sequentialCycle(balance, valves, pump, cycle) == balance.target
+        before.append(time.perf_counter() - start)
+    Valve.closeValves()
+
+    async def run():
+        transports = await openAll(devices)
+        times = []
+        try:
+            for cycle in range(CYCLES):
+                start = time.perf_counter()
+                results = await concurrentCycle(transports, balance, cycle)
+                times.append(time.perf_counter() - start)
+                assert results['balance'] == balance.target and results['pump'] == bytes.fromhex(pumpCommand())
+                assert all(results[f'valve{i}'] == destination(cycle) for i in range(len(valves)))
+        finally:
+            for transport in transports.values():
+                transport.close()
+        return times
+
+    after = asyncio.run(run())
+    print(f"Rig cycle (balance settling {SETTLE_TIME} s, valves {MOVE_TIMES} s, pump {PUMP_LATENCY} s), {CYCLES} cycles: "
+          f"sequential blocking drivers mean {sum(before) / len(before) * 1000:.0f} ms | "
+          f"asyncio mean {sum(after) / len(after) * 1000:.0f} ms | speedup {sum(before) / sum(after):.1f}x")
+    for device in devices.values():
+        device.close()
+
+
+def check_timeouts():
+    # A stuck valve times out on its own; the other devices still finish
+    balance = FakeBalance(SETTLE_TIME)
+    devices = {'balance': balance, 'pump': FakePump(PUMP_LATENCY), 'valve0': FakeValve(MOVE_TIMES[0]), 'valve1': FakeValve(None)}
+
+    async def run():
+        transports = await openAll(devices)
+        try:
+            start = time.perf_counter()
+            results = await concurrentCycle(transports, balance, 0, {'valve1': 1.0})
+            return results, time.perf_counter() - start
+        finally:
+            for transport in transports.values():
+                transport.close()
+
+    results, elapsed = asyncio.run(run())
+    assert isinstance(results['valve1'], InstrumentIO.DeviceTimeout) and results['valve1'].device == 'valve1'
+    assert results['balance'] == balance.target and results['valve0'] == destination(0)
+    assert elapsed < 1.5
+    print(f"Timeouts: stuck valve gave up after {elapsed:.2f} s, other devices finished")
+    for device in devices.values():
+        device.close()
+    # A dispense cut short by its step's timeout still stops the pump
+    rig, devices = simulatedRig('timed out', timeout=0.3)
+
+    async def dispense():
+        await rig.open()
+        try:
+            await rig.step({'valve': rig.moveValve(RESERVOIRS['H2O'])})
+            await rig.step({'pump': rig.dispense(100 * SAMPLE_VOLUME)})
+        except InstrumentIO.DeviceTimeout:
+            return devices[2].flow
+        finally:
+            rig.close()
+
+    assert asyncio.run(dispense()) == 0 and devices[2].poured < 100 * SAMPLE_VOLUME
+    print(f"Timeouts: pump stopped after {devices[2].poured:.2f} of {100 * SAMPLE_VOLUME} mL when the dispense timed out")
+    for device in devices:
+        device.close()
+
+
+def legacyGo(port_num, baud_rate, dest):
+    # Valve.go before the valve driver: CP and GO again and again until the valve is there
+    ser = serial.Serial(port_num, baud_rate, timeout=1)
+    while True:
+        ser.write("CP\r".encode())
+        response = int(ser.read(4).decode('utf-8').strip()[2:])
+        if response != dest:
+            ser.write(f"GO{dest}\r".encode())
+        else:
+            ser.close()
+            return
+
+
+def timedMove(move, valve, dest):
+    # (seconds, CPU seconds of the calling thread, commands the valve received)
+    commands = valve.commands
+    start, cpu = time.perf_counter(), time.thread_time()
+    move(valve.port, BAUD_RATE, dest)
+    return time.perf_counter() - start, time.thread_time() - cpu, valve.commands - commands
+
+
+def benchmark_valve_driver(moves=5):
+    valve = FakeValve(MOVE_TIMES[1])
+    before = [timedMove(legacyGo, valve, destination(i)) for i in range(moves)]
+    after = [timedMove(Valve.go, valve, destination(i + 1)) for i in range(moves)]
+    assert valve.position == destination(moves)
+    for name, results in [('busy loop', before), ('driver', after)]:
+        print(f"Valve move ({MOVE_TIMES[1]} s), {name}: mean {sum(r[0] for r in results) / moves * 1000:.0f} ms, "
+              f"CPU {sum(r[1] for r in results) / moves * 1000:.0f} ms, {sum(r[2] for r in results) / moves:.0f} commands")
+    print(f"Valve driver: {Valve.getValve(valve.port, BAUD_RATE).stats()}")
+    Valve.closeValves()
+    # Two addressed valves on one bus, driven from two threads, share one open port
+    bus = FakeValve(MOVE_TIMES[0], addresses=('1', '2'))
+    opens = SerialPorts.ports.opens
+    drivers = [Valve.ValveDriver(bus.port, BAUD_RATE, address) for address in (1, 2)]
+    threads = [threading.Thread(target=driver.moveTo, args=(3 + i,)) for i, driver in enumerate(drivers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert SerialPorts.ports.opens - opens == 1 and [bus.current(address) for address in (b'1', b'2')] == [3, 4]
+    assert all(driver.stats()['moves'] == 1 for driver in drivers)
+    print(f"Shared bus: 2 addressed valves moved concurrently through 1 open port, "
+          f"{sum(driver.commands_sent for driver in drivers)} commands")
+    for driver in drivers:
+        driver.close()
+    assert not SerialPorts.ports.ports
+    valve.close()
+    bus.close()
+
+
+def migratedDatabase():
+    # A fresh copy in a new scratch directory, like the app's use_database_copy: connections
+    # other threads hold to the last copy would keep its write-ahead log alive
+    Pipeline.snapshot.wait()
+    ConnectionPool.close_all()
+    Pipeline.result_cache.bump()
+    Pipeline.catalog.invalidate()
+    Pipeline.column_stats.invalidate()
+    Pipeline.snapshot.close()
+    os.chdir(tempfile.mkdtemp(prefix='clio-instruments-'))
+    shutil.copyfile(SOURCE_DB, 'Database.db')
+    conn = sqlite3.connect('Database.db', isolation_level=None)
+    Migrations.migrate(conn)
+    conn.close()
+    return 'Database.db'
+
+
+def timedMeasurement(balance, measure):
+    balance.reset()
+    start = time.perf_counter()
+    reading = measure(balance.port)
+    return reading, time.perf_counter() - start
+
+
+def benchmark_streaming_measurement():
+    telemetry = TelemetryWriter(migratedDatabase())
+    balance = FakeBalance(SETTLE_TIME)
+    # makeMeasurement sleeps 0.1 s between readlines while the balance streams every 20 ms,
+    # so it works through a growing backlog of old readings
+    old, before = timedMeasurement(balance, lambda port: Balance.makeMeasurement(port, BAUD_RATE, 0.1, ACCURACY))
+    run = telemetry.newRun()
+    new, after = timedMeasurement(balance, lambda port: Balance.streamMeasurement(port, BAUD_RATE, ACCURACY, telemetry, run))
+    assert old == new == balance.target
+    mass = new
+    print(f"Measurement settling in {SETTLE_TIME} s: makeMeasurement {before * 1000:.0f} ms | "
+          f"streamMeasurement {after * 1000:.0f} ms | speedup {before / after:.1f}x")
+    # A slow drift moves each reading by less than accuracy, which makeMeasurement takes for stable
+    drifting = 10 * ACCURACY
+    old, before = timedMeasurement(balance, lambda port: Balance.makeMeasurement(port, BAUD_RATE, PERIOD, drifting))
+    new, after = timedMeasurement(balance, lambda port: Balance.streamMeasurement(port, BAUD_RATE, drifting))
+    assert abs(new - balance.target) < drifting
+    print(f"Drifting reading, accuracy {drifting}: makeMeasurement off by {abs(old - balance.target):.4f} after {before * 1000:.0f} ms | "
+          f"streamMeasurement off by {abs(new - balance.target):.4f} after {after * 1000:.0f} ms")
+    # The trace is in the database, linked to the experiment its reading was saved as
+    times, values = telemetry.trace(run)
+    measurement = dict({'Density': mass, 'Mass': mass, 'Volume': 1.0, 'Temperature': 25, 'CompositionID': COMPOSITIONS[0],
+                        'Date': '2024-01-01', 'Trial': 1}, **{name: reading for name, (reading, unit) in PROBES.items()})
+    experiment_id = Pipeline.submit_measurement(measurement).result()
+    telemetry.link(run, experiment_id)
+    linked = telemetry.conn.execute(f"SELECT COUNT(*) FROM {Migrations.TELEMETRY_TABLE} WHERE experiment = ?", (experiment_id,)).fetchone()[0]
+    stored = Pipeline.get_data_from_database(f"SELECT Mass FROM {Pipeline.MAIN_NAME} WHERE ID = ?", params=(experiment_id,))['Mass']
+    assert len(values) == linked > 0 and values[-1] == balance.target == stored[0] and times == sorted(times)
+    print(f"Telemetry: {len(values)} readings of the run saved and linked to experiment {experiment_id}")
+    balance.close()
+    SerialPorts.ports.closeAll()
+    # A port that can't be opened is logged and gives no reading, like makeMeasurement
+    assert Balance.streamMeasurement(os.path.join(os.getcwd(), 'missing'), BAUD_RATE, ACCURACY) is None
+    assert not SerialPorts.ports.ports
+    # Recording readings: one log line each vs batched telemetry rows
+    samples = 20000
+    logger = logging.getLogger()
+    start = time.perf_counter()
+    for i in range(samples):
+        logger.info(f'Received measurement: {i * 1e-4}')
+    logged = time.perf_counter() - start
+    run = telemetry.newRun()
+    batches = telemetry.batches
+    start = time.perf_counter()
+    for i in range(samples):
+        telemetry.add(run, i * 0.01, i * 1e-4)
+    queued = time.perf_counter() - start
+    telemetry.flush()
+    recorded = time.perf_counter() - start
+    assert len(telemetry.trace(run)[0]) == samples
+    # add() is what the measurement loop pays; the writes happen on the writer's thread
+    print(f"Recording {samples} readings: logging.info {samples / logged:.0f}/s | "
+          f"telemetry.add {samples / queued:.0f}/s, written {samples / recorded:.0f}/s in "
+          f"{telemetry.batches - batches} transactions | speedup {logged / queued:.1f}x in the loop, "
+          f"{logged / recorded:.1f}x written")
+    # A lone reading is written once it has waited flush_interval, without a flush
+    rows = telemetry.rows
+    telemetry.add(run, samples * 0.01, 0.0)
+    time.sleep(2 * telemetry.flush_interval)
+    assert telemetry.rows == rows + 1
+    telemetry.close()
+
+
+def legacyGenerateCommand(*args):
+    # Pump.generate_command before PumpCodec
+    pdu = get_pdu(args[0])
+    if args[0] == Mode.SET_ROTATION_SPEED:
+        pdu += generate_bytes(args[4], 2) + [args[2].value, args[3].value]
+    elif args[0] == Mode.SET_FLOW_RATE:
+        pdu += generate_bytes(args[4], 4) + [args[2].value, args[3].value]
+    elif args[0] == Mode.FLOW_CALIBRATION:
+        pdu += [baud_rate[args[2]], args[3].value, args[4]]
+    fcs = xor_bytes([args[1]] + pdu)
+    return ' '.join([format(i, '02X') for i in [233, args[1]] + pdu + [fcs]])
+
+
+def randomCommand(rng):
+    mode = rng.choice(list(Mode))
+    address = rng.randrange(256)
+    if mode == Mode.SET_ROTATION_SPEED:
+        return (mode, address, rng.choice(list(State1)), rng.choice(list(State2)), rng.randrange(2 ** 16))
+    if mode == Mode.SET_FLOW_RATE:
+        return (mode, address, rng.choice(list(State1)), rng.choice(list(State2)), rng.randrange(2 ** 32))
+    if mode == Mode.FLOW_CALIBRATION:
+        return (mode, address, rng.choice(list(baud_rate)), rng.choice(list(Parity)), rng.randrange(3))
+    return (mode, address)
+
+
+def commandFields(command):
+    # The fields PumpCodec.decode should find for a command
+    mode, address, *args = command
+    template = PumpCodec.TEMPLATES[mode.value]
+    return {name: args[i] for name, i in zip(template.fields, PumpCodec.PAYLOADS[mode][2])}
+
+
+def check_pump_codec(cases=20000, seed=0):
+    rng = random.Random(seed)
+    commands = [randomCommand(rng) for _ in range(cases)]
+    # Same frames as the old generate_command, and they decode back to the command
+    for command in commands:
+        frame = PumpCodec.encode(*command)
+        assert frame == bytes.fromhex(legacyGenerateCommand(*command)) and generate_command(*command) == legacyGenerateCommand(*command)
+        decoded = PumpCodec.decode(frame[1], frame[2:-1])
+        assert (decoded.mode, decoded.address, decoded.fields) == (command[0], command[1], commandFields(command))
+    # A stream with noise between frames and some frames corrupted, fed in random pieces
+    noise = bytes(b for b in range(256) if b != PumpCodec.START)
+    stream = bytearray()
+    expected = []
+    corrupted = 0
+    for command in commands:
+        stream += bytes(rng.choice(noise) for _ in range(rng.randrange(4)))
+        frame = bytearray(PumpCodec.encode(*command))
+        if rng.random() < 0.05:
+            frame[-1] ^= 1 << rng.randrange(8)
+            corrupted += 1
+        else:
+            expected.append(command)
+        stream += frame
+    parser = PumpCodec.FrameParser()
+    frames = []
+    position = 0
+    while position < len(stream):
+        size = rng.randrange(1, 64)
+        frames += parser.feed(stream[position:position + size])
+        position += size
+    assert [(frame.mode, frame.address, frame.fields) for frame in frames] == [(c[0], c[1], commandFields(c)) for c in expected]
+    assert parser.fcs_errors >= corrupted and not parser.buffer
+    # Frames for many pumps at once
+    addresses = list(range(1, 33))
+    batch = PumpCodec.encode_many(Mode.SET_ROTATION_SPEED, addresses, State1.START_PUMP, State2.CLOCKWISE, 300)
+    assert batch == PumpCodec.encode_batch([(Mode.SET_ROTATION_SPEED, address, State1.START_PUMP, State2.CLOCKWISE, 300) for address in addresses])
+    assert [frame.address for frame in PumpCodec.FrameParser().feed(batch)] == addresses
+    print(f"Pump codec: {cases} random commands match the old frames and round-trip; stream with noise and "
+          f"{corrupted} corrupted frames parsed to the {len(expected)} good ones ({parser.fcs_errors} FCS errors, {parser.skipped} bytes skipped)")
+
+
+def benchmark_pump_codec(frames=100000, pumps=32):
+    rng = random.Random(1)
+    commands = [randomCommand(rng) for _ in range(frames)]
+    start = time.perf_counter()
+    old = [bytes.fromhex(legacyGenerateCommand(*command)) for command in commands]
+    legacy = time.perf_counter() - start
+    start = time.perf_counter()
+    new = [PumpCodec.encode(*command) for command in commands]
+    encoded = time.perf_counter() - start
+    assert old == new
+    addresses = list(range(pumps))
+    start = time.perf_counter()
+    for _ in range(frames // pumps):
+        PumpCodec.encode_many(Mode.SET_FLOW_RATE, addresses, State1.START_PUMP, State2.CLOCKWISE, 1500)
+    batched = frames // pumps * pumps / (time.perf_counter() - start)
+    stream = b''.join(new)
+    parser = PumpCodec.FrameParser()
+    start = time.perf_counter()
+    parsed = []
+    for position in range(0, len(stream), 4096):
+        parsed += parser.feed(stream[position:position + 4096])
+    decoded = time.perf_counter() - start
+    assert len(parsed) == frames and parser.fcs_errors == 0
+    print(f"Pump frames, {frames}: generate_command + bytes.fromhex {frames / legacy:.0f}/s | "
+          f"PumpCodec.encode {frames / encoded:.0f}/s ({legacy / encoded:.1f}x) | "
+          f"encode_many for {pumps} pumps {batched:.0f}/s ({batched * legacy / frames:.1f}x) | "
+          f"FrameParser decode {frames / decoded:.0f}/s ({len(stream) / decoded / 1e6:.1f} MB/s)")
+
+
+# Simulated rigs: three reservoirs and probes for the properties the balance doesn't give
+DENSITIES = {2: 1.0, 3: 1.32, 4: 1.07}  # g/cm^3 by valve position
+RESERVOIRS = {'H2O': 2, 'EC': 3, 'DMC': 4}
+PROBES = {'Conductivity': (10.5, 'mS/cm'), 'Viscosity': (1.2, 'cP')}
+COMPOSITIONS = ['H2O|100|LiCl|1', 'EC_DMC|30_70|LiPF6|1', 'H2O_EC|50_50|LiCl|2', 'EC_DMC_H2O|20_30_50|LiPF6|0.5']
+SAMPLE_VOLUME = 0.5  # mL
+SAMPLE_FLOW_RATE = 120000  # 2 mL/s
+
+
+def simulatedRig(name, stuck=False, timeout=Orchestrator.STEP_TIMEOUT, telemetry=None):
+    # A rig whose pump really fills its balance's cell, and the simulators behind it
+    balance = FakeBalance(SETTLE_TIME / 2, target=50.0)
+    valve = FakeValve(None if stuck else MOVE_TIMES[0] / 3)
+    pump = FakePump(PUMP_LATENCY / 10, balance, valve, DENSITIES)
+    probes = {name: FakeProbe(*reading) for name, reading in PROBES.items()}
+    rig = Orchestrator.Rig(name, balance.port, pump.port, valve.port, RESERVOIRS, {name: probe.port for name, probe in probes.items()},
+                           baud_rate=BAUD_RATE, volume=SAMPLE_VOLUME, flow_rate=SAMPLE_FLOW_RATE, timeout=timeout, telemetry=telemetry)
+    return rig, [balance, valve, pump] + list(probes.values())
+
+
+def expectedDensity(composition_id):
+    solvents, percentages = parse_composition_id(composition_id)[0]
+    return sum(DENSITIES[RESERVOIRS[solvent]] * percentage / 100 for solvent, percentage in zip(solvents, percentages))
+
+
+def runRigs(rigs, composition_ids, submit=Pipeline.submit_measurement):
+    orchestrator = Orchestrator.Orchestrator([rig for rig, devices in rigs], submit, parse_composition_id, Pipeline.last_trial)
+    stats = orchestrator.run(composition_ids)
+    for rig, devices in rigs:
+        for device in devices:
+            device.close()
+    return orchestrator, stats
+
+
+def experimentCount():
+    return Pipeline.get_data_from_database(f"SELECT COUNT(*) AS n FROM {Pipeline.MAIN_NAME}")['n'][0]
+
+
+def benchmark_orchestrator(experiments=12, rig_counts=(1, 4)):
+    telemetry = TelemetryWriter(migratedDatabase())
+    composition_ids = [COMPOSITIONS[i % len(COMPOSITIONS)] for i in range(experiments)]
+    rates = {}
+    for count in rig_counts:
+        before = experimentCount()
+        orchestrator, stats = runRigs([simulatedRig(f'rig{i}', telemetry=telemetry) for i in range(count)], composition_ids)
+        # Every result is committed once run returns, as a new experiment (the simulated
+        # readings repeat, so only the trial numbers keep them apart), with the density the pours give
+        stored = experimentCount() - before
+        assert stored == stats['experiments'] == experiments and not orchestrator.failed
+        for composition_id, values in orchestrator.completed:
+            assert abs(values['Density'] - expectedDensity(composition_id)) < 0.03 * expectedDensity(composition_id)
+            assert values['Conductivity'] == PROBES['Conductivity'][0]
+        rates[count] = stats['experiments_per_hour']
+        utilization = ', '.join(f"{rig['utilization']:.0%}" for rig in stats['rigs'].values())
+        print(f"Orchestrator, {count} simulated rig(s), {stored} experiments stored: {stats['elapsed_s']:.1f} s, "
+              f"{rates[count]:.0f} experiments/hour, rig utilization {utilization}")
+    print(f"Orchestrator: {rig_counts[-1]} rigs run {rates[rig_counts[-1]] / rates[rig_counts[0]]:.1f}x the experiments/hour of {rig_counts[0]}; "
+          f"write buffer {Pipeline.write_buffer.metrics()['batches']} batches for {Pipeline.write_buffer.metrics()['rows']} experiments")
+    # The weighing of every stored experiment is traced and linked to it
+    linked = telemetry.conn.execute(f"SELECT COUNT(DISTINCT experiment) FROM {Migrations.TELEMETRY_TABLE}").fetchone()[0]
+    unlinked = telemetry.conn.execute(f"SELECT COUNT(*) FROM {Migrations.TELEMETRY_TABLE} WHERE experiment IS NULL").fetchone()[0]
+    assert linked == experiments * len(rig_counts) and unlinked == 0
+    print(f"Orchestrator: {telemetry.rows} balance readings traced, linked to {linked} experiments")
+    telemetry.close()
+    # Each run continued the trials of the one before
+    assert Pipeline.last_trial(COMPOSITIONS[0], orchestrator.date) == len(rig_counts) * composition_ids.count(COMPOSITIONS[0])
+    density = Pipeline.get_column_stats('Density')
+    assert density is not None and density['count'] >= experiments * len(rig_counts)
+    # A rig whose valve is stuck times out; its experiment is finished by the other rig
+    before = experimentCount()
+    orchestrator, stats = runRigs([simulatedRig('stuck', stuck=True, timeout=1.0), simulatedRig('working', timeout=5.0)], COMPOSITIONS)
+    assert stats['experiments'] == len(COMPOSITIONS) and experimentCount() - before == len(COMPOSITIONS)
+    assert not stats['rigs']['stuck']['in_service'] and stats['rigs']['working']['experiments'] == len(COMPOSITIONS)
+    print(f"Orchestrator: stuck rig taken out of service, {stats['experiments']} experiments finished on the other")
+    # A composition no rig has reservoirs for fails before any rig starts; one only some rigs
+    # can make fails on the others without taking them out of service
+    partial, devices = simulatedRig('partial')
+    partial.reservoirs = {'H2O': RESERVOIRS['H2O']}
+    before = experimentCount()
+    orchestrator, stats = runRigs([(partial, devices), simulatedRig('full')],
+                                  [COMPOSITIONS[1], COMPOSITIONS[0], 'Xx|100|LiCl|1'])
+    assert [composition_id for composition_id, error in orchestrator.failed] == ['Xx|100|LiCl|1']
+    assert stats['experiments'] == experimentCount() - before == 2
+    assert all(rig['in_service'] for rig in stats['rigs'].values())
+    print(f"Orchestrator: missing reservoirs failed {len(orchestrator.failed)} experiment, every rig stayed in service")
+    # A result whose write buffer batch fails counts as failed, and the others still as done
+
+    def submit(values):
+        if values['CompositionID'] != COMPOSITIONS[0]:
+            return Pipeline.submit_measurement(values)
+        commit = Future()
+        commit.set_exception(sqlite3.OperationalError('database is locked'))
+        return commit
+
+    orchestrator, stats = runRigs([simulatedRig('unsaved')], COMPOSITIONS[:2], submit)
+    assert orchestrator.failed == [(COMPOSITIONS[0], 'database is locked')]
+    assert [composition_id for composition_id, values in orchestrator.completed] == [COMPOSITIONS[1]] and stats['experiments'] == 1
+    print(f"Orchestrator: a failed commit fails its experiment, {stats['experiments']} other result saved")
+
+
+BENCHMARKS = {
+    'cycle_time': benchmark_cycle_time,
+    'timeouts': check_timeouts,
+    'valve_driver': benchmark_valve_driver,
+    'streaming_measurement': benchmark_streaming_measurement,
+    'pump_codec_checks': check_pump_codec,
+    'pump_codec': benchmark_pump_codec,
+    'orchestrator': benchmark_orchestrator,
+}
+
+if __name__ == '__main__':
+    # Usage: python Benchmark.py [name ...], from the Equipment Control directory
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
@@ -0,0 +1,174 @@
+import os
+import pty
+import re
+import select
+import threading
+import time
+import tty
+from Pump import FLOW_RATE_UNIT, Mode, State1
+from PumpCodec import FrameParser, pack_frame
+
+TICK = 0.01  # seconds between checks for scheduled output
+
+
+class FakeDevice:
+    # Simulated instrument behind a pseudo terminal. port names the other end, which opens
+    # like a serial port (serial.Serial(port, ...)), so drivers run unchanged without hardware.
+    def __init__(self):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        # Like a real port's buffer, output nobody reads is dropped once the pty is full
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self.slave)
+        self.lock = threading.Lock()
+        self.scheduled = []  # (time, bytes) to send
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        pending = b''
+        while self.running:
+            if select.select([self.master], [], [], TICK)[0]:
+                try:
+                    pending = self.receive(pending + os.read(self.master, 1024))
+                except OSError:
+                    break
+            self.tick(time.perf_counter())
+            with self.lock:
+                due = [data for at, data in self.scheduled if at <= time.perf_counter()]
+                self.scheduled = [(at, data) for at, data in self.scheduled if at > time.perf_counter()]
+            for data in due:
+                try:
+                    os.write(self.master, data)
+                except BlockingIOError:
+                    pass
+
+    def send(self, data, delay=0):
+        with self.lock:
+            self.scheduled.append((time.perf_counter() + delay, data))
+
+    def receive(self, data):
+        # Handles the bytes received so far and returns those it didn't use yet
+        return b''
+
+    def tick(self, now):
+        pass
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+
+class FakeBalance(FakeDevice):
+    # Streams a reading every interval; they drift for settle_time after reset, then stay put
+    def __init__(self, settle_time, interval=0.02, target=12.3456):
+        self.settle_time = settle_time
+        self.interval = interval
+        self.target = target
+        self.reset()
+        super().__init__()
+
+    def reset(self):
+        self.started = time.perf_counter()
+        self.next_reading = self.started
+
+    def tick(self, now):
+        if now < self.next_reading:
+            return
+        self.next_reading = now + self.interval
+        remaining = self.settle_time - (now - self.started)
+        value = self.target + (0.01 * remaining if remaining > 0 else 0)
+        self.send(f"{value:.4f}g\r\n".encode())
+
+
+class FakeValve(FakeDevice):
+    # Answers CP with its position as CPnn and moves to n in move_time after GOn; a stuck
+    # valve (move_time None) never moves. With addresses, one valve per address shares the
+    # port and commands and answers start with the address.
+    def __init__(self, move_time, position=1, addresses=('',)):
+        self.move_time = move_time
+        self.valves = {address.encode(): [position, position, 0] for address in addresses}  # position, target, arrival
+        self.moves = 0
+        self.commands = 0
+        super().__init__()
+
+    @property
+    def position(self):
+        return self.current(next(iter(self.valves)))
+
+    def current(self, address):
+        valve = self.valves[address]
+        if time.perf_counter() >= valve[2]:
+            valve[0] = valve[1]
+        return valve[0]
+
+    def receive(self, data):
+        *commands, rest = data.split(b'\r')
+        for command in commands:
+            self.commands += 1
+            match = re.fullmatch(rb'(\d*?)(CP|GO)(\d*)', command)
+            if match is None or match.group(1) not in self.valves:
+                continue
+            address, name, argument = match.groups()
+            if name == b'CP':
+                self.send(address + f"CP{self.current(address):02d}".encode())
+            elif int(argument) != self.valves[address][1] and self.move_time is not None:
+                self.current(address)
+                self.valves[address][1:] = [int(argument), time.perf_counter() + self.move_time]
+                self.moves += 1
+        return rest
+
+
+class FakePump(FakeDevice):
+    # Answers every valid frame (0xE9, address, PDU, FCS) with the same frame after latency.
+    # With a balance, the pump pours onto it from when a SET_FLOW_RATE frame starts it until
+    # one stops it; densities gives the liquid's density (g/cm^3) at each position of valve.
+    def __init__(self, latency, balance=None, valve=None, densities=None):
+        self.latency = latency
+        self.frames = 0
+        self.parser = FrameParser()
+        self.balance = balance
+        self.valve = valve
+        self.densities = densities or {}
+        self.flow = 0  # mL/s
+        self.poured = 0  # mL
+        self.last = time.perf_counter()
+        super().__init__()
+
+    def receive(self, data):
+        for frame in self.parser.feed(data):
+            self.frames += 1
+            self.send(pack_frame(frame.address, frame.pdu), self.latency)
+            if frame.mode == Mode.SET_FLOW_RATE:
+                self.tick(time.perf_counter())
+                running = frame.fields['state1'] != State1.STOP_PUMP
+                self.flow = frame.fields['flow_rate'] * FLOW_RATE_UNIT / 60 if running else 0
+                if not running and self.balance is not None:
+                    # The reading settles again after the pour
+                    self.balance.reset()
+        return b''
+
+    def tick(self, now):
+        volume = self.flow * (now - self.last)
+        self.last = now
+        if volume and self.balance is not None:
+            self.poured += volume
+            self.balance.target += volume * self.densities[self.valve.position]
+
+
+class FakeProbe(FakeDevice):
+    # Streams "<value> <unit>" lines every interval, like a conductivity meter or viscometer
+    def __init__(self, value, unit, interval=0.02):
+        self.value = value
+        self.unit = unit
+        self.interval = interval
+        self.next_reading = time.perf_counter()
+        super().__init__()
+
+    def tick(self, now):
+        if now >= self.next_reading:
+            self.next_reading = now + self.interval
+            self.send(f"{self.value:.4f} {self.unit}\r\n".encode())
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import os
+import time
+import serial
+from Balance import parseReading
+from Measurement import StabilityDetector, WINDOW
+
+DEFAULT_TIMEOUT = 30  # seconds one device operation may take
+VALVE_POLL_INITIAL = 0.01  # seconds before the first position query after GO, as in Valve.ValveDriver
+VALVE_POLL_MAX = 0.1  # longest wait between position queries
+STABLE_COUNT = 5  # same as Balance.STABLE_COUNT
+
+
+class DeviceTimeout(asyncio.TimeoutError):
+    def __init__(self, device, timeout):
+        super().__init__(f"{device} did not finish within {timeout} s")
+        self.device = device
+        self.timeout = timeout
+
+
+class SerialTransport:
+    # Non-blocking access to a serial port from the event loop. On POSIX the loop watches the
+    # port's file descriptor; elsewhere (Windows COM ports) reads run in the loop's executor.
+    def __init__(self, ser, loop):
+        self.ser = ser
+        self.loop = loop
+        self.buffer = bytearray()
+        self.waiter = None
+        self.watched = os.name == 'posix'
+        if self.watched:
+            loop.add_reader(ser.fileno(), self.onReadable)
+
+    def onReadable(self):
+        try:
+            self.buffer += self.ser.read(max(1, self.ser.in_waiting))
+        except serial.SerialException as e:
+            logging.error(f"Error reading from serial port {self.ser.port}: {e}")
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def fill(self):
+        # Waits for more bytes
+        if self.watched:
+            self.waiter = self.loop.create_future()
+            await self.waiter
+        else:
+            self.buffer += await self.loop.run_in_executor(None, self.ser.read, max(1, self.ser.in_waiting))
+
+    async def readUntil(self, terminator=b'\n'):
+        while terminator not in self.buffer:
+            await self.fill()
+        end = self.buffer.index(terminator) + len(terminator)
+        data = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        return data
+
+    async def read(self, size):
+        while len(self.buffer) < size:
+            await self.fill()
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def write(self, data):
+        self.ser.write(data)
+
+    def discard(self):
+        # Drops what was received so far, e.g. a balance's readings from before a measurement
+        self.buffer.clear()
+        self.ser.reset_input_buffer()
+
+    def close(self):
+        if self.watched:
+            self.loop.remove_reader(self.ser.fileno())
+        self.ser.close()
+
+
+async def openSerial(port_num, baud_rate):
+    # timeout only matters for the executor reads, which give the loop's thread back that often
+    ser = serial.Serial(port_num, baud_rate, timeout=0 if os.name == 'posix' else 0.1)
+    logging.info(f'Successfully opened serial port {port_num} at baud rate {baud_rate}.')
+    return SerialTransport(ser, asyncio.get_running_loop())
+
+
+async def measure(transport, period, accuracy, stable_count=STABLE_COUNT):
+    # Balance.makeMeasurement on the event loop: reads until stable_count readings in a row
+    # differ by less than accuracy. Readings from before the call are dropped, as opening
+    # the port does for makeMeasurement.
+    transport.discard()
+    prev_measurement = 0
+    count = 0
+    while True:
+        data = (await transport.readUntil(b'\n')).decode(errors='replace').strip()
+        if not data:
+            continue
+        try:
+            measurement = float(data[:-1])
+        except ValueError:
+            logging.warning(f"Invalid data received: {data}")
+            continue
+        if abs(measurement - prev_measurement) < accuracy:
+            count += 1
+        else:
+            count = 0
+        if count >= stable_count:
+            logging.info(f'Measurement stabilized: {measurement}')
+            return measurement
+        prev_measurement = measurement
+        await asyncio.sleep(period)
+
+
+async def latestReading(transport):
+    # Balance.latestReading on the event loop: the newest complete reading received, waiting
+    # for one if there is none. Older readings are skipped.
+    while b'\n' not in transport.buffer:
+        await transport.fill()
+    end = transport.buffer.rindex(b'\n')
+    lines = bytes(transport.buffer[:end]).split(b'\n')
+    del transport.buffer[:end + 1]
+    for line in reversed(lines):
+        reading = parseReading(line)
+        if reading is not None:
+            return reading
+    return None
+
+
+async def streamMeasurement(transport, accuracy, telemetry=None, run=None, window=WINDOW):
+    # Balance.streamMeasurement on the event loop: stable once Measurement.StabilityDetector
+    # says so, with the readings going to telemetry under run. The deadline is withTimeout's.
+    transport.discard()
+    detector = StabilityDetector(accuracy, window)
+    start = time.perf_counter()
+    while True:
+        reading = await latestReading(transport)
+        if reading is not None:
+            t = time.perf_counter() - start
+            if telemetry is not None:
+                telemetry.add(run, t, reading)
+            if detector.add(t, reading):
+                return reading
+        await asyncio.sleep(detector.nextPeriod())
+
+
+async def probeReading(transport):
+    # The next complete reading of an instrument that streams "<value> <unit>" lines, like a
+    # conductivity meter or viscometer
+    transport.discard()
+    await transport.readUntil(b'\n')  # the rest of a line discard cut
+    return float((await transport.readUntil(b'\n')).split()[0])
+
+
+async def valvePosition(transport):
+    transport.write(b"CP\r")
+    return int((await transport.read(4)).decode('utf-8').strip()[2:])
+
+
+async def moveValve(transport, dest):
+    # ValveDriver.moveTo on the event loop: one GO, then position queries with capped
+    # exponential backoff. The deadline is withTimeout's.
+    if await valvePosition(transport) == dest:
+        return dest
+    transport.write(f"GO{dest}\r".encode())
+    delay = VALVE_POLL_INITIAL
+    while True:
+        await asyncio.sleep(delay)
+        delay = min(2 * delay, VALVE_POLL_MAX)
+        if await valvePosition(transport) == dest:
+            return dest
+
+
+async def sendPumpCommand(transport, command, response_size=0):
+    # command as Pump.generate_command returns it or as PumpCodec frames; returns the pump's
+    # response_size byte answer
+    transport.write(command if isinstance(command, (bytes, bytearray)) else bytes.fromhex(command))
+    if response_size:
+        return await transport.read(response_size)
+
+
+async def withTimeout(device, operation, timeout=DEFAULT_TIMEOUT):
+    try:
+        return await asyncio.wait_for(operation, timeout)
+    except asyncio.TimeoutError:
+        logging.error(f"{device} did not finish within {timeout} s")
+        raise DeviceTimeout(device, timeout)
+
+
+async def runConcurrently(operations, timeouts=None, default_timeout=DEFAULT_TIMEOUT):
+    # Runs {device: coroutine} at the same time, each with its own timeout, and returns
+    # {device: result or exception}. A device failing or timing out doesn't stop the others.
+    timeouts = timeouts or {}
+    devices = list(operations)
+    results = await asyncio.gather(*[withTimeout(device, operations[device], timeouts.get(device, default_timeout))
+                                     for device in devices], return_exceptions=True)
+    return dict(zip(devices, results))
@@ -0,0 +1,69 @@
+import numpy as np
+
+WINDOW = 16  # latest readings the stability test looks at
+MIN_PERIOD = 0.01  # seconds between readings while the value is close to settling
+MAX_PERIOD = 0.2  # longest wait between readings while it is still moving
+NEAR = 10  # a change below NEAR * accuracy between readings counts as close to settling
+
+
+class RingBuffer:
+    # The latest size (time, value) readings in fixed NumPy arrays
+    def __init__(self, size):
+        self.times = np.zeros(size)
+        self.values = np.zeros(size)
+        self.size = size
+        self.head = 0
+        self.count = 0
+
+    def append(self, t, value):
+        self.times[self.head] = t
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def window(self):
+        # The readings, oldest first
+        order = (np.arange(self.count) + self.head - self.count) % self.size
+        return self.times[order], self.values[order]
+
+    def last(self, n):
+        return self.window()[1][-n:]
+
+
+def isStable(times, values, accuracy):
+    # Stable when the readings scatter by less than accuracy and their linear trend moves
+    # them by less than accuracy across the window
+    if values.std() >= accuracy:
+        return False
+    t = times - times.mean()
+    spread = t @ t
+    slope = (t @ (values - values.mean())) / spread if spread > 0 else 0
+    return abs(slope) * (times[-1] - times[0]) < accuracy
+
+
+class StabilityDetector:
+    # Decides when a stream of readings has settled and how long to wait for the next one:
+    # the wait doubles (up to max_period) while the value moves by more than NEAR * accuracy
+    # and drops to min_period once it is close, so the window fills quickly when it matters
+    def __init__(self, accuracy, window=WINDOW, min_period=MIN_PERIOD, max_period=MAX_PERIOD):
+        self.accuracy = accuracy
+        self.readings = RingBuffer(window)
+        self.min_period = min_period
+        self.max_period = max_period
+        self.period = min_period
+
+    def add(self, t, value):
+        # Returns whether the readings are stable with this one
+        self.readings.append(t, value)
+        if self.readings.count < self.readings.size:
+            return False
+        return isStable(*self.readings.window(), self.accuracy)
+
+    def nextPeriod(self):
+        if self.readings.count >= 2:
+            previous, latest = self.readings.last(2)
+            if abs(latest - previous) < NEAR * self.accuracy:
+                self.period = self.min_period
+            else:
+                self.period = min(2 * self.period, self.max_period)
+        return self.period
@@ -0,0 +1,224 @@
+import asyncio
+import datetime
+import logging
+import time
+import serial
+import InstrumentIO
+from Pump import FLOW_RATE_UNIT, Mode, State1, State2
+from PumpCodec import encode
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', filename='Balance.log', filemode='a')
+SAMPLE_VOLUME = 1.0  # mL dispensed per experiment
+FLOW_RATE = 60000  # pump flow rate, in SET_FLOW_RATE units
+ACCURACY = 1e-4  # g
+STEP_TIMEOUT = 60  # seconds one step of an experiment may take
+MAX_ATTEMPTS = 2  # rigs an experiment is tried on before it is given up
+# Failures that mean the rig itself is broken; anything else only fails the experiment
+DEVICE_ERRORS = (InstrumentIO.DeviceTimeout, serial.SerialException)
+DATE_FORMAT = '%Y-%m-%d'  # one of Pipeline.DATE_FORMATS
+
+
+class Rig:
+    # One rig: a balance under the sample cell, a pump filling it from the reservoir a
+    # selector valve picks, and probes for the other properties ({property: port} of
+    # instruments streaming "<value> <unit>" lines, see InstrumentIO.probeReading).
+    # reservoirs maps solvent names to valve positions; salts are expected to be dissolved
+    # in the reservoirs' stock solutions. Ports can be FakeSerial simulators. The balance
+    # readings of each sample go to telemetry (a Telemetry.TelemetryWriter), if given.
+    def __init__(self, name, balance, pump, valve, reservoirs, probes=None, pump_address=1, baud_rate=9600,
+                 temperature=25, volume=SAMPLE_VOLUME, flow_rate=FLOW_RATE, timeout=STEP_TIMEOUT, telemetry=None):
+        self.name = name
+        self.ports = dict({'balance': balance, 'pump': pump, 'valve': valve}, **(probes or {}))
+        self.probes = list(probes or {})
+        self.reservoirs = reservoirs
+        self.pump_address = pump_address
+        self.baud_rate = baud_rate
+        self.temperature = temperature
+        self.volume = volume
+        self.flow_rate = flow_rate
+        self.timeout = timeout
+        self.telemetry = telemetry
+        self.transports = {}
+        self.in_service = True
+        self.experiments = 0
+        self.busy = 0  # seconds spent on experiments
+
+    async def open(self):
+        for device, port in self.ports.items():
+            self.transports[device] = await InstrumentIO.openSerial(port, self.baud_rate)
+
+    def close(self):
+        for transport in self.transports.values():
+            transport.close()
+        self.transports = {}
+
+    async def step(self, operations):
+        # Runs {device: coroutine} at the same time; any failure or timeout fails the experiment
+        results = await InstrumentIO.runConcurrently(operations, default_timeout=self.timeout)
+        for result in results.values():
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+    async def runPump(self, state):
+        frame = encode(Mode.SET_FLOW_RATE, self.pump_address, state, State2.CLOCKWISE, self.flow_rate)
+        return await InstrumentIO.sendPumpCommand(self.transports['pump'], frame, len(frame))
+
+    async def dispense(self, volume):
+        # From the reservoir the valve is at; the pump runs from the start command to the stop.
+        # The stop is sent even if the dispense fails or is cancelled, e.g. by step's timeout.
+        start = time.perf_counter()
+        try:
+            await self.runPump(State1.START_PUMP)
+            await asyncio.sleep(start + volume / (self.flow_rate * FLOW_RATE_UNIT / 60) - time.perf_counter())
+        finally:
+            await InstrumentIO.withTimeout('pump', self.runPump(State1.STOP_PUMP), self.timeout)
+
+    def moveValve(self, position):
+        return InstrumentIO.moveValve(self.transports['valve'], position)
+
+    def weigh(self, run=None):
+        # Readings are recorded under run, if given
+        return InstrumentIO.streamMeasurement(self.transports['balance'], ACCURACY, self.telemetry if run else None, run)
+
+    def missing(self, solvents):
+        return [solvent for solvent in solvents if solvent not in self.reservoirs]
+
+    async def run(self, solvents, percentages):
+        # The measured properties of one sample and the telemetry run of its weighing (None
+        # without telemetry): the solvents are dispensed by volume fraction, one after the
+        # other, and weighed together
+        missing = self.missing(solvents)
+        if missing:
+            raise ValueError(f"{self.name} has no reservoir of {', '.join(missing)}")
+        positions = [self.reservoirs[solvent] for solvent in solvents]
+        # Taring overlaps the move to the first reservoir
+        tare = (await self.step({'balance': self.weigh(), 'valve': self.moveValve(positions[0])}))['balance']
+        for i, (position, percentage) in enumerate(zip(positions, percentages)):
+            if i > 0:
+                await self.step({'valve': self.moveValve(position)})
+            await self.step({'pump': self.dispense(self.volume * percentage / 100)})
+        trace = self.telemetry.newRun() if self.telemetry is not None else None
+        readings = {probe: InstrumentIO.probeReading(self.transports[probe]) for probe in self.probes}
+        values = await self.step(dict({'balance': self.weigh(trace)}, **readings))
+        mass = values.pop('balance') - tare
+        return dict({'Density': mass / self.volume, 'Mass': mass, 'Volume': self.volume,
+                     'Temperature': self.temperature}, **values), trace
+
+
+class Orchestrator:
+    # Runs a queue of composition IDs on several rigs at once, each rig taking the next one
+    # when it is free. Results go to submit(values), values being {property: value} for the
+    # app's ALL_INPUT properties, e.g. Pipeline.submit_measurement, which returns a future
+    # for the commit or an error message. parse(composition_id) gives the solvents and their
+    # percentages, e.g. CompositionParser.parse_composition_id. last_trial(composition_id,
+    # date) gives the highest Trial already stored, e.g. Pipeline.last_trial, so the trials of
+    # a run continue from earlier runs that day. An experiment that fails on a rig is tried
+    # again on another; if it failed with one of DEVICE_ERRORS the rig is taken out of service.
+    # Rigs with telemetry have the trace of each sample linked to the experiment it is saved as.
+    def __init__(self, rigs, submit, parse, last_trial=None, max_attempts=MAX_ATTEMPTS):
+        self.rigs = rigs
+        self.submit = submit
+        self.parse = parse
+        self.last_trial = last_trial
+        self.date = None
+        self.max_attempts = max_attempts
+        self.completed = []  # (composition ID, values), once committed
+        self.failed = []  # (composition ID, error)
+        self.commits = []  # (composition ID, values, future of the write buffer commit, rig, trace)
+        self.elapsed = None
+
+    def run(self, composition_ids):
+        return asyncio.run(self.runQueue(composition_ids))
+
+    async def runQueue(self, composition_ids):
+        start = time.perf_counter()
+        queue = asyncio.Queue()
+        try:
+            for rig in self.rigs:
+                try:
+                    await rig.open()
+                except serial.SerialException as e:
+                    logging.error(f"{rig.name} could not open its ports, taking it out of service: {e}")
+                    rig.in_service = False
+            self.fillQueue(queue, composition_ids)
+            # A rig taken out of service puts its experiment back after the others may have
+            # stopped, so the rigs still in service go again until the queue is empty
+            while not queue.empty() and any(rig.in_service for rig in self.rigs):
+                await asyncio.gather(*[self.work(rig, queue) for rig in self.rigs if rig.in_service])
+        finally:
+            for rig in self.rigs:
+                rig.close()
+        while not queue.empty():
+            composition_id, solvents, percentages, trial, attempts = queue.get_nowait()
+            self.failed.append((composition_id, 'No rig in service'))
+        # Done once the write buffer has committed every result; a batch that couldn't be
+        # written fails its experiments
+        for composition_id, values, commit, rig, trace in self.commits:
+            try:
+                experiment_id = await asyncio.wrap_future(commit)
+            except Exception as e:
+                logging.error(f"Result of {composition_id} could not be saved: {e}")
+                self.failed.append((composition_id, str(e)))
+                continue
+            self.completed.append((composition_id, values))
+            if trace is not None:
+                try:
+                    rig.telemetry.link(trace, experiment_id)
+                except Exception as e:
+                    # The result is saved; only its trace stays unlinked
+                    logging.error(f"Trace of {composition_id} could not be linked to experiment {experiment_id}: {e}")
+        self.elapsed = time.perf_counter() - start
+        return self.stats()
+
+    def fillQueue(self, queue, composition_ids):
+        # Experiments no rig in service can make fail here instead of on a rig
+        self.date = datetime.date.today().strftime(DATE_FORMAT)
+        trials = {}
+        for composition_id in composition_ids:
+            parsed = self.parse(composition_id)
+            if isinstance(parsed, str):
+                self.failed.append((composition_id, parsed))
+                continue
+            (solvents, percentages), salts = parsed
+            if all(rig.missing(solvents) for rig in self.rigs if rig.in_service):
+                self.failed.append((composition_id, f"No rig in service has reservoirs of {', '.join(solvents)}"))
+                continue
+            # Repeats of a composition in the queue are its next trials
+            if composition_id not in trials:
+                trials[composition_id] = self.last_trial(composition_id, self.date) if self.last_trial else 0
+            trials[composition_id] += 1
+            queue.put_nowait((composition_id, solvents, percentages, trials[composition_id], 0))
+
+    async def work(self, rig, queue):
+        while rig.in_service and not queue.empty():
+            composition_id, solvents, percentages, trial, attempts = queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                values, trace = await rig.run(solvents, percentages)
+            except Exception as e:
+                broken = isinstance(e, DEVICE_ERRORS)
+                logging.error(f"{rig.name} failed on {composition_id}{', taking it out of service' if broken else ''}: {e}")
+                if attempts + 1 < self.max_attempts:
+                    queue.put_nowait((composition_id, solvents, percentages, trial, attempts + 1))
+                else:
+                    self.failed.append((composition_id, str(e)))
+                if broken:
+                    rig.in_service = False
+                    return
+                continue
+            rig.experiments += 1
+            rig.busy += time.perf_counter() - start
+            values.update({'CompositionID': composition_id, 'Date': self.date, 'Trial': trial})
+            result = self.submit(values)
+            if isinstance(result, str):
+                self.failed.append((composition_id, result))
+            else:
+                self.commits.append((composition_id, values, result, rig, trace))
+
+    def stats(self):
+        hours = self.elapsed / 3600 if self.elapsed else None
+        return {'experiments': len(self.completed), 'failed': len(self.failed), 'elapsed_s': self.elapsed,
+                'experiments_per_hour': len(self.completed) / hours if hours else None,
+                'rigs': {rig.name: {'experiments': rig.experiments, 'in_service': rig.in_service,
+                                    'utilization': rig.busy / self.elapsed if self.elapsed else None} for rig in self.rigs}}
@@ -18,6 +18,7 @@ class State2(Enum):
     CLOCKWISE = 1
 
 baud_rate = {1200:1, 2400:2, 4800:3, 9600:4, 19200:5, 38400:6}
+FLOW_RATE_UNIT = 0.001  # mL/min per unit of a SET_FLOW_RATE flow rate (uL/min)
 
 class Parity(Enum):
     NO_PARITY = 1
@@ -56,20 +57,10 @@ def generate_bytes(num, n):
     return result
 
 def generate_command(*args):
-    pdu = get_pdu(args[0])
-    command = [233, args[1]]
-    #Default Read mode: # (Mode, Pump address)
-    # (Mode, Pump address, State1, State2, Speed)
-    if args[0] == Mode.SET_ROTATION_SPEED:
-        pdu += generate_bytes(args[4], 2) + [args[2].value, args[3].value]
-    # (Mode, Pump address, State1, State2, Flow rate)
-    elif args[0] == Mode.SET_FLOW_RATE:
-        pdu += generate_bytes(args[4], 4) + [args[2].value, args[3].value]
-    # (Mode, Pump address, Baud rate, Parity, Stop bit)
-    elif args[0] == Mode.FLOW_CALIBRATION:
-        pdu += [baud_rate[args[2]], args[3].value, args[4]]
-    fcs = xor_bytes([args[1]] + pdu)
-    command = ' '.join([format(i, '02X') for i in [233, args[1]] + pdu + [fcs]])
-    return command
+    # (Mode, Pump address), (Mode, Pump address, State1, State2, Speed or Flow rate) or
+    # (Mode, Pump address, Baud rate, Parity, Stop bit); PumpCodec.encode gives the bytes
+    from PumpCodec import encode
+    return encode(*args).hex(' ').upper()
 
-print(generate_command(Mode.FLOW_CALIBRATION, 13, 19200, Parity.EVEN_PARITY, 1))
\ No newline at end of file
+if __name__ == '__main__':
+    print(generate_command(Mode.FLOW_CALIBRATION, 13, 19200, Parity.EVEN_PARITY, 1))
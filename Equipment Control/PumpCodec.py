@@ -0,0 +1,132 @@
+import struct
+from collections import namedtuple
+from functools import reduce
+from operator import xor
+from Pump import Mode, Parity, State1, State2, baud_rate, get_pdu
+
+START = 0xE9
+# Frame: START, address, PDU, FCS. The PDU's first byte is its length minus one and the
+# FCS is the XOR of the address and the PDU.
+
+# Fields after each mode's fixed PDU header, in frame order, how they are packed and where
+# they are among generate_command's arguments after the address
+PAYLOADS = {
+    Mode.SET_ROTATION_SPEED: ('HBB', ('speed', 'state1', 'state2'), (2, 0, 1)),
+    Mode.READ_ROTATION_SPEED: ('', (), ()),
+    Mode.SET_FLOW_RATE: ('IBB', ('flow_rate', 'state1', 'state2'), (2, 0, 1)),
+    Mode.READ_FLOW_RATE: ('', (), ()),
+    Mode.FLOW_CALIBRATION: ('BBB', ('baud_rate', 'parity', 'stop_bit'), (0, 1, 2)),
+}
+
+Template = namedtuple('Template', ['mode', 'header', 'packer', 'header_fcs', 'fields', 'arguments', 'unpacker'])
+Frame = namedtuple('Frame', ['address', 'mode', 'fields', 'pdu'])
+
+
+def enum_value(member):
+    return member.value
+
+
+def same(value):
+    return value
+
+
+# Packed value of each field from its argument, and the field back from the packed value
+ENCODERS = {'state1': enum_value, 'state2': enum_value, 'parity': enum_value, 'baud_rate': baud_rate.__getitem__}
+DECODERS = {'state1': State1, 'state2': State2, 'parity': Parity,
+            'baud_rate': {code: rate for rate, code in baud_rate.items()}.__getitem__}
+
+
+def build_templates():
+    # By mode value, so modes from Pump run as a script work too
+    templates = {}
+    for mode, (payload, fields, order) in PAYLOADS.items():
+        header = bytes(get_pdu(mode))
+        # START, address, header, payload; the FCS is appended separately
+        packer = struct.Struct('>BB' + f'{len(header)}s' + payload)
+        arguments = tuple((ENCODERS.get(name, same), i) for name, i in zip(fields, order))
+        templates[mode.value] = Template(mode, header, packer, reduce(xor, header, 0), fields, arguments,
+                                         struct.Struct('>' + payload))
+    return templates
+
+
+TEMPLATES = build_templates()
+# Templates by PDU header, for decoding; longer headers first so prefixes can't shadow them
+HEADERS = sorted(((template.header, template) for template in TEMPLATES.values()), key=lambda item: -len(item[0]))
+
+
+def fcs(data):
+    return reduce(xor, data, 0)
+
+
+def pack_frame(address, pdu):
+    # Any PDU framed for address, e.g. to answer with
+    return bytes([START, address]) + pdu + bytes([address ^ fcs(pdu)])
+
+
+def encode(mode, address, *args):
+    # The frame generate_command describes, as bytes; args are in generate_command's order
+    template = TEMPLATES[mode.value]
+    frame = template.packer.pack(START, address, template.header,
+                                 *[convert(args[i]) for convert, i in template.arguments])
+    return frame + bytes([address ^ template.header_fcs ^ fcs(frame[2 + len(template.header):])])
+
+
+def encode_batch(commands):
+    # One buffer with a frame per (mode, address, *args), e.g. for pumps sharing a bus
+    return b''.join(encode(*command) for command in commands)
+
+
+def encode_many(mode, addresses, *args):
+    # The same command for many pumps
+    pdu = encode(mode, addresses[0], *args)[2:-1]
+    pdu_fcs = fcs(pdu)
+    return b''.join(bytes([START, address]) + pdu + bytes([address ^ pdu_fcs]) for address in addresses)
+
+
+def decode(address, pdu):
+    # Frame with the mode and fields of a PDU, or mode None if no template matches
+    for header, template in HEADERS:
+        if pdu.startswith(header) and len(pdu) == len(header) + template.unpacker.size:
+            values = template.unpacker.unpack_from(pdu, len(header))
+            fields = {name: DECODERS.get(name, same)(value) for name, value in zip(template.fields, values)}
+            return Frame(address, template.mode, fields, pdu)
+    return Frame(address, None, {}, pdu)
+
+
+class FrameParser:
+    # Splits a byte stream into frames. Bytes before a START are skipped; a frame whose FCS
+    # doesn't match is dropped and the search goes on after its START byte.
+    def __init__(self):
+        self.buffer = bytearray()
+        self.frames = 0
+        self.fcs_errors = 0
+        self.skipped = 0
+
+    def feed(self, data):
+        # The frames completed by data, decoded
+        buffer = self.buffer
+        buffer += data
+        frames = []
+        position = 0
+        while True:
+            start = buffer.find(START, position)
+            if start < 0:
+                self.skipped += len(buffer) - position
+                position = len(buffer)
+                break
+            self.skipped += start - position
+            position = start
+            if len(buffer) - start < 3:
+                break
+            end = start + buffer[start + 2] + 4
+            if end > len(buffer):
+                break
+            if fcs(buffer[start + 1:end - 1]) != buffer[end - 1]:
+                self.fcs_errors += 1
+                position = start + 1
+                continue
+            frames.append(decode(buffer[start + 1], bytes(buffer[start + 2:end - 1])))
+            self.frames += 1
+            position = end
+        del buffer[:position]
+        return frames
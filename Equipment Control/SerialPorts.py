@@ -0,0 +1,64 @@
+import logging
+import threading
+from contextlib import contextmanager
+import serial
+
+READ_TIMEOUT = 1  # seconds a read waits for a device's answer
+
+
+class SharedPort:
+    # One open handle to a serial port. Devices on the same bus (e.g. addressed valves)
+    # share it; exchange() keeps their command and answer from interleaving.
+    def __init__(self, port_num, baud_rate):
+        self.port_num = port_num
+        self.baud_rate = baud_rate
+        self.ser = serial.Serial(port_num, baud_rate, timeout=READ_TIMEOUT)
+        self.lock = threading.RLock()
+        self.users = 0
+        logging.info(f'Successfully opened serial port {port_num} at baud rate {baud_rate}.')
+
+    @contextmanager
+    def exchange(self):
+        # Holds the bus for one command and its answer
+        with self.lock:
+            yield self.ser
+
+    def close(self):
+        self.ser.close()
+
+
+class PortManager:
+    # Keeps one SharedPort per port name for as long as some device uses it, instead of
+    # opening and closing the port on every command
+    def __init__(self):
+        self.ports = {}
+        self.lock = threading.Lock()
+        self.opens = 0
+
+    def acquire(self, port_num, baud_rate):
+        with self.lock:
+            port = self.ports.get(port_num)
+            if port is None:
+                port = SharedPort(port_num, baud_rate)
+                self.ports[port_num] = port
+                self.opens += 1
+            elif port.baud_rate != baud_rate:
+                raise ValueError(f'{port_num} is already open at baud rate {port.baud_rate}')
+            port.users += 1
+            return port
+
+    def release(self, port):
+        with self.lock:
+            port.users -= 1
+            if port.users == 0:
+                del self.ports[port.port_num]
+                port.close()
+
+    def closeAll(self):
+        with self.lock:
+            for port in self.ports.values():
+                port.close()
+            self.ports.clear()
+
+
+ports = PortManager()
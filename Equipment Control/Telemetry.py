@@ -0,0 +1,114 @@
+import sqlite3
+import threading
+import time
+import uuid
+
+TELEMETRY_TABLE = 'balance_telemetry'  # Migrations.TELEMETRY_TABLE
+TELEMETRY_VERSION = 4  # schema version (PRAGMA user_version) whose migration created the table
+BATCH_SIZE = 500  # readings that get written at once without waiting for FLUSH_INTERVAL
+FLUSH_INTERVAL = 0.5  # seconds a reading waits for others before it is written
+# The app's connection settings (ConnectionPool.PRAGMAS): in WAL mode with synchronous
+# NORMAL a commit doesn't wait for the disk
+PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'NORMAL'}
+
+
+class TelemetryWriter:
+    # Records raw readings in the database's telemetry table instead of logging every one.
+    # add() only queues a reading; a background thread writes the queue in one transaction
+    # once BATCH_SIZE readings are waiting or the oldest has waited FLUSH_INTERVAL. Each
+    # measurement is a run; link() attaches a run to the experiment (its integer ID) once
+    # that is saved. The app creates the table when it opens the database, so it has to
+    # have opened it once.
+    def __init__(self, db_file, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.conn = sqlite3.connect(db_file, timeout=30, check_same_thread=False)
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < TELEMETRY_VERSION:
+            self.conn.close()
+            raise RuntimeError(f'{db_file} has no {TELEMETRY_TABLE} table yet; open it with the app first')
+        for name, value in PRAGMAS.items():
+            self.conn.execute(f"PRAGMA {name} = {value}")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.since = None  # when the oldest pending reading was added
+        self.writing = False
+        self.flushing = 0
+        self.closed = False
+        self.error = None
+        self.condition = threading.Condition()
+        self.lock = threading.Lock()  # the connection
+        self.batches = 0
+        self.rows = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def newRun(self):
+        return uuid.uuid4().hex
+
+    def add(self, run, t, value):
+        with self.condition:
+            if not self.pending:
+                self.since = time.monotonic()
+            self.pending.append((run, t, value))
+            # The writer starts timing the first reading and writes at batch_size
+            if len(self.pending) in (1, self.batch_size):
+                self.condition.notify_all()
+
+    def due(self):
+        return self.pending and (self.flushing or len(self.pending) >= self.batch_size
+                                 or time.monotonic() - self.since >= self.flush_interval)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.due():
+                    if self.closed:
+                        return
+                    self.condition.wait(self.since + self.flush_interval - time.monotonic() if self.pending else None)
+                batch, self.pending = self.pending, []
+                self.writing = True
+            try:
+                self.write(batch)
+            except sqlite3.Error as e:
+                # Raised by the next flush
+                self.error = e
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+    def write(self, batch):
+        with self.lock, self.conn:
+            self.conn.executemany(f"INSERT INTO {TELEMETRY_TABLE} (run, time, value) VALUES (?, ?, ?)", batch)
+        self.batches += 1
+        self.rows += len(batch)
+
+    def flush(self):
+        # Waits until every reading added so far is written
+        with self.condition:
+            self.flushing += 1
+            self.condition.notify_all()
+            self.condition.wait_for(lambda: not self.pending and not self.writing)
+            self.flushing -= 1
+            error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def link(self, run, experiment_id):
+        self.flush()
+        with self.lock, self.conn:
+            self.conn.execute(f"UPDATE {TELEMETRY_TABLE} SET experiment = ? WHERE run = ?", (experiment_id, run))
+
+    def trace(self, run):
+        # (times, values) of a run, in order
+        self.flush()
+        with self.lock:
+            rows = self.conn.execute(f"SELECT time, value FROM {TELEMETRY_TABLE} WHERE run = ? ORDER BY time", (run,)).fetchall()
+        return [row[0] for row in rows], [row[1] for row in rows]
+
+    def close(self):
+        self.flush()
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.conn.close()
@@ -1,26 +1,94 @@
 import serial
 import time
 import logging
+import re
+from SerialPorts import ports
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', filename='Balance.log', filemode='a')
+POLL_INITIAL = 0.01  # seconds before the first position query after GO
+POLL_MAX = 0.1  # longest wait between position queries
+MOVE_TIMEOUT = 30  # seconds a valve may take to reach its position
+
+class ValveTimeout(Exception):
+    pass
+
+class ValveDriver:
+    # A multi-position valve on a port shared through SerialPorts.ports. address prefixes
+    # its commands when several valves are on one bus.
+    def __init__(self, port_num, baud_rate, address=None, manager=ports):
+        self.manager = manager
+        self.port = manager.acquire(port_num, baud_rate)
+        self.prefix = '' if address is None else str(address)
+        self.commands_sent = 0
+        self.moves = 0
+        self.timeouts = 0
+        self.total_time = 0
+        self.last_time = None
+        self.max_time = 0
+
+    def command(self, text, answer_size=0):
+        with self.port.exchange() as ser:
+            ser.write(f"{self.prefix}{text}\r".encode())
+            self.commands_sent += 1
+            return ser.read(answer_size).decode('utf-8').strip() if answer_size else ''
+
+    def position(self):
+        answer = self.command('CP', len(self.prefix) + 4)
+        match = re.fullmatch(re.escape(self.prefix) + r'CP(\d+)', answer)
+        if match is None:
+            raise serial.SerialException(f'Unexpected answer to CP: {answer!r}')
+        return int(match.group(1))
+
+    def moveTo(self, dest, timeout=MOVE_TIMEOUT):
+        # Sends GO once, then polls the position with capped exponential backoff until the
+        # valve is at dest or timeout passes. Returns the seconds it took.
+        start = time.perf_counter()
+        if self.position() == dest:
+            return 0
+        self.command(f'GO{dest}')
+        delay = POLL_INITIAL
+        while True:
+            remaining = start + timeout - time.perf_counter()
+            if remaining <= 0:
+                self.timeouts += 1
+                raise ValveTimeout(f'Valve on {self.port.port_num} did not reach position {dest} within {timeout} s')
+            time.sleep(min(delay, remaining))
+            delay = min(2 * delay, POLL_MAX)
+            if self.position() == dest:
+                break
+        elapsed = time.perf_counter() - start
+        self.moves += 1
+        self.total_time += elapsed
+        self.last_time = elapsed
+        self.max_time = max(self.max_time, elapsed)
+        logging.info(f'Valve on {self.port.port_num} reached position {dest} in {elapsed:.3f} s')
+        return elapsed
+
+    def stats(self):
+        return {'commands_sent': self.commands_sent, 'moves': self.moves, 'timeouts': self.timeouts,
+                'last_time_to_position': self.last_time, 'max_time_to_position': self.max_time,
+                'mean_time_to_position': self.total_time / self.moves if self.moves else None}
+
+    def close(self):
+        self.manager.release(self.port)
+
+# Drivers go reuses, so the port stays open between calls
+valves = {}
+
+def getValve(port_num, baud_rate, address=None):
+    key = (port_num, address)
+    if key not in valves:
+        valves[key] = ValveDriver(port_num, baud_rate, address)
+    return valves[key]
+
+def closeValves():
+    for valve in valves.values():
+        valve.close()
+    valves.clear()
+
 def go(port_num, baud_rate, dest):
     try:
-        ser = serial.Serial(port_num, baud_rate, timeout=1)
-        logging.info(f'Successfully opened serial port {port_num} at baud rate {baud_rate}.')
-    except serial.SerialException as e:
-        logging.error(f"Error opening serial port: {e}")
+        getValve(port_num, baud_rate).moveTo(dest)
+    except (serial.SerialException, ValueError, ValveTimeout) as e:
+        logging.error(f"Error moving valve on {port_num} to {dest}: {e}")
         return None
-        
-    while True:
-        try:
-            command = "CP\r"
-            ser.write(command.encode())
-            response = int(ser.read(4).decode('utf-8').strip()[2:])
-            if response != dest:
-                command = f"GO{dest}\r"
-                ser.write(command.encode()) 
-            else:
-                ser.close()
-                return
-        except:
-            return
\ No newline at end of file
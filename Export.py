@@ -0,0 +1,142 @@
+import base64
+import json
+import zlib
+import pandas as pd
+import Pipeline
+from ConnectionPool import open_connection
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+CHUNK_SIZE = 10000  # rows read from the cursor and written out at a time
+ROUTE = '/export'
+FORMATS = {
+    'csv': 'text/csv',
+    'csv.gz': 'application/gzip',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def available_formats():
+    return [current for current in FORMATS if current != 'parquet' or pa is not None]
+
+
+def encode_options(options):
+    return base64.urlsafe_b64encode(json.dumps(options, default=str).encode('utf-8')).decode('ascii')
+
+
+def decode_options(token):
+    options = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    if not isinstance(options, dict):
+        raise ValueError('Export options must be an object')
+    return options
+
+
+def export_url(options, export_format):
+    return f"{ROUTE}?format={export_format}&options={encode_options(options)}"
+
+
+def format_chunk(rows, columns):
+    # Formatted like generate_df. Whether an integer column reads as int64 or float64 depends
+    # on a chunk having NULLs, so they are all float64 to keep every chunk of a file the same.
+    df = Pipeline.format_results(pd.DataFrame.from_records(rows, columns=columns))
+    integers = df.select_dtypes('integer').columns
+    df[integers] = df[integers].astype('float64')
+    return df
+
+
+def read_chunks(query, params, chunk_size=CHUNK_SIZE, db_file=Pipeline.DEFAULT_DB):
+    conn = open_connection(db_file)
+    try:
+        cursor = conn.execute(query, params)
+        columns = [current[0] for current in cursor.description]
+        # An empty result still gives one (empty) chunk, so files get their header
+        yield format_chunk(cursor.fetchmany(chunk_size), columns)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield format_chunk(rows, columns)
+    finally:
+        conn.close()
+
+
+def stream_csv(chunks):
+    header = True
+    for df in chunks:
+        yield df.to_csv(index=False, header=header).encode('utf-8')
+        header = False
+
+
+def stream_gzip(parts):
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    for part in parts:
+        compressed = compressor.compress(part)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class ChunkSink:
+    # Write only file object for ParquetWriter; what was written so far is taken out after every row group
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+        self.position = 0
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def stream_parquet(chunks):
+    # One row group per chunk, with the first chunk's schema. Integers in object columns
+    # (e.g. the 0 filled into columns without values) are widened to float64 as well.
+    sink = ChunkSink()
+    writer = None
+    schema = None
+    for df in chunks:
+        if writer is None:
+            schema = pa.Schema.from_pandas(df, preserve_index=False)
+            schema = pa.schema([pa.field(field.name, pa.float64()) if pa.types.is_integer(field.type) else field
+                                for field in schema])
+            writer = pq.ParquetWriter(sink, schema)
+        writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+    yield sink.drain()
+
+
+def export(options, export_format, chunk_size=CHUNK_SIZE, db_file=Pipeline.DEFAULT_DB):
+    # Generator of the file's bytes. The filter is compiled here, so bad options raise
+    # ValueError before anything is sent. Association values are looked up per row, so
+    # SQLite doesn't hold pivoted tables in memory either.
+    if export_format not in available_formats():
+        raise ValueError(f'Unsupported export format {export_format}')
+    query, params = Pipeline.compile_df_query(options, lookups=True)
+    chunks = read_chunks(query, params, chunk_size, db_file)
+    if export_format == 'parquet':
+        return stream_parquet(chunks)
+    parts = stream_csv(chunks)
+    if export_format == 'csv.gz':
+        return stream_gzip(parts)
+    return parts
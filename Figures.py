@@ -0,0 +1,146 @@
+import datetime
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+POINT_BUDGET = 20000  # points per figure; larger results are drawn from per-voxel averages
+MARGIN = 0.3  # space around a property's values on its axis, as a fraction of their range
+MAX_BINS = 1024  # finest grid tried per dimension
+WORKERS = min(4, os.cpu_count() or 1)  # threads building figures; 1 builds them in the calling thread
+PARALLEL_FIGURES = 12  # figures from which on the groups are shared out among the threads; show_graph
+# builds at most Main.LAZY_FIGURES - 1 at once
+
+executor = None
+executor_lock = threading.Lock()
+
+
+def axis_range(low, high):
+    return [low - MARGIN * (high - low), high + MARGIN * (high - low)]
+
+
+def value_range(values):
+    # axis_range of a column's values, for columns without known bounds
+    values = np.asarray(values, dtype='float64')
+    return axis_range(float(np.nanmin(values)), float(np.nanmax(values)))
+
+
+def is_date(series):
+    # generate_df shows Date as datetime.date objects
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return True
+    values = series.dropna()
+    return series.dtype == object and len(values) > 0 and isinstance(values.iloc[0], datetime.date)
+
+
+def plot_values(series):
+    # A column as float64 for binning and plotting. Dates become milliseconds since the
+    # epoch, which plotly's date axes show as dates.
+    if is_date(series):
+        return ((pd.to_datetime(series) - pd.Timestamp(0)) / pd.Timedelta(milliseconds=1)).to_numpy(dtype='float64')
+    return series.to_numpy(dtype='float64')
+
+
+def voxel_means(values, budget=POINT_BUDGET):
+    # Puts the rows (points in len(columns) dimensions) on the finest grid that leaves at
+    # most budget occupied voxels and returns each voxel's mean point and number of points
+    low = values.min(axis=0)
+    span = values.max(axis=0) - low
+    span[span == 0] = 1
+    dimensions = values.shape[1]
+
+    def voxels(bins):
+        cells = np.minimum(((values - low) / span * bins).astype(np.int64), bins - 1)
+        return np.unique(np.ravel_multi_index(cells.T, (bins,) * dimensions), return_inverse=True, return_counts=True)
+
+    # Voxel numbers have to fit in an int64. Finer grids occupy more voxels, so the
+    # number of bins is found by bisection.
+    fine, coarse = min(MAX_BINS, int(2 ** (62 / dimensions))), 1
+    result = voxels(fine)
+    if len(result[0]) > budget:
+        result = voxels(coarse)
+        while fine - coarse > 1:
+            middle = (fine + coarse) // 2
+            current = voxels(middle)
+            if len(current[0]) <= budget:
+                coarse, result = middle, current
+            else:
+                fine = middle
+    occupied, inverse, counts = result
+    means = np.column_stack([np.bincount(inverse, weights=values[:, i], minlength=len(occupied)) for i in range(dimensions)])
+    return means / counts[:, None], counts
+
+
+def figure_groups(variable_names):
+    # The variables plotted together: each one alone, or each pair of them in 3D
+    if len(variable_names) == 1:
+        return [(variable_names[0],)]
+    return [(variable_names[i], variable_names[j]) for i in range(len(variable_names)) for j in range(i + 1, len(variable_names))]
+
+
+def group_figures(values, axes, properties, ranges, budget=POINT_BUDGET, dates=()):
+    # The figures of one group as dicts for dcc.Graph: one per property, sharing one customdata
+    # array for the hover. values holds the group's variables, then the properties; the
+    # variables in dates are plot_values of dates and get a date axis.
+    # Above budget points, a figure shows per-voxel averages over its variables and all the
+    # properties, with the number of points averaged in the hover, and 2D figures use WebGL.
+    counts = None
+    if len(values) > budget:
+        values, counts = voxel_means(values, budget)
+    customdata = values[:, len(axes):]
+    hover_template_parts = [f"{current}: %{{customdata[{i}]}}" for i, current in enumerate(properties)]
+    if counts is not None:
+        customdata = np.column_stack([customdata, counts])
+        hover_template_parts.append(f"Points: %{{customdata[{len(properties)}]}}")
+    hover_template = '<br>'.join(hover_template_parts) + '<extra></extra>'
+    axis_types = [dict(type='date') if current in dates else {} for current in axes]
+    figures = []
+    for index, property in enumerate(properties):
+        z = values[:, len(axes) + index]
+        if len(axes) == 1:
+            scatter = go.Scattergl if counts is not None else go.Scatter
+            figure = go.Figure(scatter(x=values[:, 0], y=z, mode='markers', customdata=customdata,
+                                       hovertemplate=axes[0] + ': %{x}<br>' + hover_template))
+            figure.update_layout(xaxis=dict(title=axes[0], **axis_types[0]), yaxis=dict(title=property, range=ranges[property]))
+        else:
+            figure = go.Figure(go.Scatter3d(x=values[:, 0], y=values[:, 1], z=z, mode='markers', customdata=customdata,
+                                            hovertemplate=axes[0] + ': %{x}<br>' + axes[1] + ': %{y}<br>' + hover_template))
+            figure.update_layout(scene=dict(xaxis=dict(title=axes[0], **axis_types[0]), yaxis=dict(title=axes[1], **axis_types[1]),
+                                            zaxis=dict(title=property, range=ranges[property])))
+        figures.append(figure.to_plotly_json())
+    return figures
+
+
+def get_executor():
+    global executor
+    with executor_lock:
+        if executor is None and WORKERS > 1:
+            executor = ThreadPoolExecutor(WORKERS, thread_name_prefix='figures')
+        return executor
+
+
+def build_figures(df, variable_names, properties, budget=POINT_BUDGET, groups=None, ranges=None, parallel=True):
+    # Figure dicts for the given groups (all of figure_groups by default), in group order.
+    # ranges maps properties to their axis range; the others get the range of their values in df.
+    # From PARALLEL_FIGURES figures on the groups are built in a thread pool. Threads share
+    # the figure dicts without pickling them, unlike worker processes.
+    if groups is None:
+        groups = figure_groups(variable_names)
+    ranges = dict(ranges or {})
+    for current in properties:
+        if current not in ranges:
+            ranges[current] = value_range(df[current])
+    dates = {current for current in variable_names if is_date(df[current])}
+    # Each column is converted once, however many groups it is in
+    columns = {current: plot_values(df[current]) for current in {axis for axes in groups for axis in axes} | set(properties)}
+    tasks = [(np.column_stack([columns[current] for current in list(axes) + properties]), axes, properties, ranges, budget, dates)
+             for axes in groups]
+    pool = get_executor() if parallel and len(groups) > 1 and len(groups) * len(properties) >= PARALLEL_FIGURES else None
+    if pool is None:
+        results = [group_figures(*task) for task in tasks]
+    else:
+        # map returns the results in task order
+        results = pool.map(group_figures, *zip(*tasks))
+    return [figure for figures in results for figure in figures]
@@ -0,0 +1,102 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = 2  # uploads validated at the same time; their writes still go through the one writer
+MAX_FINISHED = 100  # finished jobs whose status is kept for polling
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, description):
+        self.id = uuid.uuid4().hex
+        self.description = description
+        self.state = QUEUED
+        self.progress = {}
+        self.message = None
+        self.cancel_requested = threading.Event()
+        self.submitted = time.time()
+        self.finished = None
+
+    def update(self, progress):
+        # Called by the job's function between steps; raises Cancelled once cancel() was called
+        self.progress = dict(progress)
+        self.check()
+
+    def check(self):
+        if self.cancel_requested.is_set():
+            raise Cancelled()
+
+    def status(self):
+        return {'id': self.id, 'description': self.description, 'state': self.state,
+                'progress': self.progress, 'message': self.message}
+
+
+class IngestJobs:
+    # Background jobs for uploads, so a large file never holds a request thread. Jobs run on
+    # a small worker pool and hand every database write to a single writer thread (see write),
+    # which keeps concurrent jobs from contending for SQLite's write lock.
+    # Jobs live in this process's memory: the app is served by one process.
+    def __init__(self, workers=JOB_WORKERS):
+        self.workers = ThreadPoolExecutor(workers, thread_name_prefix='ingest-job')
+        self.writer = ThreadPoolExecutor(1, thread_name_prefix='sqlite-writer')
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, function, description=''):
+        # Runs function(job) in the background and returns the job's ID.
+        # function's return value becomes the job's message.
+        job = Job(description)
+        with self.lock:
+            self.jobs[job.id] = job
+            self.prune()
+        self.workers.submit(self.run, job, function)
+        return job.id
+
+    def run(self, job, function):
+        try:
+            job.check()
+            job.state = RUNNING
+            job.message = function(job)
+            job.state = DONE
+        except Cancelled:
+            job.state = CANCELLED
+            job.message = 'Cancelled' + (f" after {job.progress['inserted']} rows were saved" if job.progress.get('inserted') else '')
+        except Exception as e:
+            job.state = FAILED
+            job.message = f'An error occurred: {e}'
+        finally:
+            job.finished = time.time()
+
+    def write(self, function, *args, **kwargs):
+        # Runs function on the writer thread and returns its result
+        return self.writer.submit(function, *args, **kwargs).result()
+
+    def status(self, job_id):
+        job = self.jobs.get(job_id)
+        return None if job is None else job.status()
+
+    def cancel(self, job_id):
+        # Takes effect at the job's next step; rows it already saved stay
+        job = self.jobs.get(job_id)
+        if job is None or job.state in FINISHED:
+            return False
+        job.cancel_requested.set()
+        return True
+
+    def prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.state in FINISHED]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED)]:
+            del self.jobs[job_id]
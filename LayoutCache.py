@@ -0,0 +1,28 @@
+import threading
+
+
+class LayoutCache:
+    # Built Dash component trees, one per section of a page, each with the key it was built
+    # for. A section is built again only when its key changes, and only its latest tree is
+    # kept, so memory doesn't grow with page loads. Cached trees are shared between requests
+    # and must not be modified.
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.builds = 0
+
+    def get(self, name, key, build, *args):
+        entry = self.entries.get(name)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        value = build(*args)
+        with self.lock:
+            self.entries[name] = (key, value)
+            self.builds += 1
+        return value
+
+    def keep(self, names):
+        # Drops the sections not in names, e.g. of association tables that are gone
+        with self.lock:
+            for name in [current for current in self.entries if current not in names]:
+                del self.entries[name]
@@ -6,15 +6,22 @@ import pandas as pd
 import numpy as np
 import dash_bootstrap_components as dbc
 from Pipeline import *
+from Pagination import KeysetPager, PAGE_SIZE
+import Export
+from Figures import build_figures, figure_groups
+from IngestJobs import DONE, FINISHED
+from LayoutCache import LayoutCache
+from flask import Response, request, stream_with_context
 from io import StringIO
 import datetime
-import binascii
 
 app = Dash(__name__, suppress_callback_exceptions=True)
 input_properties = ["CompositionID"]
 GUID_LENGTH = 32
-labels = []
-MARGIN = 0.3
+layout_cache = LayoutCache()
+table_pager = KeysetPager()
+LAZY_FIGURES = 24  # from this many figures on, show_graph puts each group of variables in a tab
+UPLOAD_POLL_INTERVAL = 500  # ms between progress updates of a running upload
 
 # Define the layout of the app
 app.layout = html.Div([
@@ -58,6 +65,12 @@ input_content = [
         },
     ),
     dbc.Alert(id='file-alert', is_open=False, duration=4000),
+    # Uploads are ingested in the background; their progress is polled while one runs
+    html.Div([dbc.Progress(id='upload-progress', value=0, label='', style={'flex': '1'}),
+              html.Button('Cancel upload', id='cancel-upload', n_clicks=0, disabled=True)],
+             style={'display': 'flex', 'padding': '10px', 'flex-direction': 'row'}),
+    dcc.Store(id='upload-job', data=None),
+    dcc.Interval(id='upload-poll', interval=UPLOAD_POLL_INTERVAL, disabled=True),
     html.Div('Alternatively, you can manually enter the lab data.'),
     
     html.Div([item for pair in zip([f"{ALL_INPUT['Property'].iloc[i]} {ALL_INPUT['Units'].iloc[i]}" for i in range(len(ALL_INPUT['Property']))], 
@@ -93,65 +106,114 @@ def input_data(n_clicks, *args):
     insert_new_data(compositions)
     return ['Data submitted successfully', True]
 
-@app.callback([Output('file-alert', 'children'), Output('file-alert', 'is_open')],
+@app.callback([Output('upload-job', 'data'), Output('upload-poll', 'disabled'), Output('cancel-upload', 'disabled')],
               Input('upload-file', 'contents'),
               State('upload-file', 'filename'),
               prevent_initial_call=True)
 def update_output(contents, filename):
-    if contents is not None:
-        children = parse_contents(contents, filename)
-        return [children, True]
+    # Only queues the upload, so the request returns at once
+    if contents is None:
+        return [None, True, True]
+    return [submit_upload(contents, filename), False, False]
+
+@app.callback([Output('upload-progress', 'value'), Output('upload-progress', 'label'),
+               Output('file-alert', 'children'), Output('file-alert', 'is_open'),
+               Output('upload-poll', 'disabled', allow_duplicate=True), Output('cancel-upload', 'disabled', allow_duplicate=True)],
+              Input('upload-poll', 'n_intervals'),
+              State('upload-job', 'data'),
+              prevent_initial_call=True)
+def poll_upload(n_intervals, job_id):
+    status = ingest_jobs.status(job_id)
+    if status is None:
+        return [0, '', 'The upload was lost, please try again.', True, True, True]
+    progress = status['progress']
+    value = round(100 * progress.get('fraction', 0))
+    label = f"{progress.get('inserted', 0)} of {progress.get('rows', 0)} rows saved" if progress else status['state']
+    if status['state'] not in FINISHED:
+        return [value, label, '', False, False, False]
+    return [100 if status['state'] == DONE else value, label, status['message'], True, True, True]
+
+@app.callback(Output('cancel-upload', 'disabled', allow_duplicate=True),
+              Input('cancel-upload', 'n_clicks'),
+              State('upload-job', 'data'),
+              prevent_initial_call=True)
+def cancel_upload(n_clicks, job_id):
+    # The next poll reports the cancellation
+    ingest_jobs.cancel(job_id)
+    return True
 
 @app.callback(
     Output('container', 'children'),
     Input('form-options', 'data')
 )
 def generate_options(a):
+    # The dependent and independent sections only change with the date their date filters
+    # default to; an association section changes with its names and their column stats
     form_options = get_choices()
+    column_stats.current()  # reads the stats again after a write, bumping their version
     form_elements = []
     for category in form_options:
-        column = [html.Label(category['Title']), 
+        if category['Title'] in (DEPENDENT_VARIABLE, INDEPENDENT_VARIABLE):
+            key = datetime.date.today()
+            build = variable_section
+        else:
+            key = (tuple(category['Options']), column_stats.version)
+            build = association_section
+        form_elements.append(layout_cache.get(category['Title'], key, build, category))
+    layout_cache.keep([category['Title'] for category in form_options])
+    return form_elements
+
+def section_header(title):
+    return [html.Label(title),
         dcc.RadioItems(
-            id=category['Title'] + '-radio',  # ID for callback reference
+            id=title + '-radio',  # ID for callback reference
             options=[
                 {'label': 'and', 'value': 'and'},
                 {'label': 'or', 'value': 'or'},
             ],
             value='or'  # Default selected value
         )]
-        variables = PROPERTY if category['Title'] == 'Dependent variables' else INPUT
-        if category['Title'] == 'Dependent variables' or category['Title'] == 'Independent variables':
-            for index, row in variables.iterrows():
-                structure = row['Type'].selectstructure(row['Property'])
-                labels.append(row['Property'])
-                if structure:
-                    column.append(structure)
-            column = html.Form(id=category["Title"], className='column', style={'flex': '1', 'padding': '10px', 'flex-direction': 'row'}, children=column)
-        else:
-            for label in category['Options']:
-                labels.append(label)
-                checkbox = dcc.Checklist(id=label + '-checkbox', options=[label], value=[])
-                min_input = dcc.Input(id=label + '-min', type='number', disabled=False, value=None)
-                max_input = dcc.Input(id=label + '-max',type='number', disabled=False, value=None)
-                column += [
-                    html.Div([checkbox,
 
-                        # Min input with label
-                        dbc.Col([
-                            dbc.Row([html.Label('Min:'), min_input])
-                        ]),
+def variable_section(category):
+    column = section_header(category['Title'])
+    variables = PROPERTY if category['Title'] == DEPENDENT_VARIABLE else INPUT
+    for property_type, property_name in zip(variables['Type'], variables['Property']):
+        structure = property_type.selectstructure(property_name)
+        if structure:
+            column.append(structure)
+    return html.Form(id=category["Title"], className='column', style={'flex': '1', 'padding': '10px', 'flex-direction': 'row'}, children=column)
 
-                        # Max input with label
-                        dbc.Col([
-                            dbc.Row([html.Label('Max:'), max_input])
-                        ]),
-                    ])]
-            column = html.Form(id=category["Title"], className='column', style={'flex': '1', 'padding': '10px', 'flex-direction': 'row'}, children=column)
-        form_elements.append(column)
-    return form_elements
+def association_section(category):
+    column = section_header(category['Title'])
+    value_column = catalog.table_column_map()[category['Title']][2]
+    for label in category['Options']:
+        checkbox = dcc.Checklist(id=label + '-checkbox', options=[label], value=[])
+        # The stored range, from the column stats, as a hint
+        bounds = column_bounds(f"{label}_{value_column}")
+        min_input = dcc.Input(id=label + '-min', type='number', disabled=False, value=None, placeholder=None if bounds is None else f"{bounds[0]:g}")
+        max_input = dcc.Input(id=label + '-max',type='number', disabled=False, value=None, placeholder=None if bounds is None else f"{bounds[1]:g}")
+        column += [
+            html.Div([checkbox,
+
+                # Min input with label
+                dbc.Col([
+                    dbc.Row([html.Label('Min:'), min_input])
+                ]),
+
+                # Max input with label
+                dbc.Col([
+                    dbc.Row([html.Label('Max:'), max_input])
+                ]),
+            ])]
+    return html.Form(id=category["Title"], className='column', style={'flex': '1', 'padding': '10px', 'flex-direction': 'row'}, children=column)
 
 # Home page call back functions
 def generate_options_df(form_elements):
+    options = read_options(form_elements)
+    df = generate_df(options)
+    return options, df
+
+def read_options(form_elements):
     options = {}
     for current in form_elements:
         current_column = current['props']['children']
@@ -172,9 +234,7 @@ def generate_options_df(form_elements):
                 except IndexError as e:
                     options[column_name][current_label]['min'] = current_structure[1]['props']['children'][0]['props']['children'][1]['props']['value']
                     options[column_name][current_label]['max'] = current_structure[2]['props']['children'][0]['props']['children'][1]['props']['value']
-
-    df = generate_df(options)
-    return options, df
+    return options
 
 @app.callback(
     [Output('plot-container', 'children', allow_duplicate=True), Output('displayed-form', 'data')],
@@ -183,29 +243,44 @@ def generate_options_df(form_elements):
     prevent_initial_call=True
 )
 def show_table(n_clicks, form_elements):
-    # Extract selected options from form_elements
-    options, df = generate_options_df(form_elements)
-    if 'ExperimentID' in df.columns:
-        df['ExperimentID'] = df['ExperimentID'].apply(lambda x: binascii.hexlify(x).decode('utf-8'))
-    buffer = StringIO()
-    df.to_csv(buffer, index=False)
-    csv_string = buffer.getvalue()
+    # Only the first page is sent; the form's options are kept to fetch the others
+    options = read_options(form_elements)
+    df = table_pager.page(options, 0, PAGE_SIZE)
     return [[dash_table.DataTable(
         id='table',
         columns=[{"name": i, "id": i} for i in df.columns],
-        data=df.to_dict('records')), 
-    dcc.Download(id="download-table"),
-    html.Button('Download', id='download-table-button', n_clicks=0)], csv_string]
+        data=df.to_dict('records'),
+        page_current=0,
+        page_size=PAGE_SIZE,
+        page_count=table_pager.page_count(options, PAGE_SIZE),
+        page_action='custom',
+        sort_action='custom',
+        sort_mode='single',
+        sort_by=[]),
+    html.Div([html.A(f'Download {export_format}', href=Export.export_url(options, export_format), style={'padding': '10px'})
+              for export_format in Export.available_formats()])], options]
 
 @app.callback(
-    Output("download-table", "data"),
-    Input('download-table-button', "n_clicks"),
+    Output('table', 'data'),
+    Input('table', 'page_current'),
+    Input('table', 'page_size'),
+    Input('table', 'sort_by'),
     State('displayed-form', 'data'),
     prevent_initial_call=True
 )
-def download_table(n_clicks, data):
-    csv_bytes = io.BytesIO(data.encode())
-    return dcc.send_bytes(csv_bytes.getvalue(), "exported_data.csv")
+def update_table_page(page_current, page_size, sort_by, options):
+    return table_pager.page(options, page_current or 0, page_size, sort_by).to_dict('records')
+
+@app.server.route(Export.ROUTE)
+def download_table():
+    # Streams the displayed filter's rows, so large exports never sit in memory or in the page
+    export_format = request.args.get('format', 'csv')
+    try:
+        chunks = Export.export(Export.decode_options(request.args.get('options', '')), export_format)
+    except ValueError as e:
+        return Response(str(e), status=400)
+    return Response(stream_with_context(chunks), mimetype=Export.FORMATS[export_format],
+                    headers={'Content-Disposition': f'attachment; filename=exported_data.{export_format}'})
 
 
 @app.callback(
@@ -217,58 +292,30 @@ def download_table(n_clicks, data):
 def show_graph(n_clicks, form_elements=None):
     # Extract selected options from form_elements
     options, df = generate_options_df(form_elements)
-    variable_names = set(df.columns.tolist())
-    variable_names.discard('ID')
-    properties = set()
-    for current in variable_names:
-        if current in set(PROPERTY['Property']):
-            properties.add(current)
-    for current in properties:
-        variable_names.discard(current)
-    variable_names = list(variable_names)
-    properties = list(properties)
+    # Variables and properties keep the form's order, so figures always come in the same order
+    property_names = set(PROPERTY['Property'])
+    variable_names = [current for current in df.columns if current != 'ID' and current not in property_names]
+    properties = [current for current in df.columns if current in property_names]
     if len(variable_names) < 1:
         return html.Div('Please select at least one independent variables.')
-    result = []
-    hover_template_parts = [f"{current}: %{{customdata[{i}]}}" for i, current in enumerate(properties)]
-    hover_template = '<br>'.join(hover_template_parts) + '<extra></extra>'
-    property_minmax = {}
-    for current in properties:
-        property_minmax[current] = [min(df[current]), max(df[current])]
-        property_minmax[current].append(property_minmax[current][1] - property_minmax[current][0])
-    if len(variable_names) == 1:
-        result = [px.scatter(df, x=variable_names[0], y=i) for i in properties]
-        for current, property in zip(result, properties):
-            current.update_traces(customdata=df[properties].to_numpy(), 
-                    hovertemplate=
-                        variable_names[0] + ': %{x}<br>' +
-                        hover_template
-                    )
-            current.update_layout(
-                        scene=dict(
-                            yaxis=dict(range=[property_minmax[property][0] - MARGIN * property_minmax[property][2], 
-                            property_minmax[property][1] + MARGIN * property_minmax[property][2]])
-                        )
-                    )
-    else:
-        for i in range(len(variable_names)):
-            for j in range(i + 1, len(variable_names)):
-                new = [px.scatter_3d(df, x=df[variable_names[i]], y=df[variable_names[j]], z=k) for k in properties]
-                for current, property in zip(new, properties):
-                    current.update_traces(customdata=df[properties].to_numpy(), 
-                    hovertemplate=
-                        variable_names[i] + ': %{x}<br>' +
-                        variable_names[j] + ': %{y}<br>' +
-                        hover_template
-                    )
-                    current.update_layout(
-                        scene=dict(
-                            zaxis=dict(range=[property_minmax[property][0] - MARGIN * property_minmax[property][2], 
-                            property_minmax[property][1] + MARGIN * property_minmax[property][2]])
-                        )
-                    )
-                result += new
-    return [dcc.Graph(figure=i) for i in result]
+    groups = figure_groups(variable_names)
+    if len(groups) * len(properties) < LAZY_FIGURES:
+        return [dcc.Graph(figure=i) for i in build_figures(df, variable_names, properties)]
+    # Many figures: one tab per group, built when it is opened
+    return [dcc.Store(id='graph-form', data={'options': options, 'variables': variable_names, 'properties': properties}),
+            dcc.Tabs(id='graph-tabs', value='0', children=[dcc.Tab(label=' / '.join(axes), value=str(i)) for i, axes in enumerate(groups)]),
+            html.Div(id='graph-tab-content')]
+
+@app.callback(
+    Output('graph-tab-content', 'children'),
+    Input('graph-tabs', 'value'),
+    State('graph-form', 'data')
+)
+def show_graph_tab(tab, form):
+    # generate_df answers from the result cache after show_graph
+    df = generate_df(form['options'])
+    axes = figure_groups(form['variables'])[int(tab)]
+    return [dcc.Graph(figure=i) for i in build_figures(df, form['variables'], form['properties'], groups=[axes])]
 
 if __name__ == '__main__':
     app.run_server(debug=True)
\ No newline at end of file
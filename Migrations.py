@@ -0,0 +1,165 @@
+MAIN_NAME = 'experiments'
+# Maps each experiment's content hash (see Pipeline.hash_datapoint) to its integer ID
+HASH_TABLE = 'experiment_hashes'
+# Count, sum, min and max of the numbers in every experiment column, and in every association
+# table's value column per name (see ColumnStats). Experiment columns have '' as their name.
+STATS_TABLE = 'column_stats'
+# Raw balance readings of each measurement run, linked to the experiment once it is saved
+# (written by "Equipment Control/Telemetry.py")
+TELEMETRY_TABLE = 'balance_telemetry'
+# Bookkeeping tables that aren't association tables
+INTERNAL_TABLES = [HASH_TABLE, STATS_TABLE, TELEMETRY_TABLE]
+# Experiment columns the filter form lets users put bounds on
+INDEXED_COLUMNS = ['Density', 'Conductivity', 'Viscosity', 'Temperature', 'Date', 'Trial']
+
+
+def main_table_sql(columns):
+    return f"CREATE TABLE IF NOT EXISTS {MAIN_NAME} (ID INTEGER PRIMARY KEY, {', '.join(columns)})"
+
+
+def hash_table_sql():
+    return f"CREATE TABLE IF NOT EXISTS {HASH_TABLE} (ID INTEGER PRIMARY KEY, Hash BLOB NOT NULL UNIQUE)"
+
+
+def association_table_sql(table, columns):
+    return f"CREATE TABLE IF NOT EXISTS {table} (ID INTEGER(32), {', '.join(columns)})"
+
+
+def create_indexes(conn, table, columns):
+    # Filters compare one column against a range and only need the ID back, so every
+    # index ends with ID and answers the filter queries on its own
+    if table == MAIN_NAME:
+        for column in columns:
+            if column in INDEXED_COLUMNS:
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{column} ON {table} ({column}, ID)")
+    else:
+        # Association tables are (ID, name column, value column)
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_lookup ON {table} ({columns[0]}, {columns[1]}, ID)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_id ON {table} (ID)")
+
+
+def fill_column_stats(conn):
+    # Computes the column stats from the data into an empty stats table.
+    # Text and NULL values are left out, as they are when ingest adds to the stats.
+    tables = user_tables(conn)
+    if MAIN_NAME in tables:
+        fill_table_stats(conn, MAIN_NAME)
+    for table in association_tables(conn):
+        fill_table_stats(conn, table)
+
+
+def fill_table_stats(conn, table):
+    # fill_column_stats for one table, the experiments table or an association table
+    if table == MAIN_NAME:
+        for column in table_columns(conn, MAIN_NAME)[1:]:
+            conn.execute(f"INSERT INTO {STATS_TABLE} (table_name, column_name, name, count, sum, min, max) "
+                         f"SELECT ?, ?, '', COUNT(*), TOTAL({column}), MIN({column}), MAX({column}) FROM {MAIN_NAME} "
+                         f"WHERE typeof({column}) IN ('integer', 'real') HAVING COUNT(*) > 0", (MAIN_NAME, column))
+    else:
+        name_column, value_column = table_columns(conn, table)[1:3]
+        conn.execute(f"INSERT INTO {STATS_TABLE} (table_name, column_name, name, count, sum, min, max) "
+                     f"SELECT ?, ?, {name_column}, COUNT(*), TOTAL({value_column}), MIN({value_column}), MAX({value_column}) "
+                     f"FROM {table} WHERE {name_column} IS NOT NULL AND typeof({value_column}) IN ('integer', 'real') "
+                     f"GROUP BY {name_column}", (table, value_column))
+
+
+def table_columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def user_tables(conn):
+    return [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+
+
+def association_tables(conn):
+    return [table for table in user_tables(conn) if table != MAIN_NAME and table not in INTERNAL_TABLES]
+
+
+# Migrations, run in order. Each one gets a connection inside an open transaction.
+# They spell out their own table definitions, which must not change once released.
+def add_keys_and_indexes(conn):
+    tables = user_tables(conn)
+    if MAIN_NAME in tables:
+        columns = table_columns(conn, MAIN_NAME)[1:]
+        # Rebuild experiments with ID as its primary key. Rows are copied in insertion
+        # order so a later duplicate replaces an earlier one, like INSERT OR REPLACE.
+        conn.execute(f"ALTER TABLE {MAIN_NAME} RENAME TO {MAIN_NAME}_unkeyed")
+        conn.execute(f"CREATE TABLE {MAIN_NAME} (ID BLOB PRIMARY KEY, {', '.join(columns)})")
+        conn.execute(f"INSERT OR REPLACE INTO {MAIN_NAME} (ID, {', '.join(columns)}) "
+                     f"SELECT ID, {', '.join(columns)} FROM {MAIN_NAME}_unkeyed ORDER BY rowid")
+        conn.execute(f"DROP TABLE {MAIN_NAME}_unkeyed")
+    for table in tables:
+        create_indexes(conn, table, table_columns(conn, table)[1:])
+
+
+def intern_experiment_ids(conn):
+    # The 32 byte hashes move to experiment_hashes and every other table refers to
+    # experiments by the hash's integer rowid instead
+    conn.execute(f"CREATE TABLE {HASH_TABLE} (ID INTEGER PRIMARY KEY, Hash BLOB NOT NULL UNIQUE)")
+    tables = user_tables(conn)
+    if MAIN_NAME not in tables:
+        return
+    associations = [table for table in tables if table not in (MAIN_NAME, HASH_TABLE)]
+    conn.execute(f"INSERT INTO {HASH_TABLE} (Hash) SELECT ID FROM {MAIN_NAME} ORDER BY rowid")
+    # Association rows whose experiment is missing keep a (new) ID of their own
+    for table in associations:
+        conn.execute(f"INSERT OR IGNORE INTO {HASH_TABLE} (Hash) SELECT ID FROM {table} WHERE typeof(ID) = 'blob' ORDER BY rowid")
+    columns = ', '.join(table_columns(conn, MAIN_NAME)[1:])
+    conn.execute(f"ALTER TABLE {MAIN_NAME} RENAME TO {MAIN_NAME}_hashed")
+    conn.execute(f"CREATE TABLE {MAIN_NAME} (ID INTEGER PRIMARY KEY, {columns})")
+    conn.execute(f"INSERT INTO {MAIN_NAME} (ID, {columns}) SELECT h.ID, {columns} FROM {MAIN_NAME}_hashed e "
+                 f"JOIN {HASH_TABLE} h ON h.Hash = e.ID ORDER BY h.ID")
+    # Dropping the old table drops its indexes, so they can be created again on the new one
+    conn.execute(f"DROP TABLE {MAIN_NAME}_hashed")
+    create_indexes(conn, MAIN_NAME, table_columns(conn, MAIN_NAME)[1:])
+    for table in associations:
+        # ID is declared INTEGER(32) here; without the cast the comparison gets numeric
+        # affinity and can't use the index on Hash
+        conn.execute(f"UPDATE {table} SET ID = (SELECT h.ID FROM {HASH_TABLE} h WHERE h.Hash = CAST({table}.ID AS BLOB)) "
+                     f"WHERE typeof(ID) = 'blob'")
+
+
+def add_column_stats(conn):
+    conn.execute(f"CREATE TABLE {STATS_TABLE} (table_name TEXT NOT NULL, column_name TEXT NOT NULL, name TEXT NOT NULL, "
+                 f"count INTEGER NOT NULL, sum REAL NOT NULL, min REAL, max REAL, PRIMARY KEY (table_name, column_name, name))")
+    fill_column_stats(conn)
+
+
+def add_telemetry(conn):
+    conn.execute(f"CREATE TABLE {TELEMETRY_TABLE} (run TEXT NOT NULL, experiment INTEGER, time REAL NOT NULL, value REAL NOT NULL)")
+    conn.execute(f"CREATE INDEX idx_{TELEMETRY_TABLE}_run ON {TELEMETRY_TABLE} (run, time)")
+    conn.execute(f"CREATE INDEX idx_{TELEMETRY_TABLE}_experiment ON {TELEMETRY_TABLE} (experiment)")
+
+
+MIGRATIONS = [add_keys_and_indexes, intern_experiment_ids, add_column_stats, add_telemetry]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    # Brings the database up to SCHEMA_VERSION, each migration in its own transaction.
+    # The version is read again under the write lock in case another process migrated first.
+    migrated = False
+    while schema_version(conn) < SCHEMA_VERSION:
+        migrated = True
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = schema_version(conn)
+            if version < SCHEMA_VERSION:
+                MIGRATIONS[version](conn)
+                conn.execute(f"PRAGMA user_version = {version + 1}")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+    if migrated:
+        # Give the query planner statistics for the new indexes
+        conn.execute("ANALYZE")
+
+
+def explain(conn, query, params=()):
+    # The detail column of EXPLAIN QUERY PLAN, one entry per step
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
@@ -0,0 +1,88 @@
+import threading
+from collections import OrderedDict
+import Pipeline
+from QueryCompiler import quote
+
+PAGE_SIZE = 50
+MAX_QUERIES = 256  # filter and sort combinations whose page boundaries are remembered
+
+
+class KeysetPager:
+    # Serves one page of a generate_df result at a time. Pages are read with
+    #   WHERE (sort value, key) > (last row of the previous page) ORDER BY sort value, key LIMIT page size
+    # so every page costs the same, instead of OFFSET which reads every row before the page.
+    # The key is the experiment's integer ID. Page boundaries seen so far are remembered per
+    # filter and sort until the next write; jumping past them skips ahead from the closest one.
+    def __init__(self, max_queries=MAX_QUERIES):
+        self.max_queries = max_queries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def entry(self, options, sort=None, page_size=None):
+        # Boundaries are dropped with the result cache's generation, i.e. on every write
+        key = (Pipeline.result_cache.key(options), Pipeline.result_cache.generation, sort, page_size)
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = {}
+                while len(self.entries) > self.max_queries:
+                    self.entries.popitem(last=False)
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def count(self, options):
+        entry = self.entry(options)
+        if 'count' not in entry:
+            query, params = Pipeline.compile_df_query(options, count=True)
+            entry['count'] = Pipeline.get_data_from_database(query, params=params).iloc[0, 0]
+        return int(entry['count'])
+
+    def page_count(self, options, page_size=PAGE_SIZE):
+        return max(1, -(-self.count(options) // page_size))
+
+    def page(self, options, page_current=0, page_size=PAGE_SIZE, sort_by=None):
+        query, params = Pipeline.compile_df_query(options, Pipeline.KEY_COLUMN, lookups=True)
+        key = quote(Pipeline.KEY_COLUMN)
+        sort = None
+        sort_value = None
+        if sort_by:
+            sort = (sort_by[0]['column_id'], sort_by[0]['direction'] == 'desc')
+        direction = ' DESC' if sort and sort[1] else ''
+        comparison = '<' if sort and sort[1] else '>'
+        if sort:
+            # The table shows missing values as 0 (see format_df), so they sort as 0 too
+            sort_value = f"COALESCE({quote(sort[0])}, 0)"
+            columns = f"{sort_value}, {key}"
+            order = f"{sort_value}{direction}, {key}{direction}"
+        else:
+            columns = key
+            order = f"{key}{direction}"
+        boundaries = self.entry(options, sort, page_size)
+        # boundaries[n] is the last row of page n - 1; page 0 starts at the beginning
+        known = max([0] + [page for page in boundaries if page <= page_current])
+        start = boundaries.get(known)
+        if known < page_current:
+            # Only the boundary's keys are read for the skipped pages
+            skip = (page_current - known) * page_size - 1
+            condition, condition_params = self.after(columns, comparison, start)
+            rows = Pipeline.get_data_from_database(
+                f"SELECT {columns} FROM ({query}){condition} ORDER BY {order} LIMIT 1 OFFSET ?",
+                params=params + condition_params + [skip])
+            if rows.empty:
+                # Past the last page
+                df = Pipeline.get_data_from_database(f"SELECT * FROM ({query}) LIMIT 0", params=params)
+                return Pipeline.format_results(df.drop(columns=Pipeline.KEY_COLUMN))
+            start = tuple(rows.iloc[0].tolist())
+            boundaries[page_current] = start
+        condition, condition_params = self.after(columns, comparison, start)
+        df = Pipeline.get_data_from_database(f"SELECT *{', ' + sort_value + ' AS SortValue' if sort else ''} FROM ({query})"
+                                             f"{condition} ORDER BY {order} LIMIT ?", params=params + condition_params + [page_size])
+        helpers = ['SortValue', Pipeline.KEY_COLUMN] if sort else [Pipeline.KEY_COLUMN]
+        if len(df) == page_size:
+            boundaries[page_current + 1] = tuple(df.iloc[-1][helpers].tolist())
+        return Pipeline.format_results(df.drop(columns=helpers))
+
+    def after(self, columns, comparison, start):
+        if start is None:
+            return "", []
+        values = [current.item() if hasattr(current, 'item') else current for current in start]
+        return f" WHERE ({columns}) {comparison} ({', '.join('?' * len(values))})", values
@@ -1,31 +1,43 @@
 import binascii
+import numpy as np
 import pandas as pd
 import sqlite3
-import matplotlib
 import uuid
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
 import os
 import io
 import base64
 from io import BytesIO
-from datetime import datetime
 import base64
 import hashlib
 from CustomTypes import CustomType
 from TypeFunctions import *
+# After the star import, which brings in the datetime module under the same name
+from datetime import datetime
 import json
 from functools import reduce
+from itertools import compress
+from ConnectionPool import durable, get_connection, register_initializer, transaction
+from Migrations import HASH_TABLE, association_table_sql, hash_table_sql, main_table_sql, migrate
+from BulkIngest import BATCH_SIZE, group_by_table, ingest, lookup_ids
+from StreamingUpload import CHUNK_SIZE, read_csv_chunks_with_position
+from CompositionParser import parse_composition_column
+from QueryCompiler import compile_options
+from ResultCache import ResultCache
+from Catalog import Catalog
+from ColumnStats import ColumnStats, following_changes
+from Snapshot import Snapshot
+from RenderService import RenderService
+from IngestJobs import IngestJobs
+from WriteBuffer import WriteBuffer
 
 DATE_FORMATS = ["%m/%d/%Y", "%m/%d/%y", "%Y-%m-%d"]
-float_customtype = CustomType(getverifyNumberFunction(0, float('inf')), getNumberInput, selectstructure=getNumberFilter)
+float_customtype = CustomType(getverifyNumberFunction(0, float('inf')), getNumberInput, selectstructure=getNumberFilter, batchverify=getverifyNumberColumnFunction(0, float('inf')))
 PROPERTY = pd.DataFrame({'Property':['Density', 'Conductivity', 'Viscosity', 'Mass', 'Volume'], 'Type':[float_customtype, float_customtype, float_customtype, float_customtype, float_customtype], 'Units':['g', 'cm^3', 'g/cm^3', 'mS/cm', 'cP']})
 INPUT = pd.DataFrame({'Property':['Temperature', 'CompositionID', 'Date', 'Trial'], 
-    'Type':[CustomType(getverifyNumberFunction(-273.15, float('inf')), getNumberInput, selectstructure=getNumberFilter), 
-    CustomType(verifyCompositionID, getStringInput), 
-    CustomType(getVerifyDateFunction(DATE_FORMATS), getDateInput, displayMethod=displayDate, selectstructure=getDateFilter),
-    CustomType(getverifyNumberFunction(0, float('inf'), integer=True), getNumberInput)], 
+    'Type':[CustomType(getverifyNumberFunction(-273.15, float('inf')), getNumberInput, selectstructure=getNumberFilter, batchverify=getverifyNumberColumnFunction(-273.15, float('inf'))), 
+    CustomType(verifyCompositionID, getStringInput, batchverify=parse_composition_column), 
+    CustomType(getVerifyDateFunction(DATE_FORMATS), getDateInput, displayMethod=displayDate, selectstructure=getDateFilter, batchverify=getVerifyDateColumnFunction(DATE_FORMATS)),
+    CustomType(getverifyNumberFunction(0, float('inf'), integer=True), getNumberInput, batchverify=getverifyNumberColumnFunction(0, float('inf'), integer=True))], 
     'Units':['C', '', '', '#']})
 ALL_INPUT = pd.concat([PROPERTY, INPUT])
 MAIN_NAME = 'experiments'
@@ -35,54 +47,114 @@ UNITS = ['g/cm^3', 'mS/cm', 'cP', 'C']
 TABLE_NAMES = ['experiments', 'solvents', 'salts']
 DEPENDENT_VARIABLE = "Dependent variables"
 INDEPENDENT_VARIABLE = "Independent variables"
-ALL_IDS = "SELECT ID FROM " + MAIN_NAME
+ALL_IDS = "SELECT ID FROM " + MAIN_NAME + " ORDER BY ID"
 DEFAULT_DB = "Database.db"
 LOGIC = 'logic'
-table_column_map = {}
+KEY_COLUMN = 'RowKey'
+MAX_REPORTED_ERRORS = 10
+register_initializer(migrate)
+result_cache = ResultCache(LOGIC)
+catalog = Catalog(DEFAULT_DB)
+column_stats = ColumnStats(DEFAULT_DB)
+snapshot = Snapshot(DEFAULT_DB)
+render_service = RenderService()
+ingest_jobs = IngestJobs()
+# Single experiments from the Add Data form are group committed on the ingest writer thread
+write_buffer = WriteBuffer(lambda compositions: insert_submissions(compositions), ingest_jobs.write)
 
 
-def get_data_from_database(query, db_file=DEFAULT_DB):
-    # Connect to the SQLite database
-    conn = sqlite3.connect(db_file)
+def get_data_from_database(query, db_file=DEFAULT_DB, params=None):
+    # Reuse this thread's pooled connection to the SQLite database
+    conn = get_connection(db_file)
     try:
         # Use pandas to execute the SQL query and return a DataFrame
-        df = pd.read_sql(query, conn)
+        df = pd.read_sql(query, conn, params=params)
         return df
     except Exception as e:
         print(f"An error occurred: {e}")
         return None
-    finally:
-        # Close the database connection
-        conn.close()
 
 def edit_database(queries, db_file=DEFAULT_DB):
-    # Connect to the SQLite database
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-    for query in queries:
-        cursor.execute(query[0], query[1])  # None is used to insert a NULL value
-    conn.commit()
-    conn.close()
+    # All the queries are applied in one transaction, and the column stats follow what they change
+    try:
+        with transaction(db_file) as conn, following_changes(conn):
+            cursor = conn.cursor()
+            for query in queries:
+                cursor.execute(query[0], query[1])  # None is used to insert a NULL value
+    finally:
+        result_cache.bump()
+        catalog.invalidate()
+        column_stats.invalidate()
+        snapshot.invalidate()
 
 def insert_new_data(compositions):
-    queries = generate_edit_queries([compositions])
-    edit_database(queries, DEFAULT_DB)
+    # Returns once the experiment is committed, together with whatever other sessions
+    # submitted meanwhile
+    write_buffer.put(compositions).result()
+
+def insert_submissions(compositions):
+    # A write buffer batch. Submitters are told their data is saved once this returns, so the
+    # commit is synced to disk; the fsync is shared by the whole batch. Returns the integer
+    # IDs the experiments are stored under, which their futures resolve to.
+    with durable(DEFAULT_DB):
+        insert_new_data_bulk(compositions)
+    return lookup_ids(get_connection(DEFAULT_DB), [hash_datapoint(composition[MAIN_NAME]) for composition in compositions])
 
-def insert_new_data_bulk(compositions):
-    queries = generate_edit_queries(compositions)
-    edit_database(queries, DEFAULT_DB)
+def submit_measurement(values):
+    # One experiment measured by a rig, {property: value} for the ALL_INPUT properties, checked
+    # like the Add Data form and queued for the write buffer. Returns the future that resolves
+    # to the experiment's integer ID once it is committed (e.g. to link its telemetry to), or
+    # check_validity's message if it is invalid.
+    compositions = check_validity([values.get(property) for property in ALL_INPUT['Property']])
+    if isinstance(compositions, str):
+        return compositions
+    return write_buffer.put(compositions)
+
+def last_trial(composition_id, date, db_file=DEFAULT_DB):
+    # The highest Trial stored for a composition on a date (in one of DATE_FORMATS), or 0.
+    # Repeats measured later continue from it; reusing a Trial would give an experiment with
+    # the same readings the same ID, and replace it.
+    composition = verifyCompositionID('CompositionID', composition_id)
+    days = getVerifyDateFunction(DATE_FORMATS)('Date', date)
+    if isinstance(composition, str) or isinstance(days, str):
+        return 0
+    # Experiments with exactly these components and amounts
+    conditions = []
+    params = [days]
+    for table, columns in composition.items():
+        (name_column, names), (amount_column, amounts) = columns.items()
+        matches = ' OR '.join([f"(c.{name_column} = ? AND c.{amount_column} = ?)"] * len(names))
+        conditions.append(f"(SELECT COUNT(*) FROM {table} c WHERE c.ID = e.ID) = ?")
+        conditions.append(f"(SELECT COUNT(*) FROM {table} c WHERE c.ID = e.ID AND ({matches})) = ?")
+        params += [len(names)] + [value for pair in zip(names, amounts) for value in pair] + [len(names)]
+    df = get_data_from_database(f"SELECT MAX(e.Trial) AS trial FROM {MAIN_NAME} e WHERE e.Date = ? AND "
+                                + ' AND '.join(conditions), db_file, params)
+    if df is None or pd.isna(df['trial'][0]):
+        return 0
+    return int(df['trial'][0])
+
+def insert_new_data_bulk(compositions, batch_size=BATCH_SIZE, db_file=DEFAULT_DB):
+    if len(compositions) == 0:
+        return 0
+    return insert_tables(group_by_table(compositions, MAIN_NAME, hash_datapoint), batch_size, db_file)
 
 def generate_edit_queries(compositions):
     queries = []
     for current in compositions[0]:
         table_name = current
-        columns = ', '.join(compositions[0][current].keys())
+        columns = list(compositions[0][current].keys())
 
         # Generate SQL query to create table
-        create_table_query = f"CREATE TABLE IF NOT EXISTS {table_name} (ID INTEGER(32), {', '.join(compositions[0][current].keys())})"
+        if table_name == MAIN_NAME:
+            create_table_query = main_table_sql(columns)
+        else:
+            create_table_query = association_table_sql(table_name, columns)
         queries.append((create_table_query, ""))
+    queries.append((hash_table_sql(), ""))
     for current_composition in compositions:
         GUID = hash_datapoint(current_composition[MAIN_NAME])
+        # Rows refer to the experiment by the integer ID its hash is stored under
+        queries.append((f"INSERT OR IGNORE INTO {HASH_TABLE} (Hash) VALUES (?)", (GUID,)))
         for current_table in current_composition.keys():
             new_df = 0
             try:
@@ -93,22 +165,24 @@ def generate_edit_queries(compositions):
             for index, row in new_df.iterrows():
                 columns = ', '.join(new_df.columns)
                 placeholders = ', '.join(["?" for _ in row])
+                key = f"(SELECT ID FROM {HASH_TABLE} WHERE Hash = ?)"
                 if current_table == MAIN_NAME:
-                    query = f"INSERT OR REPLACE INTO {current_table} (ID, {columns}) VALUES (?, {placeholders})"
+                    query = f"INSERT OR REPLACE INTO {current_table} (ID, {columns}) VALUES ({key}, {placeholders})"
                 else:
-                    query = f"INSERT INTO {current_table} (ID, {columns}) VALUES (?, {placeholders})"
+                    query = f"INSERT INTO {current_table} (ID, {columns}) VALUES ({key}, {placeholders})"
                 queries.append((query, (GUID,) + tuple(row)))
     return queries
 
 def generate_query(table_name, variable, minimum=None, maximum=None):
     if table_name != MAIN_NAME:
-        query = f'SELECT ID, {table_column_map[table_name][2]} as {variable}_{table_column_map[table_name][2]} FROM {table_name} WHERE {table_column_map[table_name][1]} = "{variable}"'
+        columns = catalog.table_column_map()[table_name]
+        query = f'SELECT ID, {columns[2]} as {variable}_{columns[2]} FROM {table_name} WHERE {columns[1]} = "{variable}"'
         if minimum and maximum:
-            query += f" AND {table_column_map[table_name][2]} BETWEEN {minimum} AND {maximum}"
+            query += f" AND {columns[2]} BETWEEN {minimum} AND {maximum}"
         elif minimum:
-            query += f" AND {table_column_map[table_name][2]} >= {minimum}"
+            query += f" AND {columns[2]} >= {minimum}"
         elif maximum:
-            query += f" AND {table_column_map[table_name][2]} <= {maximum}"
+            query += f" AND {columns[2]} <= {maximum}"
         return query
     else:
         query = f"SELECT ID, {variable} FROM {table_name}"
@@ -138,55 +212,173 @@ def check_validity(args):
     return result
         
 
+def check_validity_batch(df):
+    # check_validity for a whole DataFrame, one column at a time. Returns the valid rows as
+    # ingest tables (see BulkIngest.group_by_table) and a Series of messages for the invalid
+    # ones, indexed like df. As in check_validity, a row reports the first failing property.
+    errors = np.full(len(df), None, dtype=object)
+    has_error = np.zeros(len(df), dtype=bool)
+    main_values = {}
+    association_values = []
+    for property, current_type in zip(ALL_INPUT['Property'], ALL_INPUT['Type']):
+        values, error_mask, messages = current_type.verify_column(df[property])
+        first = error_mask & ~has_error
+        errors[first] = messages[first]
+        has_error |= error_mask
+        # Types like CompositionID return flat association table columns
+        if isinstance(values, dict):
+            association_values.append(values)
+        else:
+            main_values[property] = values
+    valid = ~has_error
+    main_columns = list(main_values)
+    # tolist gives plain Python numbers, so hash_datapoint sees what check_validity returns
+    columns = [values[valid].tolist() if isinstance(values, np.ndarray) else list(compress(values, valid))
+               for values in main_values.values()]
+    main_rows = list(zip(*columns))
+    ids = [hash_datapoint(dict(zip(main_columns, row))) for row in main_rows]
+    # Renumber the owners of the kept association rows to positions among the valid rows
+    positions = np.cumsum(valid) - 1
+    associations = {}
+    for tables in association_values:
+        for table, (table_columns, owners, column_arrays) in tables.items():
+            keep = valid[owners]
+            rows = list(zip(*[current[keep].tolist() for current in column_arrays]))
+            associations[table] = (table_columns, positions[owners[keep]], rows)
+    tables = (main_columns, ids, main_rows, associations)
+    return tables, pd.Series(errors[has_error], index=df.index[has_error], dtype=object)
+
+def insert_tables(tables, batch_size=BATCH_SIZE, db_file=DEFAULT_DB):
+    # Inserts the output of check_validity_batch or BulkIngest.group_by_table
+    if len(tables[2]) == 0:
+        return 0
+    try:
+        inserted = ingest(db_file, MAIN_NAME, *tables, batch_size=batch_size)
+    except BaseException:
+        # Batches committed before the failure are in the database, the rest aren't
+        catalog.invalidate()
+        raise
+    finally:
+        result_cache.bump()
+        column_stats.invalidate()
+    for table, (columns, owners, rows) in tables[3].items():
+        catalog.add_names(table, columns, set(row[0] for row in rows))
+    # Off the write path: Add Data and upload chunks don't wait for the Parquet files
+    snapshot.schedule(result_cache.generation)
+    return inserted
+
 def parse_contents(contents, filename):
     content_type, content_string = contents.split(',')
     decoded = base64.b64decode(content_string)
     #try:
     if 'csv' in filename:
             # Assume that the user uploaded a CSV file
-        df = pd.read_csv(io.StringIO(decoded.decode('utf-8')))[ALL_INPUT['Property']]
-        compositions = []
-        for index, row in df.iterrows():
-            try:
-                composition = check_validity(tuple(row))
-            except KeyError as e:
-                return 'Your CSV file must have a ' + e.args[0] + ' column!'
-            if isinstance(composition, str):
-                return 'Error on line ' + str(index + 2) + ': ' + composition
-            compositions.append(composition)
-        insert_new_data_bulk(compositions)
+        df = pd.read_csv(io.StringIO(decoded.decode('utf-8')))
+        try:
+            df = df[ALL_INPUT['Property']]
+        except KeyError:
+            return 'Your CSV file must have a ' + missing_column(df) + ' column!'
+        tables, errors = check_validity_batch(df)
+        if len(errors) > 0:
+            return 'Error on line ' + str(errors.index[0] + 2) + ': ' + errors.iloc[0]
+        insert_tables(tables)
         return 'Data uploaded successfully.'
     else:
         return 'You must upload a CSV file'
 
-# Home page helper functions
-def generate_graph(df, file_name, c, x, y, z=None):
-    fig = plt.figure()
-    ax = None
-    if z is not None:
-        ax = fig.add_subplot(111, projection='3d')
-        scatter = ax.scatter(df[x], df[y], df[z], c=df[c], marker='o')
-        ax.set_zlabel(z)
-    else:
-        ax = fig.add_subplot(111)
-        scatter = ax.scatter(df[x], df[y], c=df[c], marker='o')
+def missing_column(df):
+    return [current for current in ALL_INPUT['Property'] if current not in df.columns][0]
 
+def parse_contents_streaming(contents, filename, chunksize=CHUNK_SIZE, progress=None, insert=insert_tables):
+    # Validates and inserts the upload one chunk at a time. Valid rows are kept even
+    # when other rows fail, and progress(report) is called after every chunk.
+    # insert(tables) writes a chunk's rows and returns how many it wrote.
+    if 'csv' not in filename:
+        return 'You must upload a CSV file'
+    rows = 0
+    inserted = 0
+    errors = []
+    for chunk_number, (chunk, fraction) in enumerate(read_csv_chunks_with_position(contents, chunksize)):
+        try:
+            chunk = chunk[ALL_INPUT['Property']]
+        except KeyError:
+            return 'Your CSV file must have a ' + missing_column(chunk) + ' column!'
+        tables, chunk_errors = check_validity_batch(chunk)
+        chunk_errors = ['Error on line ' + str(index + 2) + ': ' + message for index, message in chunk_errors.items()]
+        inserted += insert(tables)
+        rows += len(chunk)
+        errors += chunk_errors[:MAX_REPORTED_ERRORS - len(errors)]
+        if progress is not None:
+            progress({'chunk': chunk_number, 'rows': rows, 'inserted': inserted, 'errors': chunk_errors, 'fraction': fraction})
+    if rows == inserted:
+        return 'Data uploaded successfully.'
+    return f'Uploaded {inserted} of {rows} rows. ' + ' '.join(errors)
 
-    color_bar = fig.colorbar(scatter, ax=ax, pad=0.1, shrink=0.7, aspect=10)
-    color_bar.set_label(c)
-    #plt.subplots_adjust(left=0.1, right=1.5, top=0.9, bottom=0.1)
-    ax.set_xlabel(x)
-    ax.set_ylabel(y)
-    plt.savefig(file_name)
-    buffer = BytesIO()
-    plt.savefig(buffer, format='png')
-    buffer.seek(0)
-    img_base64 = base64.b64encode(buffer.read()).decode('utf-8')
-    buffer.close()
+def submit_upload(contents, filename):
+    # Runs parse_contents_streaming as a background job and returns its ID for
+    # ingest_jobs.status. Chunks are written by the jobs' shared writer thread.
+    def run(job):
+        return parse_contents_streaming(contents, filename, progress=job.update,
+                                        insert=lambda tables: ingest_jobs.write(insert_tables, tables))
+    return ingest_jobs.submit(run, filename)
 
-    return img_base64
+# Home page helper functions
+def generate_graph(df, file_name, c, x, y, z=None, generation=None, data_key=None):
+    # Rendered once; the file gets the same PNG bytes as the page
+    png = render_service.render(df, c, x, y, z, generation, data_key)
+    if file_name is not None:
+        with open(file_name, 'wb') as file:
+            file.write(png)
+    return base64.b64encode(png).decode('utf-8')
 
 def generate_df(options):
+    # Results are cached until the next write. Callers get their own copy to modify.
+    cached = result_cache.get(options)
+    if cached is not None:
+        return cached.copy()
+    generation = result_cache.generation
+    df = snapshot_df(options, generation)
+    if df is None:
+        df = query_df(options)
+    result_cache.put(options, df, generation)
+    return df.copy()
+
+def snapshot_df(options, generation):
+    # Reads from the Parquet snapshot when it has every write up to generation
+    if not snapshot.fresh(generation):
+        return None
+    df = snapshot.read(options, catalog.table_column_map(), [DEPENDENT_VARIABLE, INDEPENDENT_VARIABLE],
+                       list(ALL_INPUT['Property']), LOGIC)
+    return None if df is None else format_results(df)
+
+def query_df(options):
+    return read_df(*compile_df_query(options))
+
+def compile_df_query(options, key_column=None, lookups=False, count=False):
+    # One query returns the filtered experiments with a column per selected variable
+    return compile_options(options, catalog.table_column_map(), MAIN_NAME, [DEPENDENT_VARIABLE, INDEPENDENT_VARIABLE],
+                           list(ALL_INPUT['Property']), LOGIC, HASH_TABLE, key_column, lookups, count)
+
+def read_df(query, params):
+    return format_results(get_data_from_database(query, params=params))
+
+def format_results(df):
+    # Amounts read from association tables are numbers even when every row is NULL
+    amounts = [current for current in df.columns[1:] if current not in set(ALL_INPUT['Property']) and current != KEY_COLUMN]
+    df[amounts] = df[amounts].astype('float64')
+    return format_df(df)
+
+def format_df(df):
+    column_names = set(df.columns)
+    for index, row in ALL_INPUT.iterrows():
+        if row['Property'] in column_names:
+            current_type = row['Type']
+            df[row['Property']] = df[row['Property']].apply(current_type.displayMethod)
+    df = df.fillna(0)
+    return df
+
+def generate_df_legacy(options):
+    # generate_df before it was compiled to one query, kept to check the compiler against
     dfs = []
     all_ids = get_data_from_database(ALL_IDS)
     merged_ids = []
@@ -208,29 +400,27 @@ def generate_df(options):
             merged_ids.append(merged_id)
     final_ids =  reduce(lambda left, right: pd.merge(left, right, on='ID', how='inner'), merged_ids, all_ids)
     df = reduce(lambda left, right: pd.merge(left, right, on='ID', how='left'), dfs, final_ids)
-    df['ID'] = df['ID'].apply(lambda x: binascii.hexlify(x).decode('utf-8'))
-    column_names = set(df.columns)
-    for index, row in ALL_INPUT.iterrows():
-        if row['Property'] in column_names:
-            current_type = row['Type']
-            df[row['Property']] = df[row['Property']].apply(current_type.displayMethod)
-    df = df.fillna(0)
-    return df
+    hashes = get_data_from_database(f"SELECT ID, lower(hex(Hash)) AS Hash FROM {HASH_TABLE}")
+    df['ID'] = pd.merge(df[['ID']], hashes, on='ID', how='left')['Hash']
+    return format_df(df)
 
     
 
 def graphs(properties, solvents, salts):
-    df = generate_df(properties, solvents, salts)
+    unbounded = {'min': None, 'max': None}
+    options = {DEPENDENT_VARIABLE: dict({LOGIC: 'or'}, **{current: unbounded for current in properties}),
+               'Solvents': dict({LOGIC: 'or'}, **{current: unbounded for current in solvents}),
+               'Salts': dict({LOGIC: 'or'}, **{current: unbounded for current in salts})}
+    generation = result_cache.generation
+    df = generate_df(options)
     cwd = os.getcwd()
     file_dir = os.path.join(cwd, 'Saved Plots')
+    os.makedirs(file_dir, exist_ok=True)
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S") + '-'
 
-    for i in range(len(solvents)):
-        solvents[i] += '_Percentage'
-    for i in range(len(salts)):
-        salts[i] += '_Molality'
-
-    interest = solvents + salts
+    table_column_map = catalog.table_column_map()
+    interest = [f"{current}_{table_column_map['Solvents'][2]}" for current in solvents] + \
+               [f"{current}_{table_column_map['Salts'][2]}" for current in salts]
     if len(interest) < 2:
         return {'base_64':-1}
     x = interest[0]
@@ -242,21 +432,22 @@ def graphs(properties, solvents, salts):
     base64_list = []
     for i in range(len(properties)):
         file_name = now + str(i) + '.png'
-        base64_list.append(generate_graph(df, os.path.join(file_dir, file_name), properties[i], x, y, z))
+        base64_list.append(generate_graph(df, os.path.join(file_dir, file_name), properties[i], x, y, z,
+                                          generation, result_cache.key(options)))
     return {'base_64':base64_list}
 
+def get_column_stats(column):
+    # Count, sum, mean, min and max of a generate_df column over the whole database,
+    # read from the column stats instead of the data
+    return column_stats.lookup(column, catalog.table_column_map(), catalog.names())
+
+def column_bounds(column):
+    # (min, max) of a generate_df column for axis ranges and filter inputs, or None
+    stats = get_column_stats(column)
+    return None if stats is None else (stats['min'], stats['max'])
+
 def get_choices():
-    form_names = get_data_from_database("SELECT name FROM sqlite_master WHERE type = 'table'")['name'].tolist()
-    title_variable_map = {}
-    for current in form_names:
-        if current != MAIN_NAME:
-            query = f"PRAGMA table_info({current})"
-            columns = get_data_from_database(query)
-            table_column_map[current] = list(columns['name'])
-            column_query = f"SELECT DISTINCT {table_column_map[current][1]} FROM {current}"
-            column_items = get_data_from_database(column_query)
-            title_variable_map[current] = list(column_items[table_column_map[current][1]])
-    
+    title_variable_map = catalog.names()
     options = [{"Title":DEPENDENT_VARIABLE, "Options":sorted(PROPERTY['Property'], key=str.lower)},
       {"Title":INDEPENDENT_VARIABLE, "Options":sorted(INPUT['Property'], key=str.lower)}] + [
       {"Title":title, "Options":sorted(options, key=str.lower)} for title, options in title_variable_map.items()]
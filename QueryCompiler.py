@@ -0,0 +1,94 @@
+def quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def range_condition(column, minimum, maximum, params):
+    # Same rules as Pipeline.generate_query: a bound of 0 or None is no bound
+    if minimum and maximum:
+        params += [minimum, maximum]
+        return f"{column} BETWEEN ? AND ?"
+    elif minimum:
+        params.append(minimum)
+        return f"{column} >= ?"
+    elif maximum:
+        params.append(maximum)
+        return f"{column} <= ?"
+    return None
+
+
+def compile_options(options, table_column_map, main_name, main_categories, main_columns, logic, hash_table, key_column=None, lookups=False, count=False):
+    # Compiles the filter form's options into one parameterized query returning what
+    # generate_df used to assemble from two queries per variable and a chain of merges:
+    #   - one column per selected variable, association values pivoted to <name>_<value column>
+    #   - only experiments matching every category, where a category matches if any (or all,
+    #     when its logic is 'and') of its selected variables matches its bounds
+    # The ID column shows the experiment's content hash in hex, looked up for the returned rows only.
+    # With key_column, the integer ID rows are ordered by is returned under that name too.
+    # With lookups, association values are looked up per returned row instead of pivoting whole
+    # tables, which is cheaper when only a page of the rows is read.
+    # With count, the query returns the number of matching experiments instead.
+    # Returns (query, params).
+    select = ["lower(hex(k.Hash)) AS ID"]
+    if key_column:
+        select.append(f"e.ID AS {quote(key_column)}")
+    select_params = []
+    where = []
+    where_params = []
+    pivots = {}
+    for category, variables in options.items():
+        conditions = []
+        joiner = ' AND ' if variables.get(logic) == 'and' else ' OR '
+        for variable, bounds in variables.items():
+            if variable == logic:
+                continue
+            if category in main_categories:
+                if variable not in main_columns:
+                    raise ValueError(f'Unknown variable {variable}')
+                column = "e." + quote(variable)
+                select.append(f"{column} AS {quote(variable)}")
+                condition = range_condition(column, bounds['min'], bounds['max'], where_params)
+                conditions.append(condition or "1")
+            else:
+                if category not in table_column_map:
+                    raise ValueError(f'Unknown table {category}')
+                name_column, value_column = [quote(current) for current in table_column_map[category][1:3]]
+                alias = f"{variable}_{table_column_map[category][2]}"
+                if lookups:
+                    # The unary + keeps the planner on the ID index instead of scanning every row with this name
+                    select.append(f"(SELECT MAX(a.{value_column}) FROM {quote(category)} a "
+                                  f"WHERE a.ID = e.ID AND +a.{name_column} = ?) AS {quote(alias)}")
+                    select_params.append(variable)
+                else:
+                    if category not in pivots:
+                        pivots[category] = (f"p{len(pivots)}", [])
+                    pivots[category][1].append((variable, alias))
+                    select.append(f"{pivots[category][0]}.{quote(alias)} AS {quote(alias)}")
+                # Seek by ID here too; the name and range would scan every matching row per experiment
+                condition = f"+a.{name_column} = ?"
+                where_params.append(variable)
+                bound = range_condition(f"a.{value_column}", bounds['min'], bounds['max'], where_params)
+                if bound:
+                    condition += " AND " + bound
+                conditions.append(f"EXISTS (SELECT 1 FROM {quote(category)} a WHERE a.ID = e.ID AND {condition})")
+        if conditions:
+            where.append("(" + joiner.join(conditions) + ")")
+    where = " WHERE " + " AND ".join(where) if where else ""
+    if count:
+        return f"SELECT COUNT(*) FROM {quote(main_name)} e{where}", where_params
+    joins = []
+    join_params = []
+    for table, (pivot, selected) in pivots.items():
+        name_column, value_column = [quote(current) for current in table_column_map[table][1:3]]
+        columns = []
+        for variable, alias in selected:
+            columns.append(f"MAX(CASE WHEN {name_column} = ? THEN {value_column} END) AS {quote(alias)}")
+            join_params.append(variable)
+        names = ', '.join('?' * len(selected))
+        join_params += [variable for variable, alias in selected]
+        joins.append(f"LEFT JOIN (SELECT ID, {', '.join(columns)} FROM {quote(table)} "
+                     f"WHERE {name_column} IN ({names}) GROUP BY ID) {pivot} ON {pivot}.ID = e.ID")
+    query = f"SELECT {', '.join(select)} FROM {quote(main_name)} e JOIN {quote(hash_table)} k ON k.ID = e.ID"
+    if joins:
+        query += " " + " ".join(joins)
+    query += where + " ORDER BY e.ID"
+    return query, select_params + join_params + where_params
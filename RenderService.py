@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from mpl_toolkits.mplot3d import Axes3D  # registers the 3d projection
+
+MAX_BYTES = 64 * 2 ** 20  # PNGs the cache may hold in total
+
+
+def render_png(df, c, x, y, z=None):
+    # Renders the scatter plot once into PNG bytes. The Figure isn't registered with pyplot,
+    # so nothing keeps it alive once it is cleared here.
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    try:
+        if z is not None:
+            ax = fig.add_subplot(111, projection='3d')
+            scatter = ax.scatter(df[x], df[y], df[z], c=df[c], marker='o')
+            ax.set_zlabel(z)
+        else:
+            ax = fig.add_subplot(111)
+            scatter = ax.scatter(df[x], df[y], c=df[c], marker='o')
+        color_bar = fig.colorbar(scatter, ax=ax, pad=0.1, shrink=0.7, aspect=10)
+        color_bar.set_label(c)
+        ax.set_xlabel(x)
+        ax.set_ylabel(y)
+        buffer = BytesIO()
+        fig.savefig(buffer, format='png')
+        return buffer.getvalue()
+    finally:
+        fig.clear()
+
+
+class RenderService:
+    # LRU cache of rendered PNGs, bounded by their size in bytes. Keys include the data's
+    # generation (see ResultCache), so a write makes every cached image unreachable; those
+    # are dropped on the next render.
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.generation = None
+        self.renders = 0
+        self.hits = 0
+        self.lock = threading.Lock()
+
+    def render(self, df, c, x, y, z=None, generation=None, data_key=None):
+        # data_key names the rows in df (e.g. ResultCache.key of the filter); without it
+        # the image isn't cached
+        key = (data_key, x, y, z, c)
+        with self.lock:
+            if generation != self.generation:
+                self.entries.clear()
+                self.size = 0
+                self.generation = generation
+            if data_key is not None and key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        png = render_png(df, c, x, y, z)
+        with self.lock:
+            self.renders += 1
+            if data_key is None or generation != self.generation or len(png) > self.max_bytes:
+                return png
+            if key not in self.entries:
+                self.entries[key] = png
+                self.size += len(png)
+            while self.size > self.max_bytes:
+                self.size -= len(self.entries.popitem(last=False)[1])
+        return png
+
+    def stats(self):
+        with self.lock:
+            return {'renders': self.renders, 'hits': self.hits, 'entries': len(self.entries),
+                    'bytes': self.size, 'max_bytes': self.max_bytes}
@@ -0,0 +1,80 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+MAX_BYTES = 256 * 2 ** 20  # memory the cached DataFrames may use in total
+
+
+def normalize_options(options, logic):
+    # Filter forms that select the same rows get the same key: categories without a
+    # selected variable are dropped, and a bound of 0 means no bound, as in generate_query
+    normalized = {}
+    for category, variables in options.items():
+        selected = {variable: {'min': bounds['min'] or None, 'max': bounds['max'] or None}
+                    for variable, bounds in variables.items() if variable != logic}
+        if selected:
+            selected[logic] = variables.get(logic)
+            normalized[category] = selected
+    return normalized
+
+
+class ResultCache:
+    # LRU cache of query results, bounded by their size in bytes. Every write to the
+    # database bumps the generation, which drops everything cached before it.
+    def __init__(self, logic, max_bytes=MAX_BYTES):
+        self.logic = logic
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def key(self, options):
+        # Column order in the result follows the form, so key order is kept inside categories
+        canonical = json.dumps(list(normalize_options(options, self.logic).items()), default=str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def get(self, options):
+        key = self.key(options)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, options, df, generation):
+        # generation is the one read before running the query, so a result that raced
+        # with a write is never stored
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        key = self.key(options)
+        with self.lock:
+            if generation != self.generation or size > self.max_bytes:
+                return
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (df, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self.size -= self.entries.popitem(last=False)[1][1]
+                self.evictions += 1
+
+    def bump(self):
+        with self.lock:
+            self.generation += 1
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'invalidations': self.invalidations, 'entries': len(self.entries),
+                    'bytes': self.size, 'max_bytes': self.max_bytes, 'generation': self.generation}
@@ -0,0 +1,336 @@
+import json
+import os
+import threading
+import time
+import uuid
+import numpy as np
+import pandas as pd
+from ConnectionPool import get_connection, transaction
+from Migrations import HASH_TABLE, MAIN_NAME, association_tables, table_columns, user_tables
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+ROWS_PER_GROUP = 50000  # experiments read from SQLite and written per Parquet row group
+MAX_PARTS = 16  # ingests appended before the snapshot is rewritten as one file
+KEY = 'Key'  # the experiment's integer ID
+MANIFEST = 'manifest.json'
+REFRESH_DELAY = 0.5  # seconds without ingests before the snapshot is brought up to date
+
+
+def snapshot_path(db_file):
+    return os.path.splitext(db_file)[0] + '.snapshot'
+
+
+def range_expression(field, minimum, maximum):
+    # Same rules as QueryCompiler.range_condition: a bound of 0 or None is no bound
+    expression = None
+    if minimum:
+        expression = field >= minimum
+    if maximum:
+        expression = field <= maximum if expression is None else expression & (field <= maximum)
+    return expression
+
+
+def compile_filter(options, schema, table_column_map, main_categories, main_columns, logic):
+    # The pyarrow version of QueryCompiler.compile_options.
+    # Returns ([(snapshot column, result column)], filter expression or None).
+    # Association filters test the experiment's (largest) value for the name, which is what
+    # the compiled query's EXISTS tests too unless an experiment lists a name twice.
+    selected = [('ID', 'ID')]
+    expression = None
+    for category, variables in options.items():
+        conditions = []
+        anded = variables.get(logic) == 'and'
+        for variable, bounds in variables.items():
+            if variable == logic:
+                continue
+            if category in main_categories:
+                if variable not in main_columns:
+                    raise ValueError(f'Unknown variable {variable}')
+                selected.append((variable, variable))
+                condition = range_expression(ds.field(variable), bounds['min'], bounds['max'])
+                conditions.append(pc.scalar(True) if condition is None else condition)
+            else:
+                if category not in table_column_map:
+                    raise ValueError(f'Unknown table {category}')
+                alias = f"{variable}_{table_column_map[category][2]}"
+                selected.append((alias, alias))
+                if alias not in schema.names:
+                    # No experiment has this name
+                    conditions.append(pc.scalar(False))
+                    continue
+                condition = ds.field(alias).is_valid()
+                bound = range_expression(ds.field(alias), bounds['min'], bounds['max'])
+                conditions.append(condition if bound is None else condition & bound)
+        if conditions:
+            combined = conditions[0]
+            for condition in conditions[1:]:
+                combined = combined & condition if anded else combined | condition
+            expression = combined if expression is None else expression & combined
+    return selected, expression
+
+
+class Snapshot:
+    # Wide, columnar copy of the database in Parquet: one row per experiment with its hex ID,
+    # its experiment columns and a <name>_<value column> column per association name, the
+    # same layout generate_df returns. Numbers are stored as float64.
+    # It is a directory of parts described by manifest.json. An ingest appends a part with
+    # the experiments whose IDs are above the previous watermark; anything else (edits,
+    # re-ingested experiments, too many parts) rewrites it in full. The manifest records
+    # row counts, so a snapshot left by another process is only used if the counts match.
+    # Ingests only schedule a refresh, which runs on a background thread once they pause;
+    # reads use SQLite until it is done.
+    def __init__(self, db_file, delay=REFRESH_DELAY):
+        self.db_file = db_file
+        self.path = snapshot_path(db_file)
+        self.lock = threading.Lock()
+        self.delay = delay
+        self.condition = threading.Condition()
+        self.pending = None  # generation of the latest ingest not refreshed yet
+        self.due = None
+        self.refreshing = False
+        self.thread = None
+        self.manifest = None
+        self.checked = None  # (generation, whether the snapshot was fresh then)
+        self.builds = 0
+        self.appends = 0
+
+    def load_manifest(self):
+        try:
+            with open(os.path.join(self.path, MANIFEST)) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def write_manifest(self, manifest):
+        temporary = os.path.join(self.path, MANIFEST + '.tmp')
+        with open(temporary, 'w') as file:
+            json.dump(manifest, file)
+        os.replace(temporary, os.path.join(self.path, MANIFEST))
+
+    def fingerprint(self, conn, watermark=None):
+        # Row counts, of the rows up to watermark if given
+        condition = "" if watermark is None else f" WHERE ID <= {int(watermark)}"
+        counts = {'watermark': conn.execute(f"SELECT COALESCE(MAX(ID), 0) FROM {HASH_TABLE}").fetchone()[0],
+                  'experiments': conn.execute(f"SELECT COUNT(*) FROM {MAIN_NAME}{condition}").fetchone()[0],
+                  'associations': {}}
+        for table in association_tables(conn):
+            count = conn.execute(f"SELECT COUNT(*) FROM {table}{condition}").fetchone()[0]
+            if count:
+                counts['associations'][table] = count
+        return counts
+
+    def fresh(self, generation):
+        # Whether reads may use the snapshot; generation is the result cache's, so the
+        # database is only looked at again after a write
+        if pa is None:
+            return False
+        checked = self.checked
+        if checked is not None and checked[0] == generation:
+            return checked[1]
+        # While a refresh holds the lock the snapshot is being rewritten, so reads use SQLite
+        # instead of waiting for it
+        if not self.lock.acquire(blocking=False):
+            return False
+        try:
+            if self.checked is not None and self.checked[0] == generation:
+                return self.checked[1]
+            manifest = self.load_manifest()
+            fresh = False
+            if manifest is not None:
+                conn = get_connection(self.db_file)
+                if HASH_TABLE in user_tables(conn):
+                    fresh = self.fingerprint(conn) == manifest['fingerprint']
+            self.manifest = manifest if fresh else None
+            self.checked = (generation, fresh)
+            return fresh
+        finally:
+            self.lock.release()
+
+    def refresh(self, generation):
+        # Brings the snapshot up to date after an ingest
+        if pa is None:
+            return
+        with self.lock:
+            with transaction(self.db_file, immediate=False) as conn:
+                if MAIN_NAME not in user_tables(conn):
+                    return
+                manifest = self.manifest or self.load_manifest()
+                unchanged = False
+                if manifest is not None and len(manifest['parts']) < MAX_PARTS:
+                    # Appending is only right if nothing up to the old watermark changed
+                    before = manifest['fingerprint']
+                    counts = self.fingerprint(conn, before['watermark'])
+                    unchanged = counts['experiments'] == before['experiments'] and counts['associations'] == before['associations']
+                if unchanged:
+                    manifest = self.append(conn, manifest)
+                else:
+                    manifest = self.rebuild(conn)
+            self.manifest = manifest
+            self.checked = (generation, True)
+
+    def schedule(self, generation):
+        # Refreshes after an ingest, delay seconds after the last of a burst of them
+        with self.condition:
+            self.pending = generation
+            self.due = time.perf_counter() + self.delay
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='snapshot-refresh', daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None or time.perf_counter() < self.due:
+                    self.condition.wait(None if self.pending is None else self.due - time.perf_counter())
+                generation = self.pending
+                self.pending = None
+                self.refreshing = True
+            try:
+                self.refresh(generation)
+            except Exception as e:
+                # The data is committed; reads use SQLite until the snapshot can be written
+                print(f"Could not update the snapshot: {e}")
+                self.invalidate()
+            finally:
+                with self.condition:
+                    self.refreshing = False
+                    self.condition.notify_all()
+
+    def wait(self):
+        # Runs a scheduled refresh now and returns once it is done, e.g. in scripts
+        with self.condition:
+            if self.pending is not None:
+                self.due = time.perf_counter()
+                self.condition.notify_all()
+            while self.pending is not None or self.refreshing:
+                self.condition.wait()
+
+    def invalidate(self):
+        # For writes the snapshot can't follow. The manifest is removed so other processes
+        # don't use it either; the next refresh rewrites the snapshot.
+        with self.lock:
+            self.manifest = None
+            self.checked = None
+            try:
+                os.remove(os.path.join(self.path, MANIFEST))
+            except OSError:
+                pass
+
+    def close(self):
+        # Forgets the in-memory state, e.g. when db_file now names another database. A
+        # scheduled refresh is dropped and one that is running finished first.
+        with self.condition:
+            self.pending = None
+        with self.lock:
+            self.manifest = None
+            self.checked = None
+
+    def names(self, conn, low):
+        # table -> (value column, names of the association rows of experiments above low)
+        names = {}
+        for table in association_tables(conn):
+            name_column, value_column = table_columns(conn, table)[1:3]
+            names[table] = (value_column, [row[0] for row in conn.execute(
+                f"SELECT DISTINCT {name_column} FROM {table} WHERE ID > ? AND {name_column} IS NOT NULL ORDER BY 1", (low,))])
+        return names
+
+    def write_part(self, conn, low, main_columns, names):
+        # Writes the experiments above low to a new part, ROWS_PER_GROUP at a time
+        fields = [pa.field(KEY, pa.int64()), pa.field('ID', pa.string())] + [pa.field(column, pa.float64()) for column in main_columns]
+        for table, (value_column, table_names) in names.items():
+            fields += [pa.field(f"{name}_{value_column}", pa.float64()) for name in table_names]
+        schema = pa.schema(fields)
+        part = f"part-{uuid.uuid4().hex}.parquet"
+        writer = pq.ParquetWriter(os.path.join(self.path, part), schema)
+        try:
+            rows = 0
+            while True:
+                main = pd.read_sql(f"SELECT e.ID AS {KEY}, lower(hex(k.Hash)) AS ID, {', '.join('e.' + column for column in main_columns)} "
+                                   f"FROM {MAIN_NAME} e JOIN {HASH_TABLE} k ON k.ID = e.ID WHERE e.ID > ? ORDER BY e.ID LIMIT ?",
+                                   conn, params=(low, ROWS_PER_GROUP))
+                if main.empty and rows:
+                    break
+                high = int(main[KEY].iloc[-1]) if len(main) else low
+                keys = main[KEY].to_numpy()
+                for table, (value_column, table_names) in names.items():
+                    name_column = table_columns(conn, table)[1]
+                    values = pd.read_sql(f"SELECT ID, {name_column}, {value_column} FROM {table} WHERE ID > ? AND ID <= ?",
+                                         conn, params=(low, high))
+                    wide = values.pivot_table(index='ID', columns=name_column, values=value_column, aggfunc='max').reindex(keys)
+                    for name in table_names:
+                        main[f"{name}_{value_column}"] = wide[name].to_numpy(dtype='float64') if name in wide.columns else np.nan
+                writer.write_table(pa.Table.from_pandas(main, schema=schema, preserve_index=False))
+                rows += len(main)
+                low = high
+                if len(main) < ROWS_PER_GROUP:
+                    break
+        finally:
+            writer.close()
+        return part
+
+    def rebuild(self, conn):
+        os.makedirs(self.path, exist_ok=True)
+        main_columns = table_columns(conn, MAIN_NAME)[1:]
+        names = self.names(conn, 0)
+        manifest = {'parts': [self.write_part(conn, 0, main_columns, names)], 'main': main_columns,
+                    'columns': {table: list(current) for table, current in names.items()},
+                    'fingerprint': self.fingerprint(conn)}
+        self.write_manifest(manifest)
+        # Readers still holding an old manifest fall back to SQLite once its parts are gone
+        for part in os.listdir(self.path):
+            if part.startswith('part-') and part not in manifest['parts']:
+                try:
+                    os.remove(os.path.join(self.path, part))
+                except OSError:
+                    pass
+        self.builds += 1
+        return manifest
+
+    def append(self, conn, old):
+        fingerprint = self.fingerprint(conn)
+        if fingerprint == old['fingerprint']:
+            return old
+        watermark = old['fingerprint']['watermark']
+        names = self.names(conn, watermark)
+        manifest = {'parts': old['parts'] + [self.write_part(conn, watermark, old['main'], names)], 'main': old['main'],
+                    'columns': dict(old['columns']), 'fingerprint': fingerprint}
+        for table, (value_column, table_names) in names.items():
+            known = manifest['columns'].get(table, [value_column, []])[1]
+            manifest['columns'][table] = [value_column, known + [name for name in table_names if name not in set(known)]]
+        self.write_manifest(manifest)
+        self.appends += 1
+        return manifest
+
+    def schema(self, manifest):
+        fields = [pa.field(KEY, pa.int64()), pa.field('ID', pa.string())] + [pa.field(column, pa.float64()) for column in manifest['main']]
+        for table, (value_column, table_names) in manifest['columns'].items():
+            fields += [pa.field(f"{name}_{value_column}", pa.float64()) for name in table_names]
+        return pa.schema(fields)
+
+    def read(self, options, table_column_map, main_categories, main_columns, logic):
+        # The rows generate_df would return, unformatted, or None if the snapshot went away
+        manifest = self.manifest
+        if manifest is None:
+            return None
+        schema = self.schema(manifest)
+        selected, expression = compile_filter(options, schema, table_column_map, main_categories, main_columns, logic)
+        stored = [column for column, alias in selected if column in schema.names]
+        try:
+            dataset = ds.dataset([os.path.join(self.path, part) for part in manifest['parts']], format='parquet', schema=schema)
+            # The filter is pushed down to the row groups' statistics
+            table = dataset.to_table(columns=[KEY] + list(dict.fromkeys(stored)), filter=expression)
+        except OSError:
+            return None
+        df = table.sort_by(KEY).to_pandas()
+        result = pd.DataFrame(index=df.index)
+        for column, alias in selected:
+            result[alias] = df[column] if column in df.columns else np.nan
+        return result
@@ -0,0 +1,43 @@
+import base64
+import io
+import pandas as pd
+
+CHUNK_SIZE = 5000  # CSV rows validated and inserted at a time
+DECODE_BLOCK = 1 << 16  # base64 characters decoded per read
+
+
+class Base64Reader(io.RawIOBase):
+    # File-like view of the base64 payload of a dcc.Upload data URL, decoded lazily
+    def __init__(self, contents):
+        self.contents = contents
+        self.position = contents.index(',') + 1
+        self.pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while len(self.pending) < len(buffer) and self.position < len(self.contents):
+            # Whole groups of 4 characters decode independently of the rest
+            end = self.position + max(DECODE_BLOCK, len(buffer) // 3 * 4 + 4)
+            self.pending += base64.b64decode(self.contents[self.position:end])
+            self.position = end
+        count = min(len(buffer), len(self.pending))
+        buffer[:count] = self.pending[:count]
+        self.pending = self.pending[count:]
+        return count
+
+
+def read_csv_chunks(contents, chunksize=CHUNK_SIZE):
+    # Only one decoded chunk of the upload is held in memory at a time
+    text = io.TextIOWrapper(io.BufferedReader(Base64Reader(contents)), encoding='utf-8')
+    return pd.read_csv(text, chunksize=chunksize)
+
+
+def read_csv_chunks_with_position(contents, chunksize=CHUNK_SIZE):
+    # Like read_csv_chunks, yielding (chunk, fraction of the upload read so far). The
+    # fraction counts what the CSV parser has buffered, so it runs a little ahead.
+    reader = Base64Reader(contents)
+    text = io.TextIOWrapper(io.BufferedReader(reader), encoding='utf-8')
+    for chunk in pd.read_csv(text, chunksize=chunksize):
+        yield chunk, min(1.0, reader.position / len(contents))
@@ -1,7 +1,9 @@
 import datetime
+import numpy as np
 import pandas as pd
 from dash import Dash, dash_table, html, dcc
 import dash_bootstrap_components as dbc
+from CompositionParser import parse_composition_id
 def getverifyNumberFunction(min, max, integer=False):
     def result(property, number):
         if not isinstance(number, (int, float)):
@@ -15,44 +17,44 @@ def getverifyNumberFunction(min, max, integer=False):
         return number
     return result
 
-def verifyCompositionID(property, str):
-    # Check compositionID
-    error_comp_id = 'Please enter a valid composition ID.'
-    splitted_string = str.split('|')
-    if len(splitted_string) != 4:
-        return error_comp_id
-    solvents = splitted_string[0].split('_')
-    percentage = splitted_string[1].split('_')
-    if len(solvents) != len(percentage):
-        return error_comp_id
-    for current in solvents:
-        if len(current) <= 0 or not (current[0].isupper() and current.isalnum()):
-            return error_comp_id
-    for i in range(len(percentage)):
-        try:
-            percentage[i] = float(percentage[i])
-        except ValueError:
-            return error_comp_id
-        if percentage[i] <= 0:
-            return error_comp_id
-    if abs(sum(percentage) - 100) > 1E-10:
-           return 'Percentages of solvents must sum up to 100.'
+def getverifyNumberColumnFunction(min, max, integer=False):
+    # Column version of getverifyNumberFunction, with the same messages
+    def result(property, series):
+        numbers = series
+        whole = np.full(len(series), pd.api.types.is_integer_dtype(series))
+        not_number = np.zeros(len(series), dtype=bool)
+        if not pd.api.types.is_numeric_dtype(series):
+            # Cells are checked one by one like in getverifyNumberFunction, so text fails
+            # even where it reads as a number
+            not_number = ~series.map(lambda cell: isinstance(cell, (int, float))).to_numpy(dtype=bool)
+            whole = series.map(lambda cell: isinstance(cell, int)).to_numpy(dtype=bool)
+            numbers = pd.to_numeric(series.where(~not_number), errors='coerce')
+        values = numbers.to_numpy()
+        below = ~not_number & (values < min)
+        above = ~not_number & ~below & (values > max)
+        error_mask = not_number | below | above
+        messages = np.full(len(values), None, dtype=object)
+        messages[not_number] = f'{property} must be a number!'
+        messages[below] = f'{property} must be greater than {min}!'
+        messages[above] = f'{property} must be less than {max}!'
+        if integer:
+            # Floats fail even when whole, e.g. a Trial column read as float because of an
+            # empty cell, as the scalar check requires an int
+            not_integer = ~error_mask & ~whole
+            messages[not_integer] = f'{property} must be integer!'
+            error_mask |= not_integer
+            if values.dtype.kind == 'f':
+                values = np.where(error_mask, 0, values).astype(np.int64)
+        return values, error_mask, messages
+    return result
 
-    salts = splitted_string[2].split('_')
-    molality = splitted_string[3].split('_')
-    if len(salts) != len(molality):
-        return error_comp_id
-    for current in salts:
-        if len(current) <= 0 or not (current[0].isupper() and current.isalnum()):
-            return error_comp_id
-    for i in range(len(molality)):
-        try:
-            molality[i] = float(molality[i])
-        except ValueError:
-            return error_comp_id
-        if percentage[i] <= 0:
-            return error_comp_id
-    return {'Solvents': {'solvent':solvents, 'percentage':percentage}, 'Salts': {'salt':salts, 'molality':molality}}
+def verifyCompositionID(property, composition_id):
+    # Check compositionID, see CompositionParser for the rules
+    parsed = parse_composition_id(composition_id)
+    if isinstance(parsed, str):
+        return parsed
+    (solvents, percentage), (salts, molality) = parsed
+    return {'Solvents': {'solvent':list(solvents), 'percentage':list(percentage)}, 'Salts': {'salt':list(salts), 'molality':list(molality)}}
 
 def getVerifyDateFunction(allowed_formats):
     def verifyDate(property, date_string):
@@ -67,6 +69,36 @@ def getVerifyDateFunction(allowed_formats):
         return f'{property} must be in MM/DD/YY format!'
     return verifyDate
 
+def getVerifyDateColumnFunction(allowed_formats):
+    # Column version of getVerifyDateFunction. Each distinct string is parsed once,
+    # trying the formats in order like the scalar version does.
+    verifyDate = getVerifyDateFunction(allowed_formats)
+    def verifyDates(property, series):
+        codes, uniques = pd.factorize(series, use_na_sentinel=False)
+        uniques = pd.Series(uniques, dtype=object)
+        days = np.zeros(len(uniques), dtype=np.int64)
+        is_string = uniques.map(lambda value: isinstance(value, str)).to_numpy(dtype=bool)
+        remaining = is_string.copy()
+        epoch = pd.Timestamp(1970, 1, 1)
+        for input_format in allowed_formats:
+            parsed = pd.to_datetime(uniques[remaining], format=input_format, errors='coerce')
+            matched = parsed.notna()
+            days[matched.index[matched]] = (parsed[matched] - epoch).dt.days
+            remaining[matched.index[matched]] = False
+        unique_errors = ~is_string
+        unique_messages = np.full(len(uniques), None, dtype=object)
+        unique_messages[unique_errors] = f'{property} must be in MM/DD/YY format!'
+        for i in np.flatnonzero(remaining):
+            # pandas can't represent some dates strptime accepts (e.g. year 24 read with %Y)
+            result = verifyDate(property, uniques[i])
+            if isinstance(result, str):
+                unique_errors[i] = True
+                unique_messages[i] = result
+            else:
+                days[i] = result
+        return days[codes], unique_errors[codes], unique_messages[codes]
+    return verifyDates
+
 def getNumberInput(id):
     return dcc.Input(id=id, type='number', value=None), 'value'
 
@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+FLUSH_INTERVAL = 0  # seconds a submission waits for others; those arriving during a commit join the next batch anyway
+MAX_ROWS = 1000  # submissions written per transaction
+HISTORY = 1000  # batches the metrics are computed over
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class WriteBuffer:
+    # Group commit for single submissions (the Add Data form): submissions from every session
+    # are collected and written together in one transaction once MAX_ROWS are waiting or the
+    # oldest has waited FLUSH_INTERVAL. put's future resolves after the batch is committed.
+    # flush(items) writes a batch and may return a result per item, which the item's future
+    # resolves to (True otherwise); write(function, *args) runs it, e.g. on the ingest writer thread.
+    def __init__(self, flush, write=None, flush_interval=FLUSH_INTERVAL, max_rows=MAX_ROWS):
+        self.flush = flush
+        self.write = write if write is not None else lambda function, *args: function(*args)
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.pending = []
+        self.condition = threading.Condition()
+        self.thread = None
+        self.batch_sizes = deque(maxlen=HISTORY)
+        self.commit_times = deque(maxlen=HISTORY)
+        self.wait_times = deque(maxlen=HISTORY)
+        self.batches = 0
+        self.rows = 0
+        self.failures = 0
+
+    def put(self, item):
+        future = Future()
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='write-buffer', daemon=True)
+                self.thread.start()
+            self.pending.append((item, future, time.perf_counter()))
+            self.condition.notify()
+        return future
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                deadline = self.pending[0][2] + self.flush_interval
+                while len(self.pending) < self.max_rows and time.perf_counter() < deadline:
+                    self.condition.wait(deadline - time.perf_counter())
+                batch = self.pending[:self.max_rows]
+                self.pending = self.pending[self.max_rows:]
+            self.commit(batch)
+
+    def commit(self, batch):
+        start = time.perf_counter()
+        try:
+            results = self.write(self.flush, [item for item, future, submitted in batch])
+        except Exception as e:
+            self.failures += 1
+            for item, future, submitted in batch:
+                future.set_exception(e)
+            return
+        end = time.perf_counter()
+        self.batches += 1
+        self.rows += len(batch)
+        self.batch_sizes.append(len(batch))
+        self.commit_times.append(end - start)
+        self.wait_times.extend(end - submitted for item, future, submitted in batch)
+        if results is None:
+            results = [True] * len(batch)
+        for (item, future, submitted), result in zip(batch, results):
+            future.set_result(result)
+
+    def metrics(self):
+        # Commit latency is the batch's transaction; wait is from put until it was committed
+        commits = list(self.commit_times)
+        waits = list(self.wait_times)
+        sizes = list(self.batch_sizes)
+        milliseconds = lambda value: None if value is None else value * 1000
+        return {'batches': self.batches, 'rows': self.rows, 'failures': self.failures,
+                'mean_batch_size': sum(sizes) / len(sizes) if sizes else None, 'max_batch_size': max(sizes, default=None),
+                'commit_ms_p50': milliseconds(percentile(commits, 0.5)), 'commit_ms_p95': milliseconds(percentile(commits, 0.95)),
+                'wait_ms_p50': milliseconds(percentile(waits, 0.5)), 'wait_ms_p95': milliseconds(percentile(waits, 0.95))}